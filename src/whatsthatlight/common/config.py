@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# Local imports
+import mapping
+
 # Client section
 CLIENT_SECTION = 'client'
 CLIENT_ADDRESS_OPTION = 'address'
@@ -22,6 +25,8 @@ CLIENT_USERNAME_OPTION = 'username'
 CLIENT_USERNAME_DEFAULT = ''
 CLIENT_REGISTRATION_RETRY_PERIOD_OPTION = 'registration_retry_period'
 CLIENT_REGISTRATION_RETRY_PERIOD_DEFAULT = 5
+CLIENT_LISTENER_CLASS_OPTION = 'listener_class'
+CLIENT_LISTENER_CLASS_DEFAULT = 'Listener'
 
 # Server section
 SERVER_SECTION = 'server'
@@ -48,6 +53,12 @@ DEVICE_USB_PROTOCOL_OPTION = 'usb_protocol'
 DEVICE_USB_PROTOCOL_DEFAULT = 'DasBlinkenLichten'
 DEVICE_USB_TRANSFER_OPTION = 'usb_transfer_mode'
 DEVICE_USB_TRANSFER_DEFAULT = 'Raw'
+DEVICE_COMMAND_TTL_OPTION = 'command_ttl'
+DEVICE_COMMAND_TTL_DEFAULT = 5
+DEVICE_PIPELINE_WINDOW_OPTION = 'pipeline_window'
+DEVICE_PIPELINE_WINDOW_DEFAULT = 1
+DEVICE_PATH_OPTION = 'path'
+DEVICE_PATH_DEFAULT = None
 
 # Monitor section
 MONITOR_SECTION = 'monitor'
@@ -55,6 +66,14 @@ MONITOR_CLASS_OPTION = 'class'
 MONITOR_CLASS_DEFAULT = 'PyUdevDeviceMonitor'
 MONITOR_POLLING_PERIOD_OPTION = 'polling_period'
 MONITOR_POLLING_PERIOD_DEFAULT = 1
+MONITOR_UDEV_TAG_OPTION = 'udev_tag'
+MONITOR_UDEV_TAG_DEFAULT = None
+
+# Mapping section: <light state>=<led>:<led state>,..., optionally overridden
+# for a blink(1) by blink1_<light state>=..., and colour_<led>=<r>,<g>,<b>
+MAPPING_SECTION = 'mapping'
+MAPPING_BLINK1_PREFIX = 'blink1_'
+MAPPING_COLOUR_PREFIX = 'colour_'
 
 # Logger section
 LOGGER_SECTION = 'logger'
@@ -170,6 +189,33 @@ class Config:
                                 DEVICE_CLASS_OPTION,
                                 DEVICE_CLASS_DEFAULT)
 
+    def get_command_ttl(self):
+        '''
+        Get the period in seconds after which a device command that could
+        not be sent yet is dropped.
+        '''
+        return self._get_int(DEVICE_SECTION,
+                             DEVICE_COMMAND_TTL_OPTION,
+                             DEVICE_COMMAND_TTL_DEFAULT)
+
+    def get_pipeline_window(self):
+        '''
+        Get the number of RAW frames to send to the device before receiving
+        their acks.
+        '''
+        return self._get_int(DEVICE_SECTION,
+                             DEVICE_PIPELINE_WINDOW_OPTION,
+                             DEVICE_PIPELINE_WINDOW_DEFAULT)
+
+    def get_device_path(self):
+        '''
+        Get the node of a hidraw device, or None to find it by its VID and
+        PID.
+        '''
+        return self._get_string(DEVICE_SECTION,
+                                DEVICE_PATH_OPTION,
+                                DEVICE_PATH_DEFAULT)
+
     def get_device_monitor_class(self):
         '''
         Get the device monitor class to use.
@@ -186,6 +232,15 @@ class Config:
                              MONITOR_POLLING_PERIOD_OPTION,
                              MONITOR_POLLING_PERIOD_DEFAULT)
 
+    def get_udev_tag(self):
+        '''
+        Get the udev tag of the devices that the pyudev device monitor
+        receives the events of; None (or empty) for all USB devices.
+        '''
+        return self._get_string(MONITOR_SECTION,
+                                MONITOR_UDEV_TAG_OPTION,
+                                MONITOR_UDEV_TAG_DEFAULT)
+
     def get_registration_retry_period(self):
         '''
         Get the registration retry period when registering with the
@@ -195,6 +250,41 @@ class Config:
                              CLIENT_REGISTRATION_RETRY_PERIOD_OPTION,
                              CLIENT_REGISTRATION_RETRY_PERIOD_DEFAULT)
 
+    def get_listener_class(self):
+        '''
+        Get the listener class to use for receiving notifications.
+        '''
+        return self._get_string(CLIENT_SECTION,
+                                CLIENT_LISTENER_CLASS_OPTION,
+                                CLIENT_LISTENER_CLASS_DEFAULT)
+
+    def get_mapping(self):
+        '''
+        Get the mapping from requests to lights. Unlike other options, an
+        invalid mapping raises a mapping.InvalidMappingException.
+        '''
+        leds = {}
+        blink1_leds = {}
+        colours = {}
+        if self._config_parser.has_section(MAPPING_SECTION):
+            for (option, value) in self._config_parser.items(MAPPING_SECTION):
+                if option.startswith(MAPPING_COLOUR_PREFIX):
+                    led = option[len(MAPPING_COLOUR_PREFIX):]
+                    colours[led] = mapping.parse_colour(value)
+                    continue
+                if option.startswith(MAPPING_BLINK1_PREFIX):
+                    state = option[len(MAPPING_BLINK1_PREFIX):]
+                    leds_by_state = blink1_leds
+                else:
+                    state = option
+                    leds_by_state = leds
+                if not state in mapping.STATES:
+                    raise mapping.InvalidMappingException('Invalid light '
+                                                          'state: {0}'.
+                                                          format(option))
+                leds_by_state[state] = mapping.parse_leds(value)
+        return mapping.Mapping(leds, blink1_leds, colours)
+
     def _get_int(self, section, option, default):
         '''
         Get an int.
@@ -0,0 +1,53 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+class FrameBuffer(object):
+    '''
+    A preallocated frame, reused for every command sent to a device: the
+    command is copied into it in place and padded with nulls to the packet
+    size, so that sending a command allocates no new frame.
+    '''
+
+    def __init__(self, size):
+        '''
+        Constructor.
+        :param size: the frame size in bytes, i.e. the device's packet size
+        '''
+        self._frame = bytearray(size)
+        self._nulls = memoryview(bytearray(size))
+        self._length = 0
+
+    def get_size(self):
+        '''
+        Get the frame size in bytes.
+        '''
+        return len(self._frame)
+
+    def fill(self, command):
+        '''
+        Copy a command into the frame, padded with nulls, and get the frame.
+        The frame is only valid until filled again.
+        :param command: a device command, no longer than the frame
+        '''
+        length = len(command)
+        if length > len(self._frame):
+            raise ValueError('Command of {0} bytes exceeds the {1} byte frame'.
+                             format(length, len(self._frame)))
+        self._frame[0:length] = command
+        if length < self._length:
+            # Only the previous command's tail needs to be nulled again
+            self._frame[length:self._length] = self._nulls[length:self._length]
+        self._length = length
+        return self._frame
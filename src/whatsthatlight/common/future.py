@@ -0,0 +1,130 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import threading
+
+
+class FutureTimeoutException(Exception):
+    '''
+    Exception raised when a future is not done in time.
+    '''
+
+    def __init__(self, message):
+        '''
+        Constructor.
+        :param message: the message explaining the exception
+        '''
+        self.message = message
+
+
+class Future(object):
+    '''
+    The result of work done on another thread, once done. A future is done
+    only once; results set after that are ignored.
+    '''
+
+    def __init__(self):
+        '''
+        Constructor.
+        '''
+        self._done_event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def set_result(self, result):
+        '''
+        Set the result and mark the future as done.
+        :param result: the result
+        '''
+        self._set_done(result, None)
+
+    def set_exception(self, exception):
+        '''
+        Set the exception raised instead of a result and mark the future as
+        done.
+        :param exception: the exception
+        '''
+        self._set_done(None, exception)
+
+    def done(self):
+        '''
+        Check whether the future is done.
+        '''
+        return self._done_event.is_set()
+
+    def result(self, timeout=None):
+        '''
+        Wait for the result. The exception raised instead, if any, is raised
+        again.
+        :param timeout: the period in seconds to wait; forever if None
+        '''
+        if not self._done_event.wait(timeout):
+            raise FutureTimeoutException('Not done after {0} second(s)'.
+                                         format(timeout))
+        if not self._exception is None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        '''
+        Wait for the exception raised instead of a result, if any.
+        :param timeout: the period in seconds to wait; forever if None
+        '''
+        if not self._done_event.wait(timeout):
+            raise FutureTimeoutException('Not done after {0} second(s)'.
+                                         format(timeout))
+        return self._exception
+
+    def add_done_callback(self, callback):
+        '''
+        Add a method to invoke with the future once done. If already done, it
+        is invoked immediately.
+        :param callback: a method taking the future
+        '''
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _set_done(self, result, exception):
+        '''
+        Mark the future as done, unless done already, and invoke the
+        callbacks.
+        :param result: the result
+        :param exception: the exception raised instead of a result
+        '''
+        with self._lock:
+            if self.done():
+                return
+            self._result = result
+            self._exception = exception
+            self._done_event.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+
+def completed(result):
+    '''
+    Get a future that is done already.
+    :param result: the result
+    '''
+    future = Future()
+    future.set_result(result)
+    return future
@@ -0,0 +1,91 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import collections
+import threading
+
+
+class LightState(object):
+    '''
+    The desired state of a device's lights. Every light state requested is
+    merged into it, so that only the lights that actually change need to be
+    written to the device. It counts the writes suppressed.
+    '''
+
+    def __init__(self, light_mapping, usb_protocol_type):
+        '''
+        Constructor.
+        :param light_mapping: the mapping.Mapping from light states to lights
+        :param usb_protocol_type: the USB protocol used to communicate
+        '''
+        self._mapping = light_mapping
+        self._usb_protocol_type = usb_protocol_type
+        self._fragments = collections.OrderedDict()
+        self._stale = False
+        self._lock = threading.Lock()
+        self._suppressed_writes = 0
+        self._suppressed_fragments = 0
+
+    def update(self, state, force=False):
+        '''
+        Merge a light state and get the (command, channels) tuple that writes
+        the lights that changed; the command is None if nothing changed.
+        :param state: a mapping light state
+        :param force: write all the state's lights, even if unchanged
+        '''
+        fragments = self._mapping.get_fragments(state, self._usb_protocol_type)
+        with self._lock:
+            changed = [(channel, fragment) for (channel, fragment) in fragments
+                       if force or self._fragments.get(channel) != fragment]
+            self._fragments.update(changed)
+            if self._stale and len(fragments) > 0:
+                # Write all the lights, since the device may show anything
+                changed = self._fragments.items()
+                self._stale = False
+            else:
+                self._suppressed_fragments += len(fragments) - len(changed)
+                if len(changed) == 0 and len(fragments) > 0:
+                    self._suppressed_writes += 1
+        command = self._mapping.join(changed, self._usb_protocol_type)
+        return (command, frozenset([channel for (channel, _) in changed]))
+
+    def reset(self):
+        '''
+        Forget that the lights were written, e.g. when the device was
+        removed, so that the next update writes all the lights.
+        '''
+        with self._lock:
+            self._stale = True
+
+    def get_command(self):
+        '''
+        Get the command that writes all the lights, or None if none were
+        set.
+        '''
+        with self._lock:
+            fragments = self._fragments.items()
+        return self._mapping.join(fragments, self._usb_protocol_type)
+
+    def get_suppressed_writes(self):
+        '''
+        Get the number of updates that needed no device write at all.
+        '''
+        return self._suppressed_writes
+
+    def get_suppressed_fragments(self):
+        '''
+        Get the number of unchanged lights left out of device writes.
+        '''
+        return self._suppressed_fragments
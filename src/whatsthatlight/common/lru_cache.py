@@ -0,0 +1,88 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import collections
+import threading
+
+
+class LruCache(object):
+    '''
+    A bounded, thread-safe cache that evicts the least recently used entry
+    when full. It counts hits and misses.
+    '''
+
+    def __init__(self, capacity):
+        '''
+        Constructor.
+        :param capacity: the maximum number of entries
+        '''
+        self._capacity = capacity
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, default=None):
+        '''
+        Get the value for a key and mark it as most recently used.
+        :param key: the key
+        :param default: the value to return if the key is not cached
+        '''
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self._misses += 1
+                return default
+            self._entries[key] = value
+            self._hits += 1
+            return value
+
+    def put(self, key, value):
+        '''
+        Cache a value, evicting the least recently used entry if full.
+        :param key: the key
+        :param value: the value
+        '''
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        '''
+        Remove all entries.
+        '''
+        with self._lock:
+            self._entries.clear()
+
+    def get_hits(self):
+        '''
+        Get the number of lookups that found a value.
+        '''
+        return self._hits
+
+    def get_misses(self):
+        '''
+        Get the number of lookups that found nothing.
+        '''
+        return self._misses
+
+    def __len__(self):
+        '''
+        Get the number of entries.
+        '''
+        return len(self._entries)
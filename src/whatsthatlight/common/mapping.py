@@ -0,0 +1,360 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Local imports
+import fields
+import led_states
+import packets
+import priorities
+import request_types
+import usb_protocol_types
+from requests import InvalidRequestException
+
+# Light states, i.e. what a request can ask the lights to show
+STATUS_DOWN = 'status_down'
+BUILD_ACTIVE = 'build_active'
+BUILD_INACTIVE = 'build_inactive'
+ATTENTION_NONE = 'attention_none'
+ATTENTION_REQUIRED = 'attention_required'
+ATTENTION_PRIORITY = 'attention_priority'
+STATES = [STATUS_DOWN,
+          BUILD_ACTIVE,
+          BUILD_INACTIVE,
+          ATTENTION_NONE,
+          ATTENTION_REQUIRED,
+          ATTENTION_PRIORITY]
+
+# The LEDs to set for every light state. If status is down, switch on all
+# LEDs. An up request is not allowed, since it does not make any sense:
+# When up, the client must register and the notification server must send
+# the latest state for the user.
+DEFAULT_LEDS = {STATUS_DOWN: [(fields.RED_LED, led_states.ON),
+                              (fields.GREEN_LED, led_states.ON),
+                              (fields.YELLOW_LED, led_states.ON)],
+                BUILD_ACTIVE: [(fields.YELLOW_LED, led_states.ON)],
+                BUILD_INACTIVE: [(fields.YELLOW_LED, led_states.OFF)],
+                ATTENTION_NONE: [(fields.RED_LED, led_states.OFF),
+                                 (fields.GREEN_LED, led_states.ON)],
+                ATTENTION_REQUIRED: [(fields.RED_LED, led_states.ON),
+                                     (fields.GREEN_LED, led_states.OFF)],
+                ATTENTION_PRIORITY: [(fields.RED_LED, led_states.SOS),
+                                     (fields.GREEN_LED, led_states.OFF)]}
+
+# A blink(1) has a single RGB LED, so it cannot show all LEDs at once
+DEFAULT_BLINK1_LEDS = {STATUS_DOWN: [(fields.BLUE_LED, led_states.ON)]}
+
+# The (red, green, blue) colour for showing a LED on an RGB LED
+DEFAULT_COLOURS = {fields.RED_LED: (255, 0, 0),
+                   fields.GREEN_LED: (0, 255, 0),
+                   fields.BLUE_LED: (0, 0, 255),
+                   fields.YELLOW_LED: (255, 150, 0)}
+
+# How urgently the lights must show a light state: a broken build or a
+# server that is down must not wait for build activity
+PRIORITIES = {STATUS_DOWN: priorities.HIGH,
+              ATTENTION_PRIORITY: priorities.HIGH,
+              ATTENTION_REQUIRED: priorities.NORMAL,
+              ATTENTION_NONE: priorities.NORMAL,
+              BUILD_ACTIVE: priorities.LOW,
+              BUILD_INACTIVE: priorities.LOW}
+
+# The LEDs that can be configured
+_LEDS = [fields.RED_LED, fields.GREEN_LED, fields.BLUE_LED, fields.YELLOW_LED]
+
+# Separators for the configured values, e.g. red:on,green:off and 255,0,0
+_PAIR_SEPARATOR = ','
+_LED_STATE_SEPARATOR = ':'
+_COLOUR_SEPARATOR = ','
+
+# blink(1) fade time: 1 second divided by 10
+_BLINK1_FADE_MILLIS = 1000 / 10
+
+# A blink(1) only has one LED (at index 0)
+_BLINK1_LED_NUMBER = 0
+
+
+class InvalidMappingException(Exception):
+    '''
+    Exception raised when a mapping is invalid.
+    '''
+
+    def __init__(self, message):
+        '''
+        Constructor.
+        :param message: the message explaining the exception
+        '''
+        self.message = message
+
+
+class Mapping(object):
+    '''
+    A mapping from requests to lights. The mapping is compiled into a table of
+    device commands per USB protocol, so that translating a request is a
+    lookup.
+    '''
+
+    def __init__(self, leds=None, blink1_leds=None, colours=None):
+        '''
+        Constructor.
+        :param leds: the (LED, LED state) pairs by light state; overrides the
+                     defaults
+        :param blink1_leds: the (LED, LED state) pairs by light state for a
+                            blink(1); overrides the above
+        :param colours: the (red, green, blue) colours by LED; overrides the
+                        defaults
+        '''
+        self._leds = dict(DEFAULT_LEDS)
+        self._leds.update(leds or {})
+        self._blink1_leds = dict(self._leds)
+        self._blink1_leds.update(DEFAULT_BLINK1_LEDS)
+        self._blink1_leds.update(blink1_leds or {})
+        self._colours = dict(DEFAULT_COLOURS)
+        self._colours.update(colours or {})
+        self._fragments = {usb_protocol_types.DAS_BLINKENLICHTEN:
+                           self._compile(self._leds,
+                                         _assemble_led_fragments),
+                           usb_protocol_types.BLINK1:
+                           self._compile(self._blink1_leds,
+                                         self._assemble_blink1_fragments)}
+        self._joins = {usb_protocol_types.DAS_BLINKENLICHTEN:
+                       _join_led_fragments,
+                       usb_protocol_types.BLINK1:
+                       _join_blink1_fragments}
+        self._commands = {}
+        for (usb_protocol_type, fragments) in self._fragments.items():
+            self._commands[usb_protocol_type] = dict(
+                (state, self.join(fragments[state], usb_protocol_type))
+                for state in STATES)
+
+    def get_usb_protocol_types(self):
+        '''
+        Get the USB protocols that commands were compiled for.
+        '''
+        return self._commands.keys()
+
+    def get_leds(self, state, usb_protocol_type):
+        '''
+        Get the (LED, LED state) pairs for a light state.
+        :param state: a light state
+        :param usb_protocol_type: a usb_protocol_types member
+        '''
+        if usb_protocol_type == usb_protocol_types.BLINK1:
+            return self._blink1_leds[state]
+        return self._leds[state]
+
+    def get_command(self, state, usb_protocol_type):
+        '''
+        Get the device command for a light state.
+        :param state: a light state
+        :param usb_protocol_type: a usb_protocol_types member
+        '''
+        return self._commands[usb_protocol_type][state]
+
+    def get_fragments(self, state, usb_protocol_type):
+        '''
+        Get the (channel, command fragment) pairs for a light state, where a
+        channel is a light that the device sets independently.
+        :param state: a light state
+        :param usb_protocol_type: a usb_protocol_types member
+        '''
+        return self._fragments[usb_protocol_type][state]
+
+    def join(self, fragments, usb_protocol_type):
+        '''
+        Join (channel, command fragment) pairs into a device command. There
+        is no command without any fragments.
+        :param fragments: a list of (channel, command fragment) pairs
+        :param usb_protocol_type: a usb_protocol_types member
+        '''
+        if len(fragments) == 0:
+            return None
+        return self._joins[usb_protocol_type](fragments)
+
+    def get_translator(self, request_type, usb_protocol_type):
+        '''
+        Get a method that translates a type of request into a device command.
+        :param request_type: one of REQUEST_TYPES
+        :param usb_protocol_type: a usb_protocol_types member
+        '''
+        commands = self._commands[usb_protocol_type]
+        select_state = _STATE_SELECTORS[request_type]
+
+        def _translate(request):
+            return commands[select_state(request)]
+        return _translate
+
+    def _compile(self, leds, assemble):
+        '''
+        Compile the command fragments for every light state.
+        :param leds: the (LED, LED state) pairs by light state
+        :param assemble: a method assembling pairs into fragments
+        '''
+        return dict((state, assemble(leds[state])) for state in STATES)
+
+    def _assemble_blink1_fragments(self, pairs):
+        '''
+        Assemble the fragments of a blink(1) command, i.e. a single fragment
+        for its single RGB LED, if any.
+        :param pairs: a list of (LED, LED state) pairs
+        '''
+        command = self._assemble_blink1_command(pairs)
+        if command is None:
+            return []
+        return [(_BLINK1_LED_NUMBER, command)]
+
+    def _assemble_blink1_command(self, pairs):
+        '''
+        Assemble a blink(1) command from (LED, LED state) pairs. Having only a
+        single RGB LED, the first LED that is on determines the colour. There
+        is no way to treat the SOS state yet, other than on. If no LED is on,
+        there is no command.
+        :param pairs: a list of (LED, LED state) pairs
+        '''
+        leds_on = [led for (led, led_state) in pairs
+                   if led_state in [led_states.ON, led_states.SOS]]
+        if len(leds_on) == 0:
+            return None
+        if not leds_on[0] in self._colours:
+            raise InvalidMappingException('No colour for LED {0}'.
+                                          format(leds_on[0]))
+        (red, green, blue) = self._colours[leds_on[0]]
+        th = (_BLINK1_FADE_MILLIS & 0xff00) >> 8
+        tl = _BLINK1_FADE_MILLIS & 0x00ff
+        # 0x63 = 'c' => fade to RGB
+        # 0x6E = 'n' => set to RGB
+        return [0x01, 0x63, red, green, blue, th, tl, _BLINK1_LED_NUMBER]
+
+
+def _get_status_state(request):
+    '''
+    Get the light state for a StatusRequest.
+    :param request: a StatusRequest
+    '''
+    if request.is_up():
+        raise InvalidRequestException('Only a client or server down '
+                                      'request can be translated')
+    return STATUS_DOWN
+
+
+def _get_build_active_state(request):
+    '''
+    Get the light state for a BuildActiveRequest.
+    :param request: a BuildActiveRequest
+    '''
+    if request.is_build_active():
+        return BUILD_ACTIVE
+    return BUILD_INACTIVE
+
+
+def _get_attention_state(request):
+    '''
+    Get the light state for an AttentionRequest.
+    :param request: an AttentionRequest
+    '''
+    if request.is_required() and request.is_priority():
+        return ATTENTION_PRIORITY
+    elif request.is_required():
+        return ATTENTION_REQUIRED
+    return ATTENTION_NONE
+
+
+# Light state selectors by request type
+_STATE_SELECTORS = {request_types.SERVER_STATUS: _get_status_state,
+                    request_types.BUILD_ACTIVE: _get_build_active_state,
+                    request_types.ATTENTION: _get_attention_state}
+REQUEST_TYPES = _STATE_SELECTORS.keys()
+
+
+def get_state(request):
+    '''
+    Get the light state a request asks for.
+    :param request: a request of type BaseRequest
+    '''
+    get_type = getattr(request, 'get_type', None)
+    request_type = request_types.UNKNOWN if get_type is None else get_type()
+    if not request_type in _STATE_SELECTORS:
+        raise InvalidRequestException('Cannot translate a request of type {0}'.
+                                      format(type(request)))
+    return _STATE_SELECTORS[request_type](request)
+
+
+def get_priority(state):
+    '''
+    Get the priority of writing a light state to the device.
+    :param state: a light state
+    '''
+    return PRIORITIES[state]
+
+
+def parse_leds(value):
+    '''
+    Parse configured (LED, LED state) pairs, e.g. red:on,green:off.
+    :param value: the configured string
+    '''
+    pairs = []
+    for pair in value.split(_PAIR_SEPARATOR):
+        try:
+            (led, led_state) = [part.strip() for part in
+                                pair.split(_LED_STATE_SEPARATOR)]
+        except ValueError:
+            raise InvalidMappingException('Invalid LED state: {0}'.
+                                          format(pair))
+        if not led in _LEDS:
+            raise InvalidMappingException('Invalid LED: {0}'.format(pair))
+        if not led_state in [led_states.ON, led_states.OFF, led_states.SOS]:
+            raise InvalidMappingException('Invalid LED state: {0}'.
+                                          format(pair))
+        pairs.append((led, led_state))
+    return pairs
+
+
+def parse_colour(value):
+    '''
+    Parse a configured (red, green, blue) colour, e.g. 255,150,0.
+    :param value: the configured string
+    '''
+    try:
+        colour = tuple(int(part) for part in value.split(_COLOUR_SEPARATOR))
+    except ValueError:
+        raise InvalidMappingException('Invalid colour: {0}'.format(value))
+    if not len(colour) == 3 or not all(0 <= c <= 255 for c in colour):
+        raise InvalidMappingException('Invalid colour: {0}'.format(value))
+    return colour
+
+
+def _assemble_led_fragments(pairs):
+    '''
+    Assemble the fragments of a LED command from (LED, LED state) pairs, e.g.
+      [(red, red=on\n), (green, green=off\n)]
+    :param pairs: a list of (LED, LED state) pairs
+    '''
+    return [(led, packets.FIELD_SEPARATOR.join([led, led_state]) +
+             packets.ALT_TERMINATOR) for (led, led_state) in pairs]
+
+
+def _join_led_fragments(fragments):
+    '''
+    Join the fragments of a LED command, e.g. red=on\ngreen=off\n
+    :param fragments: a list of (LED, command fragment) pairs
+    '''
+    return ''.join([fragment for (_, fragment) in fragments])
+
+
+def _join_blink1_fragments(fragments):
+    '''
+    Join the fragments of a blink(1) command. With a single RGB LED, the last
+    fragment wins.
+    :param fragments: a list of (LED number, command fragment) pairs
+    '''
+    return fragments[-1][1]
@@ -12,12 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# System imports
+import collections
+
 # Local imports
-import requests
 import fields
-import led_states
+import mapping
 import packets
 import request_types
+import usb_protocol_types
 import utils
 from requests import InvalidRequestException
 from requests import AttentionRequest
@@ -33,40 +36,147 @@ def decode(data):
       <key>=<val>;<key>=<val>;...;<key>=<val>!
     '''
     data_dict = _decompose(data)
-    if (_is_request_of_type(data_dict, request_types.
-                            SERVER_STATUS)):
-        return StatusRequest(_str_to_bool(data_dict[fields.
-                                                    SERVER_STATUS]))
-    if (_is_request_of_type(data_dict, request_types.BUILD_ACTIVE)):
-        return BuildActiveRequest(_str_to_bool(data_dict[fields.
-                                                         BUILDS_ACTIVE]))
-    if (_is_request_of_type(data_dict, request_types.ATTENTION)):
-        return AttentionRequest(_str_to_bool(data_dict[fields.
-                                                       ATTENTION_REQUIRED]),
-                                _str_to_bool(data_dict[fields.
-                                                       ATTENTION_PRIORITY]))
-    raise InvalidRequestException('Cannot decode a request of type ID {0}'.
-                                  format(data_dict[fields.REQUEST_TYPE_ID]))
+    type_id = data_dict.get(fields.REQUEST_TYPE_ID)
+    if type_id is None or not type_id.isdigit():
+        raise InvalidRequestException('No or invalid type ID found')
+    decoder = _DECODERS.get(int(type_id))
+    if decoder is None:
+        raise InvalidRequestException('Cannot decode a request of type ID {0}'.
+                                      format(type_id))
+    return decoder(data_dict)
 
 
-def _str_to_bool(s):
+def _decode_status_request(data_dict):
     '''
-    Cast a integer string to a bool (e.g. '1' => True, '0' => False).
-    :param s: the integer string
+    Extract a StatusRequest from decomposed key-value pairs.
+    :param data_dict: a data dictionary of decomposed key-value pairs
     '''
-    return bool(int(s))
+    status = _str_to_bool(data_dict[fields.SERVER_STATUS])
+    return StatusRequest.get_instance(status)
 
 
-def _is_request_of_type(data_dict, request_type):
+def _decode_build_active_request(data_dict):
     '''
-    Check whether a raw request is of a certain type.
+    Extract a BuildActiveRequest from decomposed key-value pairs.
     :param data_dict: a data dictionary of decomposed key-value pairs
-    :param request_type: a request_types member
     '''
-    if (not fields.REQUEST_TYPE_ID in data_dict or
-        not data_dict[fields.REQUEST_TYPE_ID].isdigit()):
-        raise InvalidRequestException('No or invalid type ID found')
-    return (int(data_dict[fields.REQUEST_TYPE_ID]) == int(request_type))
+    is_build_active = _str_to_bool(data_dict[fields.BUILDS_ACTIVE])
+    return BuildActiveRequest.get_instance(is_build_active)
+
+
+def _decode_attention_request(data_dict):
+    '''
+    Extract an AttentionRequest from decomposed key-value pairs.
+    :param data_dict: a data dictionary of decomposed key-value pairs
+    '''
+    attention = _str_to_bool(data_dict[fields.ATTENTION_REQUIRED])
+    priority = _str_to_bool(data_dict[fields.ATTENTION_PRIORITY])
+    return AttentionRequest.get_instance(attention, priority)
+
+
+# Field extractors by request type ID
+_DECODERS = {request_types.SERVER_STATUS: _decode_status_request,
+             request_types.BUILD_ACTIVE: _decode_build_active_request,
+             request_types.ATTENTION: _decode_attention_request}
+
+
+class StreamDecoder(object):
+    '''
+    An incremental decoder for a stream of requests, e.g. as received over a
+    persistent connection. Data can be fed in arbitrary chunks and requests
+    are produced as soon as their terminators have been received.
+    '''
+
+    def __init__(self, max_frame_size=packets.MAX_SIZE):
+        '''
+        Constructor.
+        :param max_frame_size: the maximum size of a single request,
+                               including its terminator
+        '''
+        self._max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._frames = collections.deque()
+        self._discarding = False
+        self._overflowed = False
+
+    def feed(self, data):
+        '''
+        Feed a chunk of data and get a generator for the requests completed
+        by it. Should a request be invalid, the generator raises an
+        InvalidRequestException; feeding an empty string resumes decoding
+        any requests that followed it.
+        :param data: a chunk of raw data
+        '''
+        self._frames.extend(self.split(data))
+        return self._decode_frames()
+
+    def split(self, data):
+        '''
+        Feed a chunk of data and return the raw requests (frames) completed
+        by it, each including its terminator. A request that grows beyond
+        the maximum frame size is discarded up to its terminator.
+        :param data: a chunk of raw data
+        '''
+        buf = self._buffer
+        buf.extend(data)
+        frames = []
+        start = 0
+        end = buf.find(packets.TERMINATOR)
+        while end >= 0:
+            if self._discarding:
+                self._discarding = False
+            elif end + 1 - start > self._max_frame_size:
+                self._overflowed = True
+            else:
+                frames.append(str(buf[start:end + 1]))
+            start = end + 1
+            end = buf.find(packets.TERMINATOR, start)
+        del buf[:start]
+        if len(buf) >= self._max_frame_size:
+            del buf[:]
+            self._discarding = True
+            self._overflowed = True
+        return frames
+
+    def has_partial_frame(self):
+        '''
+        Check whether part of a request has been received.
+        '''
+        return len(self._buffer) > 0 and not self._discarding
+
+    def has_overflowed(self):
+        '''
+        Check, and reset, whether a request was discarded for exceeding the
+        maximum frame size.
+        '''
+        overflowed = self._overflowed
+        self._overflowed = False
+        return overflowed
+
+    def _decode_frames(self):
+        '''
+        Decode all pending frames.
+        '''
+        while len(self._frames) > 0:
+            yield decode(self._frames.popleft())
+        if self.has_overflowed():
+            raise InvalidRequestException('Request exceeds {0} bytes'.
+                                          format(self._max_frame_size))
+
+
+# The common boolean strings, to avoid parsing them
+_BOOLS = {'0': False, '1': True}
+
+
+def _str_to_bool(s):
+    '''
+    Cast a integer string to a bool (e.g. '1' => True, '0' => False).
+    :param s: the integer string
+    '''
+    b = _BOOLS.get(s)
+    if b is None:
+        return bool(int(s))
+    return b
 
 
 def _decompose(data):
@@ -76,38 +186,77 @@ def _decompose(data):
     '''
     if not data.endswith(packets.TERMINATOR):
         raise InvalidRequestException('Malformatted request')
-    data_parts = (data.rstrip(packets.TERMINATOR).
-                  split(packets.COMMAND_SEPARATOR))
+    field_separator = packets.FIELD_SEPARATOR
     data_dict = {}
-    for part in data_parts:
-        (key, val) = part.split(packets.FIELD_SEPARATOR)
+    for part in (data.rstrip(packets.TERMINATOR).
+                 split(packets.COMMAND_SEPARATOR)):
+        (key, val) = part.split(field_separator)
         if key in data_dict:
             raise InvalidRequestException('Ambiguous or duplicate type ID')
         data_dict[key] = val
     return data_dict
 
 
+# Encoders by request type and translators by (request type, USB protocol)
+_ENCODERS = {}
+_TRANSLATORS = {}
+
+# The mapping whose translators are registered
+_mapping = None
+
+
+def register_encoder(request_type, encoder):
+    '''
+    Register the method for encoding a type of request.
+    :param request_type: a request_types member
+    :param encoder: a method taking a request and returning its wire format
+    '''
+    _ENCODERS[request_type] = encoder
+
+
+def register_translator(request_type, usb_protocol_type, translator):
+    '''
+    Register the method for translating a type of request into a command
+    for a USB protocol.
+    :param request_type: a request_types member
+    :param usb_protocol_type: a usb_protocol_types member
+    :param translator: a method taking a request and returning a command
+    '''
+    _TRANSLATORS[(request_type, usb_protocol_type)] = translator
+
+
+def _get_type(request):
+    '''
+    Get a request's type, or UNKNOWN if it is not a request.
+    :param request: anything, but preferably a BaseRequest
+    '''
+    get_type = getattr(request, 'get_type', None)
+    if get_type is None:
+        return request_types.UNKNOWN
+    return get_type()
+
+
 def encode(request):
     '''
     Encode requests for transmitting over the wire.
     :param request: a request that inherits from requests.BaseRequest
     '''
-    if isinstance(request, requests.RegistrationRequest):
-        return _encode_reqistration_request(request)
-    elif isinstance(request, requests.StatusRequest):
-        return _encode_status_request(request)
-    raise InvalidRequestException('Cannot encode a request of type {0}'.
-                                  format(type(request)))
+    encoder = _ENCODERS.get(_get_type(request))
+    if encoder is None:
+        raise InvalidRequestException('Cannot encode a request of type {0}'.
+                                      format(type(request)))
+    return encoder(request)
 
 
 def _encode_reqistration_request(request):
     '''
-    Encode a requests.RegistrationRequest.
+    Encode a requests.RegistrationRequest. The fields are always in the
+    same order, so that equal registrations encode to equal bytes.
     :param request: A registration request.
     '''
-    command_tuples = {(fields.REQUEST_TYPE_ID, request.get_type()),
+    command_tuples = [(fields.REQUEST_TYPE_ID, request.get_type()),
                       (fields.HOSTNAME, request.get_hostname()),
-                      (fields.USERNAME, request.get_username())}
+                      (fields.USERNAME, request.get_username())]
     return _assemble_command(command_tuples, packets.TERMINATOR)
 
 
@@ -116,25 +265,26 @@ def _encode_status_request(request):
     Encode a requests.StatusRequest.
     :param request: A status request.
     '''
-    command_tuples = {(fields.REQUEST_TYPE_ID, request.get_type()),
-                      (fields.SERVER_STATUS, int(request.is_up()))}
+    command_tuples = [(fields.REQUEST_TYPE_ID, request.get_type()),
+                      (fields.SERVER_STATUS, int(request.is_up()))]
     return _assemble_command(command_tuples, packets.TERMINATOR)
 
 
-def translate(request):
+def translate(request,
+              usb_protocol_type=usb_protocol_types.DAS_BLINKENLICHTEN):
     '''
     Translate a request into a command that can be
     understood by the USB device.
     :param request: a request of type BaseRequest
+    :param usb_protocol_type: the USB protocol used by the device
     '''
-    if isinstance(request, requests.BuildActiveRequest):
-        return _translate_build_active_request(request)
-    elif isinstance(request, requests.StatusRequest):
-        return _translate_status_request(request)
-    elif isinstance(request, requests.AttentionRequest):
-        return _translate_attention_request(request)
-    raise InvalidRequestException('Cannot translate a request of type {0}'.
-                                  format(type(request)))
+    translator = _TRANSLATORS.get((_get_type(request), usb_protocol_type))
+    if translator is None:
+        raise InvalidRequestException('Cannot translate a request of type {0} '
+                                      'for USB protocol {1}'.
+                                      format(type(request),
+                                             usb_protocol_type))
+    return translator(request)
 
 
 def translate_for_blink1(request):
@@ -143,88 +293,29 @@ def translate_for_blink1(request):
     understood by a blink(1) USB device.
     :param request: a request of type BaseRequest
     '''
-    if isinstance(request, requests.BuildActiveRequest):
-        return _translate_build_active_request_for_blink1(request)
-    elif isinstance(request, requests.StatusRequest):
-        return _translate_status_request_for_blink1(request)
-    elif isinstance(request, requests.AttentionRequest):
-        return _translate_attention_request_for_blink1(request)
-    raise InvalidRequestException('Cannot translate a request of type {0}'.
-                                  format(type(request)))
-
-
-def _translate_attention_request_for_blink1(request):
-    '''
-    '''
-    if request.is_required() or request.is_priority():
-        return _assemble_blink1_command({(fields.RED_LED, led_states.ON)})
-    else:
-        return _assemble_blink1_command({(fields.GREEN_LED, led_states.ON)})
-
-
-def _translate_build_active_request_for_blink1(request):
-    '''
-    '''
-    if request.is_build_active():
-        return _assemble_blink1_command({(fields.YELLOW_LED, led_states.ON)})
-
-
-def _translate_status_request_for_blink1(request):
-    if request.is_up():
-        raise InvalidRequestException('Only a client or server down '
-                                      'request can be translated')
-    return _assemble_blink1_command({(fields.BLUE_LED, led_states.ON)})
-
-
-def _translate_status_request(request):
-    '''
-    Translate a StatusRequest. If status is down, switch on all LEDs.
-    An up request is not allowed, since it does not make any sense:
-    When up, the client must register and the notification server must
-    send the latest state for the user.
-    :param request: a StatusRequest
-    '''
-    if request.is_up():
-        raise InvalidRequestException('Only a client or server down '
-                                      'request can be translated')
-    red_command = _assemble_led_command(fields.RED_LED,
-                                        led_states.ON)
-    green_command = _assemble_led_command(fields.GREEN_LED,
-                                          led_states.ON)
-    yellow_command = _assemble_led_command(fields.YELLOW_LED,
-                                           led_states.ON)
-    return ''.join([red_command, green_command, yellow_command])
+    return translate(request, usb_protocol_types.BLINK1)
 
 
-def _translate_build_active_request(request):
+def register_mapping(light_mapping):
     '''
-    Translate a BuildActiveRequest.
-    :param request: a BuildActiveRequest
+    Register the translators of a mapping for all its USB protocols,
+    replacing those registered before.
+    :param light_mapping: a mapping.Mapping
     '''
-    if request.is_build_active():
-        command_tuples = {(fields.YELLOW_LED, led_states.ON)}
-    else:
-        command_tuples = {(fields.YELLOW_LED, led_states.OFF)}
-    return _assemble_command(command_tuples, packets.ALT_TERMINATOR)
+    global _mapping
+    _mapping = light_mapping
+    for usb_protocol_type in light_mapping.get_usb_protocol_types():
+        for request_type in mapping.REQUEST_TYPES:
+            translator = light_mapping.get_translator(request_type,
+                                                      usb_protocol_type)
+            register_translator(request_type, usb_protocol_type, translator)
 
 
-def _translate_attention_request(request):
+def get_mapping():
     '''
-    Translate an AttentionRequest.
-    :param request: an AttentionRequest
+    Get the mapping registered last.
     '''
-    if request.is_required() and not request.is_priority():
-        red_tuple = {(fields.RED_LED, led_states.ON)}
-        green_tuple = {(fields.GREEN_LED, led_states.OFF)}
-    elif request.is_required() and request.is_priority():
-        red_tuple = {(fields.RED_LED, led_states.SOS)}
-        green_tuple = {(fields.GREEN_LED, led_states.OFF)}
-    else:
-        red_tuple = {(fields.RED_LED, led_states.OFF)}
-        green_tuple = {(fields.GREEN_LED, led_states.ON)}
-    red_command = _assemble_command(red_tuple, packets.ALT_TERMINATOR)
-    green_command = _assemble_command(green_tuple, packets.ALT_TERMINATOR)
-    return ''.join([red_command, green_command])
+    return _mapping
 
 
 def _assemble_command(command_tuples, terminator):
@@ -242,54 +333,9 @@ def _assemble_command(command_tuples, terminator):
             join([command for command in command_list])) + terminator
 
 
-def _assemble_blink1_command(command_tuples):
-    '''
-    Assemble a list of command tuples into a valid packet. Due to backwards
-    compatibility (due to the prior existence of _assemble_command(...))
-    this method only acts on the first ON item in the list. By still allowing
-    a list, one can potentially extend this in future to allow for compound
-    states, e.g. a blink(1) device with multiple RGB LEDs, or using a
-    transition among colours when there's only a single RGB LED.
-    '''
-    # We only have one LED (at index 0)
-    led_number = 0
-    # 1 second divided by 10
-    fade_millis = 1000 / 10
-    th = (fade_millis & 0xff00) >> 8
-    tl = fade_millis & 0x00ff
-    # We assume we will always get at least one ON state.
-    # No way to treat the SOS state yet, other than ON.
-    color = [t[0] for t in command_tuples
-             if t[1] in [led_states.ON, led_states.SOS]][0]
-    if color == fields.GREEN_LED:
-        red = 0
-        green = 255
-        blue = 0
-    elif color == fields.RED_LED:
-        red = 255
-        green = 0
-        blue = 0
-    elif color == fields.BLUE_LED:
-        red = 0
-        green = 0
-        blue = 255
-    elif color == fields.YELLOW_LED:
-        red = 255
-        green = 150
-        blue = 0
-    # 0x63 = 'c' => fade to RGB
-    # 0x6E = 'n' => set to RGB
-    return [0x01, 0x63, red, green, blue, th, tl, led_number]
-
-
-def _assemble_led_command(led_field, led_state):
-    '''
-    Assemble a LED command, e.g.
-      red=on\n
-    :param led_field: the LED
-    :param led_state: the LED's status
-    '''
-    return _assemble_command({(led_field, led_state)}, packets.ALT_TERMINATOR)
+register_encoder(request_types.REGISTER, _encode_reqistration_request)
+register_encoder(request_types.SERVER_STATUS, _encode_status_request)
+register_mapping(mapping.Mapping())
 
 
 def get_challenge_request():
@@ -31,15 +31,13 @@ class InvalidRequestException(Exception):
 
 class BaseRequest(object):
     '''
-    A base request.
+    A base request. Requests are immutable, so that instances can be shared.
     '''
 
-    def __init__(self):
-        '''
-        Constructor.
-        '''
-        # Override this in sub classes
-        self._type = request_types.UNKNOWN
+    __slots__ = ()
+
+    # Override this in sub classes
+    _type = request_types.UNKNOWN
 
     def get_type(self):
         '''
@@ -47,22 +45,37 @@ class BaseRequest(object):
         '''
         return self._type
 
+    def _init_field(self, name, value):
+        '''
+        Initialise a field; only to be used by constructors.
+        :param name: the field's name
+        :param value: the field's value
+        '''
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        '''
+        Prevent modification.
+        '''
+        raise AttributeError('{0} is immutable'.format(type(self).__name__))
+
 
 class RegistrationRequest(BaseRequest):
     '''
     A registration request for registering a user with the notification server.
     '''
 
+    __slots__ = ('_hostname', '_username')
+    _type = request_types.REGISTER
+
     def __init__(self, hostname, username):
         '''
         Constructor.
         :param hostname: the user's host
         :param username: the user's username
         '''
-        super(type(self), self).__init__()
-        self._type = request_types.REGISTER
-        self._hostname = hostname
-        self._username = username
+        self._init_field('_hostname', hostname)
+        self._init_field('_username', username)
 
     def get_hostname(self):
         '''
@@ -82,14 +95,23 @@ class BuildActiveRequest(BaseRequest):
     A request to indicate whether any builds are active.
     '''
 
+    __slots__ = ('_is_build_active',)
+    _type = request_types.BUILD_ACTIVE
+
     def __init__(self, is_build_active):
         '''
         Constructor.
         :param is_build_active: true if a build is active
         '''
-        super(type(self), self).__init__()
-        self._type = request_types.BUILD_ACTIVE
-        self._is_build_active = is_build_active
+        self._init_field('_is_build_active', is_build_active)
+
+    @classmethod
+    def get_instance(cls, is_build_active):
+        '''
+        Get the shared instance for a value.
+        :param is_build_active: true if a build is active
+        '''
+        return cls._instances[bool(is_build_active)]
 
     def is_build_active(self):
         '''
@@ -103,19 +125,33 @@ class AttentionRequest(BaseRequest):
     A request to indicate whether and what type of attention is required.
     '''
 
+    __slots__ = ('_attention', '_priority')
+    _type = request_types.ATTENTION
+
     def __init__(self, attention, priority):
         '''
         Constructor.
         :param attention: true if attention is required
         :param priority: true if attention is priority
         '''
-        super(type(self), self).__init__()
-        self._type = request_types.ATTENTION
-        self._attention = attention
         if priority and not attention:
             raise InvalidRequestException('Priority only valid if '
                                           'attention is required.')
-        self._priority = priority
+        self._init_field('_attention', attention)
+        self._init_field('_priority', priority)
+
+    @classmethod
+    def get_instance(cls, attention, priority):
+        '''
+        Get the shared instance for a pair of values.
+        :param attention: true if attention is required
+        :param priority: true if attention is priority
+        '''
+        key = (bool(attention), bool(priority))
+        if not key in cls._instances:
+            # Invalid, so let the constructor raise
+            return cls(*key)
+        return cls._instances[key]
 
     def is_required(self):
         '''
@@ -136,17 +172,39 @@ class StatusRequest(BaseRequest):
     a client or server is up or down.
     '''
 
+    __slots__ = ('_status',)
+    _type = request_types.SERVER_STATUS
+
     def __init__(self, status):
         '''
         Constructor.
-        :param is_build_active: true if a build is active
+        :param status: true if the client or server is up
         '''
-        super(type(self), self).__init__()
-        self._type = request_types.SERVER_STATUS
-        self._status = status
+        self._init_field('_status', status)
+
+    @classmethod
+    def get_instance(cls, status):
+        '''
+        Get the shared instance for a value.
+        :param status: true if the client or server is up
+        '''
+        return cls._instances[bool(status)]
 
     def is_up(self):
         '''
         Return true if the client or server is up.
         '''
         return self._status
+
+
+# The shared instances; the whole value space is tiny
+BuildActiveRequest._instances = dict((value, BuildActiveRequest(value))
+                                     for value in (False, True))
+AttentionRequest._instances = dict(((attention, priority),
+                                    AttentionRequest(attention, priority))
+                                   for (attention, priority) in
+                                   [(False, False),
+                                    (True, False),
+                                    (True, True)])
+StatusRequest._instances = dict((value, StatusRequest(value))
+                                for value in (False, True))
@@ -0,0 +1,134 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import collections
+import time
+
+# Constants (in milliseconds)
+_INITIAL_TIMEOUT = 50
+_MIN_TIMEOUT = 10
+_MAX_TIMEOUT = 1000
+_GRANULARITY = 1
+
+# Smoothing factors, as for TCP (RFC 6298)
+_ALPHA = 1.0 / 8
+_BETA = 1.0 / 4
+
+
+class RttEstimator(object):
+    '''
+    Estimates a device's round-trip time (RTT) from send to receive, the way
+    TCP does, and derives the receive timeout from it. A receive that times
+    out is retried once with double the timeout; if the retry receives the
+    data, the timeout was spurious, i.e. too short.
+    '''
+
+    def __init__(self,
+                 initial_timeout=_INITIAL_TIMEOUT,
+                 min_timeout=_MIN_TIMEOUT,
+                 max_timeout=_MAX_TIMEOUT):
+        '''
+        Constructor.
+        :param initial_timeout: the timeout in milliseconds until sampled
+        :param min_timeout: the minimum timeout in milliseconds
+        :param max_timeout: the maximum timeout in milliseconds
+        '''
+        self._min_timeout = min_timeout
+        self._max_timeout = max_timeout
+        self._sent = collections.deque()
+        self._smoothed_rtt = None
+        self._rtt_variance = None
+        self._timeout = initial_timeout
+        self._timeouts = 0
+        self._spurious_retries = 0
+
+    def sent(self):
+        '''
+        Record that data was sent.
+        '''
+        self._sent.append(time.time())
+
+    def receive(self, recv):
+        '''
+        Receive the reply to the data sent first, with the estimated timeout.
+        An empty reply means that the receive timed out.
+        :param recv: a method receiving data, taking the timeout in
+                     milliseconds
+        '''
+        sent = self._sent.popleft() if len(self._sent) > 0 else None
+        data = recv(self._timeout)
+        if len(data) == 0:
+            self._timeouts += 1
+            data = recv(min(self._timeout * 2, self._max_timeout))
+            if len(data) > 0:
+                self._spurious_retries += 1
+        if len(data) > 0 and not sent is None:
+            self._sample((time.time() - sent) * 1000)
+        return data
+
+    def reset(self):
+        '''
+        Forget the data sent, e.g. when the device was opened again.
+        '''
+        self._sent.clear()
+
+    def get_timeout(self):
+        '''
+        Get the receive timeout in milliseconds.
+        '''
+        return self._timeout
+
+    def get_smoothed_rtt(self):
+        '''
+        Get the smoothed RTT in milliseconds, or None if not sampled yet.
+        '''
+        return self._smoothed_rtt
+
+    def get_rtt_variance(self):
+        '''
+        Get the RTT variance in milliseconds, or None if not sampled yet.
+        '''
+        return self._rtt_variance
+
+    def get_timeouts(self):
+        '''
+        Get the number of receives that timed out.
+        '''
+        return self._timeouts
+
+    def get_spurious_retries(self):
+        '''
+        Get the number of retried receives that received the data, i.e. of
+        timeouts that were too short.
+        '''
+        return self._spurious_retries
+
+    def _sample(self, rtt):
+        '''
+        Update the estimates and the timeout with a measured RTT.
+        :param rtt: the RTT in milliseconds
+        '''
+        if self._smoothed_rtt is None:
+            self._smoothed_rtt = rtt
+            self._rtt_variance = rtt / 2
+        else:
+            self._rtt_variance = ((1 - _BETA) * self._rtt_variance +
+                                  _BETA * abs(self._smoothed_rtt - rtt))
+            self._smoothed_rtt = ((1 - _ALPHA) * self._smoothed_rtt +
+                                  _ALPHA * rtt)
+        timeout = (self._smoothed_rtt +
+                   max(_GRANULARITY, 4 * self._rtt_variance))
+        self._timeout = int(min(max(timeout, self._min_timeout),
+                                self._max_timeout))
@@ -13,19 +13,30 @@
 # limitations under the License.
 
 # System imports
+import collections
 import logging
 import threading
+import time
 import binascii
 
 # Local imports
-from common import utils
+from common import config
+from common.frame_buffer import FrameBuffer
+from common import future
+from common import priorities
 from common import usb_transfer_types
 
 # Constants
 _ACK = 'ack'
-_TIMEOUT = 50
+_ACK_PADDING = '\0\n\r'
 _VENDOR_ID_KEY = 'ID_VENDOR_ID'
 _PRODUCT_ID_KEY = 'ID_MODEL_ID'
+_AGING_PERIOD = 0.5
+_REOPEN_DELAY = 0.1
+_MAX_REOPEN_DELAY = 5
+_MAX_REOPEN_ATTEMPTS = 8
+_BREAKER_PERIOD = 60
+_IO_DEADLINE = 5
 
 
 class DeviceController(object):
@@ -39,6 +50,9 @@ class DeviceController(object):
                  monitor,
                  add_event_handler=None,
                  remove_event_handler=None,
+                 command_ttl=config.DEVICE_COMMAND_TTL_DEFAULT,
+                 pipeline_window=config.DEVICE_PIPELINE_WINDOW_DEFAULT,
+                 io_deadline=_IO_DEADLINE,
                  logger=logging.basicConfig()):
         '''
         Constructor.
@@ -51,6 +65,12 @@ class DeviceController(object):
                                   device connected
         :param remove_event_handler: void, parameterless method to invoke when
                                      a device disconnected
+        :param command_ttl: the period in seconds after which a command not
+                            sent yet is dropped; never if None
+        :param pipeline_window: the number of RAW frames to send before
+                                receiving their acks; 1 for lock-step
+        :param io_deadline: the period in seconds after which a transfer is
+                            considered stalled
         :param logger: local logger instance
         '''
         self._logger = logger
@@ -58,26 +78,66 @@ class DeviceController(object):
         self._runLock = threading.Lock()
         self._device = device
         self._usb_transfer_type = usb_transfer_type
+        # All USB access goes through a single I/O thread while running
+        self._io_queue = _IoQueue(command_ttl)
+        self._io_thread = None
+        self._io_lock = threading.Lock()
+        self._device_lock = threading.RLock()
+        self._pipeline_window = pipeline_window
+        self._pipelined = self._can_pipeline_transfers()
+        self._pipeline_fallbacks = 0
+        # The RAW frame reused for every command, sized once the device is
+        # open
+        self._frame = None
+        # Recovery from failed I/O, by reopening the device
+        self._breaker = _CircuitBreaker()
+        self._recovery_started = None
+        self._recovery_timer = None
+        self._recovery_times = [0, 0.0, 0.0]
+        self._replay_handler = None
+        # The watchdog for stalled I/O
+        self._io_deadline = io_deadline
+        self._operation = None
+        self._watchdog_lock = threading.Lock()
+        self._watchdog_thread = None
+        self._watchdog_event = threading.Event()
+        self._abandoned_thread = None
+        self._stalls = [0, 0, 0.0, 0.0]
+        # Whether the device open was handled as added, since a monitor
+        # also reports a device present when started
+        self._device_added = False
         self.event_handlers = {'add': None,
                                'remove': None}
         self.set_add_event_handler(add_event_handler)
         self.set_remove_event_handler(remove_event_handler)
 
         def _add_event_handler():
-            self._device.open()
+            self._device_added = True
+            self._execute(self._open_added_device)
             add_event_handler = self._get_add_event_handler()
             if not add_event_handler is None:
                 add_event_handler()
 
         def _remove_event_handler():
-            self._device.close()
+            self._device_added = False
+            self._execute(self._device.close)
             remove_event_handler = self._get_remove_event_handler()
             if not remove_event_handler is None:
                 remove_event_handler()
 
+        def _monitor_add_event_handler():
+            if self._device_added and self._device_is_open():
+                self._logger.debug('Device added, but already open')
+                return
+            _add_event_handler()
+
+        self._handle_add_event = _add_event_handler
         self._monitor = monitor
-        self._monitor.set_add_event_handler(_add_event_handler)
+        self._monitor.set_add_event_handler(_monitor_add_event_handler)
         self._monitor.set_remove_event_handler(_remove_event_handler)
+        if hasattr(self._monitor, 'set_executor'):
+            # A monitor accessing the device must do so on the I/O thread
+            self._monitor.set_executor(self._call)
 
     def start(self):
         '''
@@ -89,11 +149,24 @@ class DeviceController(object):
                 self._logger.warn("Device controller already started")
                 return
             self._open_device()
-            if (self._device_is_open() and
+            self._device_added = self._device_is_open()
+            if (self._device_added and
                 not self._get_add_event_handler() is None):
                 self._get_add_event_handler()()
+            self._start_io_thread()
             self.running = True
-            self._monitor.start()
+            try:
+                self._monitor.start()
+            except Exception, e:
+                # Leave the controller stopped, so that it can be started
+                # again
+                self._logger.error('Device monitor failed to start: {0}'.
+                                   format(e))
+                self._stop_io_thread()
+                self._close_device()
+                self._device_added = False
+                self.running = False
+                raise
             self._logger.info("Device controller started")
 
     def stop(self):
@@ -108,7 +181,9 @@ class DeviceController(object):
 
             # CONSIDER: Test is_alive before stopping observer
             self._monitor.stop()
+            self._stop_io_thread()
             self._close_device()
+            self._device_added = False
             self.running = False
             self._logger.info("Device controller stopped")
 
@@ -142,6 +217,15 @@ class DeviceController(object):
                            format(handler))
         self.event_handlers['remove'] = handler
 
+    def set_replay_handler(self, handler):
+        '''
+        Set a method getting the command that writes the desired state of all
+        the lights, to replay when a device was added or reopened after it
+        failed.
+        :param handler: A parameterless method returning a command, or None.
+        '''
+        self._replay_handler = handler
+
     def _device_is_open(self):
         '''
         Checks whether the device is open for communication.
@@ -173,6 +257,27 @@ class DeviceController(object):
         if self._device_is_open():
             self._device.close()
 
+    def submit(self, command, channels=None, priority=priorities.NORMAL):
+        '''
+        Submit a command (report) to send to the USB device, without waiting
+        for it. The future's result is True if the command was sent and
+        understood. A command not sent yet is dropped when a later one sets
+        all of its channels (its result is None), or when older than the
+        command TTL (its result is False). A more urgent command overtakes
+        the commands waiting for other channels.
+        :param command: A command in the format <key>=<value><newline>, e.g.
+                        'red=on\n'.
+        :param channels: the frozenset of channels (e.g. LEDs) that the
+                         command sets; never dropped for a later one, nor
+                         overtaken, if None
+        :param priority: a priorities member
+        '''
+        return self._execute(self._transfer,
+                             (command,),
+                             channels,
+                             priority,
+                             expires=True)
+
     def send(self, command):
         '''
         Send a command (report) to the USB device. The method returns True if
@@ -180,22 +285,710 @@ class DeviceController(object):
         :param command: A command in the format <key>=<value><newline>, e.g.
                         'red=on\n'.
         '''
+        return self.submit(command).result()
+
+    def get_coalesced_commands(self):
+        '''
+        Get the number of commands dropped for a later one.
+        '''
+        return self._io_queue.get_coalesced()
+
+    def get_expired_commands(self):
+        '''
+        Get the number of commands dropped for being older than the TTL.
+        '''
+        return self._io_queue.get_expired()
+
+    def get_pipeline_fallbacks(self):
+        '''
+        Get the number of times that pipelined transfers fell back to
+        lock-step.
+        '''
+        return self._pipeline_fallbacks
+
+    def get_recovery_time(self):
+        '''
+        Get the (count, average, maximum) tuple of the periods in seconds
+        from I/O failing until the device was reopened and the lights
+        replayed.
+        '''
+        (count, total, maximum) = self._recovery_times
+        return (count, total / count if count > 0 else 0.0, maximum)
+
+    def get_circuit_breaker_trips(self):
+        '''
+        Get the number of times that reopening a failed device was suspended
+        after too many attempts.
+        '''
+        return self._breaker.get_trips()
+
+    def get_stalls(self):
+        '''
+        Get the (count, average, maximum) tuple of stalled transfers, where
+        the average and maximum periods in seconds are of the stalled
+        transfers that returned eventually.
+        '''
+        with self._watchdog_lock:
+            (count, returned, total, maximum) = self._stalls
+        return (count, total / returned if returned > 0 else 0.0, maximum)
+
+    def get_latency(self, priority):
+        '''
+        Get the (count, average, maximum) tuple of the periods in seconds
+        from submitting commands of a priority until sent.
+        :param priority: a priorities member
+        '''
+        return self._io_queue.get_latency(priority)
+
+    def _execute(self, method, args=(), channels=None,
+                 priority=priorities.HIGH, expires=False):
+        '''
+        Execute a method accessing the USB device on the I/O thread, or right
+        away if that is not running, and get its future.
+        :param method: the method
+        :param args: the method's arguments
+        :param channels: the frozenset of channels that the method sets
+        :param priority: a priorities member
+        :param expires: whether the method is dropped when waiting longer
+                        than the command TTL, i.e. is a command
+        '''
+        with self._io_lock:
+            if not self._io_thread is None:
+                task_future = future.Future()
+                task = _Task(method,
+                             args,
+                             task_future,
+                             channels,
+                             priority,
+                             expires)
+                self._io_queue.put(task)
+                return task_future
+        task_future = future.Future()
+        self._run_task(method, args, task_future)
+        return task_future
+
+    def _call(self, method):
+        '''
+        Call a parameterless method accessing the USB device on the I/O
+        thread, or right away if that is not running, and wait for its
+        result.
+        :param method: the method
+        '''
+        return self._execute(method).result()
+
+    def _run_task(self, method, args, task_future):
+        '''
+        Run a method accessing the USB device and set its future.
+        :param method: the method
+        :param args: the method's arguments
+        :param task_future: the future to set
+        '''
+        try:
+            with self._device_lock:
+                result = method(*args)
+        except Exception, e:
+            self._logger.warn('USB I/O failed: {0}'.format(e))
+            task_future.set_exception(e)
+            return
+        task_future.set_result(result)
+
+    def _start_io_thread(self):
+        '''
+        Start the thread that does all USB I/O, and its watchdog.
+        '''
+        with self._io_lock:
+            self._io_thread = threading.Thread(target=self._run_io)
+            self._io_thread.setDaemon(True)
+            self._io_thread.start()
+        self._watchdog_event.clear()
+        self._watchdog_thread = threading.Thread(target=self._run_watchdog)
+        self._watchdog_thread.setDaemon(True)
+        self._watchdog_thread.start()
+
+    def _stop_io_thread(self):
+        '''
+        Stop the I/O thread once it did the work submitted before, unless it
+        stalled.
+        '''
+        with self._io_lock:
+            io_thread = self._io_thread
+            self._io_thread = None
+            self._io_queue.put(None)
+            self._cancel_recovery_timer()
+        while (io_thread.is_alive() and
+               not io_thread is self._abandoned_thread):
+            io_thread.join(self._io_deadline)
+            self._abandon_stalled_operation()
+        self._watchdog_event.set()
+        self._watchdog_thread.join()
+        # Fail what an abandoned thread left behind
+        self._io_queue.clear()
+
+    def _run_io(self):
+        '''
+        Do the submitted USB I/O in order, until told to stop, or until the
+        watchdog abandoned this thread.
+        '''
+        self._logger.debug('I/O thread started')
+        while True:
+            tasks = self._io_queue.get(self._pipeline_window,
+                                       self._can_pipeline)
+            if tasks[0] is None:
+                break
+            operation = (time.time(), tasks, threading.current_thread())
+            with self._watchdog_lock:
+                self._operation = operation
+            if len(tasks) == 1:
+                self._run_task(tasks[0].method, tasks[0].args, tasks[0].future)
+                self._io_queue.task_done(tasks[0])
+            else:
+                self._run_pipeline(tasks)
+            with self._watchdog_lock:
+                if not self._operation is operation:
+                    # Abandoned; another thread does the I/O by now
+                    duration = time.time() - operation[0]
+                    self._stalls[1] += 1
+                    self._stalls[2] += duration
+                    self._stalls[3] = max(self._stalls[3], duration)
+                    break
+                self._operation = None
+        self._logger.debug('I/O thread stopped')
+
+    def _run_watchdog(self):
+        '''
+        Check for stalled I/O regularly, until the I/O thread stopped.
+        '''
+        while not self._watchdog_event.wait(self._io_deadline / 4.0):
+            if not self._abandon_stalled_operation():
+                continue
+            with self._io_lock:
+                if self._io_thread is None:
+                    # Stopping
+                    continue
+                self._io_thread = threading.Thread(target=self._run_io)
+                self._io_thread.setDaemon(True)
+                self._io_thread.start()
+            # Cycle the device as if it was removed and added again
+            remove_event_handler = self._get_remove_event_handler()
+            if not remove_event_handler is None:
+                remove_event_handler()
+            self._handle_add_event()
+
+    def _abandon_stalled_operation(self):
+        '''
+        Abandon the I/O thread's operation, if it overran its deadline: fail
+        its tasks, and abandon the device handle, since the stalled thread
+        holds it. Returns True if abandoned.
+        '''
+        with self._watchdog_lock:
+            if self._operation is None:
+                return False
+            (started, tasks, io_thread) = self._operation
+            duration = time.time() - started
+            if duration <= self._io_deadline * len(tasks):
+                return False
+            self._operation = None
+            self._abandoned_thread = io_thread
+            self._stalls[0] += 1
+        self._logger.error('USB I/O stalled for {0:.3f} second(s); '
+                           'abandoning it'.format(duration))
+        for task in tasks:
+            task.future.set_result(False)
+        self._device_lock = threading.RLock()
+        try:
+            self._device.close()
+        except Exception, e:
+            self._logger.debug(e)
+        return True
+
+    def _can_pipeline_transfers(self):
+        '''
+        Check whether transfers can be pipelined, i.e. are RAW and the
+        pipeline window holds several frames.
+        '''
+        return (self._usb_transfer_type == usb_transfer_types.RAW and
+                self._pipeline_window > 1)
+
+    def _can_pipeline(self, task):
+        '''
+        Check whether a task is a transfer that can be pipelined.
+        :param task: a _Task
+        '''
+        return self._pipelined and task.method == self._transfer
+
+    def _run_pipeline(self, tasks):
+        '''
+        Run several transfers pipelined and set their futures.
+        :param tasks: the transfer _Tasks
+        '''
+        acked = 0
+        with self._device_lock:
+            if self._device_is_open():
+                acked = self._pipeline([task.args[0] for task in tasks])
+        for (index, task) in enumerate(tasks):
+            task.future.set_result(index < acked)
+            self._io_queue.task_done(task)
+
+    def _pipeline(self, commands):
+        '''
+        Send the frames of several commands before receiving their acks, and
+        match the acks to the frames in order. On any mismatch, the commands
+        from there on count as failed and transfers are done in lock-step
+        from then on. Get the number of commands acked.
+        :param commands: the device commands
+        '''
+        sent = 0
+        acked = 0
+        try:
+            for command in commands:
+                self._send_frame(command)
+                sent += 1
+            while acked < sent and self._receive_ack():
+                acked += 1
+            if acked < sent:
+                self._drain_acks(sent - acked)
+        except Exception, e:
+            self._logger.warn('Pipelined transfer failed: {0}'.format(e))
+            if isinstance(e, IOError):
+                self._recover()
+        if acked < sent:
+            self._forget_unacked()
+        if acked < len(commands):
+            self._logger.warn('Only {0} of {1} pipelined frames acked; '
+                              'falling back to lock-step'.
+                              format(acked, len(commands)))
+            self._pipelined = False
+            self._pipeline_fallbacks += 1
+        return acked
+
+    def _transfer(self, command):
+        '''
+        Send a command (report) to the USB device on the calling thread.
+        :param command: a device command
+        '''
         if self._usb_transfer_type == usb_transfer_types.RAW:
             if not self._device_is_open():
                 return False
-            data = command + '\0' * (self._device.get_packet_size() -
-                                     len(command))
-            self._logger.debug('Sending data (%u bytes): %s',
-                               len(data),
-                               binascii.b2a_hex(data))
             try:
-                self._device.send(data)
-                data = self._device.receive()
-                self._logger.debug('Received data (%u bytes): %s',
-                                   len(data),
-                                   binascii.b2a_hex(data))
-                return utils.strip(data) == _ACK
+                self._send_frame(command)
+                return self._receive_ack()
             except IOError:
+                self._forget_unacked()
+                self._recover()
                 return False
         elif self._usb_transfer_type == usb_transfer_types.CONTROL:
-            self._device.send(command)
+            try:
+                self._device.send(command)
+            except IOError:
+                self._recover()
+                return False
+
+    def _send_frame(self, command):
+        '''
+        Send a command padded to a RAW frame. The frame is reused, so that
+        only the command is copied.
+        :param command: a device command
+        '''
+        packet_size = self._device.get_packet_size()
+        if self._frame is None or not self._frame.get_size() == packet_size:
+            self._frame = FrameBuffer(packet_size)
+        data = self._frame.fill(command)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug('Sending data (%u bytes): %s',
+                               len(data),
+                               binascii.b2a_hex(data))
+        self._device.send(data)
+
+    def _receive_ack(self):
+        '''
+        Receive a RAW frame and check whether it is an ack.
+        '''
+        data = self._device.receive()
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug('Received data (%u bytes): %s',
+                               len(data),
+                               binascii.b2a_hex(data))
+        return _is_ack(data)
+
+    def _drain_acks(self, count):
+        '''
+        Receive and discard the replies still outstanding, until none is
+        received, so that a late ack is not taken for the ack of a later
+        frame.
+        :param count: the maximum number of replies outstanding
+        '''
+        for _ in range(count):
+            data = self._device.receive()
+            if len(data) == 0:
+                return
+            self._logger.debug('Discarded a reply (%u bytes)', len(data))
+
+    def _forget_unacked(self):
+        '''
+        Forget the frames sent whose acks will not be received, so that the
+        device's round-trip time estimator (if any) does not match the acks
+        received later to them.
+        '''
+        if hasattr(self._device, 'get_rtt_estimator'):
+            rtt_estimator = self._device.get_rtt_estimator()
+            if not rtt_estimator is None:
+                rtt_estimator.reset()
+
+    def _open_added_device(self):
+        '''
+        Open a device that was added, pipelining its transfers again, and
+        replay the desired state of the lights right away.
+        '''
+        self._device.open()
+        self._pipelined = self._can_pipeline_transfers()
+        if not self._recovery_started is None:
+            self._recovered()
+        self._replay()
+
+    def _recover(self):
+        '''
+        Close a device whose I/O failed, and reopen it later. Only while
+        running, since it takes the I/O thread.
+        '''
+        with self._io_lock:
+            if self._io_thread is None or not self._recovery_started is None:
+                return
+            self._recovery_started = time.time()
+        self._logger.warn('Device I/O failed; closing the device to reopen it')
+        try:
+            self._device.close()
+        except Exception, e:
+            self._logger.debug(e)
+        self._schedule_reopen(self._breaker.failed())
+
+    def _schedule_reopen(self, delay):
+        '''
+        Schedule reopening a failed device.
+        :param delay: the delay in seconds
+        '''
+        self._logger.info('Reopening the device in {0} second(s)'.
+                          format(delay))
+        with self._io_lock:
+            if self._io_thread is None:
+                return
+            self._cancel_recovery_timer()
+            self._recovery_timer = threading.Timer(delay,
+                                                   self._submit_reopen)
+            self._recovery_timer.setDaemon(True)
+            self._recovery_timer.start()
+
+    def _cancel_recovery_timer(self):
+        '''
+        Cancel reopening a failed device, if scheduled.
+        '''
+        if not self._recovery_timer is None:
+            self._recovery_timer.cancel()
+            self._recovery_timer = None
+
+    def _submit_reopen(self):
+        '''
+        Submit reopening a failed device to the I/O thread, if running.
+        '''
+        with self._io_lock:
+            if not self._io_thread is None:
+                self._io_queue.put(_Task(self._reopen_failed_device,
+                                         (),
+                                         future.Future(),
+                                         None,
+                                         priorities.HIGH))
+
+    def _reopen_failed_device(self):
+        '''
+        Reopen a failed device and replay the desired state of the lights,
+        or schedule trying again.
+        '''
+        if self._recovery_started is None:
+            # Recovered already, e.g. since the device was added
+            return
+        try:
+            self._device.open()
+            if not self._replay():
+                raise IOError('Could not replay the lights')
+        except Exception, e:
+            self._logger.warn('Could not reopen the device: {0}'.format(e))
+            try:
+                self._device.close()
+            except Exception, e:
+                self._logger.debug(e)
+            self._schedule_reopen(self._breaker.failed())
+            return
+        self._recovered()
+
+    def _replay(self):
+        '''
+        Replay the desired state of the lights. Returns False if that failed.
+        '''
+        if self._replay_handler is None:
+            return True
+        command = self._replay_handler()
+        if command is None:
+            return True
+        return not self._transfer(command) is False
+
+    def _recovered(self):
+        '''
+        Record that a failed device recovered.
+        '''
+        with self._io_lock:
+            self._cancel_recovery_timer()
+            recovery_time = time.time() - self._recovery_started
+            self._recovery_started = None
+            self._recovery_times[0] += 1
+            self._recovery_times[1] += recovery_time
+            self._recovery_times[2] = max(self._recovery_times[2],
+                                          recovery_time)
+        self._breaker.succeeded()
+        self._logger.info('Device recovered in {0:.3f} second(s)'.
+                          format(recovery_time))
+
+
+def _is_ack(data):
+    '''
+    Check whether a RAW frame is an ack, i.e. the ack padded with nulls,
+    newlines or carriage returns.
+    :param data: a frame, as a string or a buffer
+    '''
+    length = len(_ACK)
+    return (data[:length] == _ACK and
+            len(data[length:].strip(_ACK_PADDING)) == 0)
+
+
+class _CircuitBreaker(object):
+    '''
+    Paces reopening a failed device: the delay doubles with every failed
+    attempt, and after too many attempts the breaker trips, suspending
+    attempts for a long period, so that a wedged device does not keep the
+    I/O thread busy.
+    '''
+
+    def __init__(self,
+                 delay=_REOPEN_DELAY,
+                 max_delay=_MAX_REOPEN_DELAY,
+                 max_attempts=_MAX_REOPEN_ATTEMPTS,
+                 period=_BREAKER_PERIOD):
+        '''
+        Constructor.
+        :param delay: the delay in seconds after the first failure
+        :param max_delay: the maximum delay in seconds between attempts
+        :param max_attempts: the number of attempts before tripping
+        :param period: the period in seconds to suspend attempts when tripped
+        '''
+        self._delay = delay
+        self._max_delay = max_delay
+        self._max_attempts = max_attempts
+        self._period = period
+        self._failures = 0
+        self._trips = 0
+
+    def failed(self):
+        '''
+        Record a failure and get the delay in seconds until the next attempt.
+        '''
+        self._failures += 1
+        if self._failures > self._max_attempts:
+            self._failures = 0
+            self._trips += 1
+            return self._period
+        return min(self._delay * 2 ** (self._failures - 1), self._max_delay)
+
+    def succeeded(self):
+        '''
+        Record a success.
+        '''
+        self._failures = 0
+
+    def get_trips(self):
+        '''
+        Get the number of times that the breaker tripped.
+        '''
+        return self._trips
+
+
+class _Task(object):
+    '''
+    A method accessing the USB device, waiting for the I/O thread.
+    '''
+
+    __slots__ = ('method', 'args', 'future', 'channels', 'priority',
+                 'expires', 'submitted')
+
+    def __init__(self, method, args, task_future, channels, priority,
+                 expires=False):
+        '''
+        Constructor.
+        :param method: the method
+        :param args: the method's arguments
+        :param task_future: the future to set
+        :param channels: the frozenset of channels that the method sets
+        :param priority: a priorities member
+        :param expires: whether the task is dropped when older than the TTL
+        '''
+        self.method = method
+        self.args = args
+        self.future = task_future
+        self.channels = channels
+        self.priority = priority
+        self.expires = expires
+        self.submitted = time.time()
+
+
+class _IoQueue(object):
+    '''
+    The I/O thread's queue of tasks. The newest task for a set of channels
+    wins: it replaces the waiting tasks that set no other channels. Tasks
+    that expire (commands) are dropped when older than the TTL.
+
+    The most urgent task goes first, but only ahead of tasks for other
+    channels, so that the lights end up as submitted. A task's priority rises
+    by one for every aging period waited, so that a low priority task is only
+    overtaken by tasks submitted less than two aging periods after it.
+    '''
+
+    def __init__(self, ttl, aging_period=_AGING_PERIOD):
+        '''
+        Constructor.
+        :param ttl: the period in seconds after which a task is dropped;
+                    never if None
+        :param aging_period: the period in seconds after which a waiting
+                             task's priority rises by one
+        '''
+        self._ttl = ttl
+        self._aging_period = aging_period
+        self._tasks = []
+        self._condition = threading.Condition()
+        self._coalesced = 0
+        self._expired = 0
+        self._latencies = dict((priority, [0, 0.0, 0.0])
+                               for priority in priorities.PRIORITIES)
+
+    def put(self, task):
+        '''
+        Queue a task, replacing the tasks it supersedes.
+        :param task: a _Task, or None to tell the I/O thread to stop
+        '''
+        superseded = []
+        with self._condition:
+            if not task is None and not task.channels is None:
+                for waiting in list(self._tasks):
+                    if (not waiting is None and
+                        not waiting.channels is None and
+                        waiting.channels <= task.channels):
+                        self._tasks.remove(waiting)
+                        superseded.append(waiting)
+                self._coalesced += len(superseded)
+            self._tasks.append(task)
+            self._condition.notify()
+        for waiting in superseded:
+            waiting.future.set_result(None)
+
+    def get(self, limit=1, can_batch=None):
+        '''
+        Wait for the most urgent tasks that have not expired: the first one
+        and, up to the limit, the ones after it that can be batched with it.
+        :param limit: the maximum number of tasks
+        :param can_batch: a method checking whether a task can be batched
+        '''
+        while True:
+            tasks = []
+            expired = []
+            with self._condition:
+                while len(self._tasks) == 0:
+                    self._condition.wait()
+                now = time.time()
+                while len(self._tasks) > 0 and len(tasks) < limit:
+                    index = self._select(now)
+                    task = self._tasks[index]
+                    batchable = (not task is None and not can_batch is None
+                                 and can_batch(task))
+                    if len(tasks) > 0 and not batchable:
+                        break
+                    self._tasks.pop(index)
+                    if (not task is None and task.expires and
+                        not self._ttl is None and
+                        now - task.submitted > self._ttl):
+                        expired.append(task)
+                        continue
+                    tasks.append(task)
+                    if not batchable:
+                        break
+                self._expired += len(expired)
+            for task in expired:
+                task.future.set_result(False)
+            if len(tasks) > 0:
+                return tasks
+
+    def clear(self):
+        '''
+        Remove all the tasks, failing them.
+        '''
+        with self._condition:
+            tasks = [task for task in self._tasks if not task is None]
+            self._tasks = []
+        for task in tasks:
+            task.future.set_result(False)
+
+    def task_done(self, task):
+        '''
+        Record the latency of a task done.
+        :param task: a _Task
+        '''
+        latency = time.time() - task.submitted
+        with self._condition:
+            stats = self._latencies.setdefault(task.priority, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += latency
+            stats[2] = max(stats[2], latency)
+
+    def get_coalesced(self):
+        '''
+        Get the number of tasks replaced by a later one.
+        '''
+        return self._coalesced
+
+    def get_expired(self):
+        '''
+        Get the number of tasks dropped for being older than the TTL.
+        '''
+        return self._expired
+
+    def get_latency(self, priority):
+        '''
+        Get the (count, average, maximum) tuple of the latencies of the tasks
+        of a priority done.
+        :param priority: a priorities member
+        '''
+        with self._condition:
+            (count, total, maximum) = self._latencies.get(priority,
+                                                          [0, 0.0, 0.0])
+        return (count, total / count if count > 0 else 0.0, maximum)
+
+    def _select(self, now):
+        '''
+        Get the index of the most urgent task that can go first, i.e. that
+        shares no channels with the tasks ahead of it.
+        :param now: the current time
+        '''
+        selected = 0
+        selected_priority = None
+        channels_ahead = frozenset()
+        for (index, task) in enumerate(self._tasks):
+            # Nothing overtakes, or is overtaken by, a task for all channels
+            if task is None or task.channels is None:
+                if index == 0:
+                    return 0
+                break
+            if not channels_ahead.isdisjoint(task.channels):
+                channels_ahead |= task.channels
+                continue
+            channels_ahead |= task.channels
+            priority = (task.priority -
+                        (now - task.submitted) / self._aging_period)
+            if selected_priority is None or priority < selected_priority:
+                selected = index
+                selected_priority = priority
+        return selected
@@ -14,15 +14,36 @@
 
 # System imports
 import logging
+import os
+import select
+import socket
 import threading
 from time import sleep
 
+# Local imports
+import usb_topology
+
 # Constants
 _VENDOR_ID_KEY = 'ID_VENDOR_ID'
 _PRODUCT_ID_KEY = 'ID_MODEL_ID'
 _ACTION_KEY = 'ACTION'
 _ADD_ACTION = 'add'
 _REMOVE_ACTION = 'remove'
+# Kernel uevents, as received by udev itself (linux/netlink.h)
+_NETLINK_KOBJECT_UEVENT = 15
+_UEVENT_KERNEL_GROUP = 1
+_UEVENT_BUFFER_SIZE = 8192
+_UEVENT_TIMEOUT = 0.5
+_UEVENT_ACTION_KEY = 'ACTION'
+_UEVENT_SUBSYSTEM_KEY = 'SUBSYSTEM'
+_UEVENT_DEVTYPE_KEY = 'DEVTYPE'
+_UEVENT_PRODUCT_KEY = 'PRODUCT'
+_USB_SUBSYSTEM = 'usb'
+_USB_DEVICE_DEVTYPE = 'usb_device'
+# The USB devices present, with their VID and PID as 4 hex digits
+_USB_SYSFS_PATH = '/sys/bus/usb/devices'
+_SYSFS_VENDOR_ID_FILE = 'idVendor'
+_SYSFS_PRODUCT_ID_FILE = 'idProduct'
 
 
 class BaseDeviceMonitor(object):
@@ -83,15 +104,24 @@ class PyUdevDeviceMonitor(BaseDeviceMonitor):
                  vendor_id,
                  product_id,
                  udev_module,
+                 topology_index=None,
+                 tag=None,
                  logger=logging.basicConfig()):
         '''
         Constructor.
         :param vendor_id: the USB device's vendor ID
         :param product_id: the USB device's product ID
         :param callback: the method to evoke when the monitored device changed
+        :param topology_index: the usb_topology.UsbTopologyIndex invalidated
+                               by the device events; the shared one if None
+        :param tag: the udev tag of the devices to receive the events of, as
+                    set by the udev rules; all USB devices if None or empty
         :param logger: local logger instance
         '''
         super(type(self), self).__init__(logger=logger)
+        if topology_index is None:
+            topology_index = usb_topology.get_shared_index()
+        self._topology_index = topology_index
         # pyudev provide the values as hex strings, without the 0x prefix
         # and exactly 4 digits, e.g. 0xa12b becomes a12b
         self._vendor_id = vendor_id
@@ -104,6 +134,8 @@ class PyUdevDeviceMonitor(BaseDeviceMonitor):
             self._logger.debug('Device event handler invoked for '
                                'vid_%0#6x, pid_%0#6x',
                                vendor_id, product_id)
+            # Any device added or removed changes the bus
+            self._topology_index.invalidate(vendor_id, product_id)
             if (not vendor_id == self._vendor_id or
                 not product_id == self._product_id):
                     self._logger.debug('Device does not match the \
@@ -124,8 +156,13 @@ class PyUdevDeviceMonitor(BaseDeviceMonitor):
                 self._logger.debug('Unknown device event or no handler')
 
         context = udev_module.Context()
+        self._context = context
+        self._tag = tag
         monitor = udev_module.Monitor.from_netlink(context)
         monitor.filter_by(subsystem='usb', device_type='usb_device')
+        if tag:
+            # Filtered in the kernel, so other devices' events never wake us
+            monitor.filter_by_tag(tag)
 
         # Note that the observer runs by default as a daemon thread
         self._observer = (udev_module.
@@ -142,8 +179,9 @@ class PyUdevDeviceMonitor(BaseDeviceMonitor):
             if self.running:
                 self._logger.warn("Device monitor already started")
                 return
-            self.running = True
             self._observer.start()
+            self.running = True
+            self._enumerate()
             self._logger.info("Device monitor started")
 
     def stop(self):
@@ -161,6 +199,38 @@ class PyUdevDeviceMonitor(BaseDeviceMonitor):
             self.running = False
             self._logger.info("Device monitor stopped")
 
+    def _enumerate(self):
+        '''
+        Invoke the add event handler if the device is present already, i.e.
+        was plugged in before the monitor started. Any event for it since
+        the monitor started may invoke it again.
+        '''
+        add_event_handler = self._get_add_event_handler()
+        if add_event_handler is None:
+            return
+        try:
+            devices = self._context.list_devices(subsystem='usb',
+                                                 DEVTYPE='usb_device')
+            if self._tag:
+                devices = devices.match_tag(self._tag)
+            present = False
+            for device in devices:
+                try:
+                    vendor_id = int(device[_VENDOR_ID_KEY], 16)
+                    product_id = int(device[_PRODUCT_ID_KEY], 16)
+                except (KeyError, ValueError):
+                    continue
+                if (vendor_id == self._vendor_id and
+                        product_id == self._product_id):
+                    present = True
+                    break
+        except Exception, e:
+            self._logger.warn('Enumerating devices failed: {0}'.format(e))
+            return
+        if present:
+            self._logger.info('Device present on start-up')
+            add_event_handler()
+
 
 class PollingDeviceMonitor(BaseDeviceMonitor):
     '''
@@ -180,6 +250,7 @@ class PollingDeviceMonitor(BaseDeviceMonitor):
         super(type(self), self).__init__(logger=logger)
         self._polling_interval = polling_interval
         self._device = device
+        self._executor = _call
         self._thread = threading.Thread(target=self._run)
 
     def start(self):
@@ -192,6 +263,13 @@ class PollingDeviceMonitor(BaseDeviceMonitor):
                 self._logger.warn("Device monitor already started")
                 return
             self.running = True
+            # Poll right away, so that a device present already is added
+            # before starting returns; polling again later if this fails
+            try:
+                self._poll()
+            except Exception, e:
+                self._logger.warn('Polling the device failed: {0}'.
+                                  format(e))
             self._thread.start()
             self._logger.info("Device monitor started")
 
@@ -214,25 +292,252 @@ class PollingDeviceMonitor(BaseDeviceMonitor):
         Polling thread.
         '''
         while self.running:
-            # Transition from open to close (removed)
-            if self._device.is_open():
-                try:
-                    self._logger.debug('Device open - polling')
-                    if not self._device.poll():
-                        self._device.close()
-                        self._get_remove_event_handler()()
-                except IOError:
-                    self._device.close()
-                    self._get_remove_event_handler()()
-            # Transition from close to open (added)
-            else:
-                try:
-                    self._logger.debug('Trying to open device')
-                    self._device.open()
-                    if not self._get_add_event_handler() is None:
-                        self._get_add_event_handler()()
-                except IOError:
-                    pass
             self._logger.debug('Sleeping for {0} second(s)'.
                                format(self._polling_interval))
             sleep(self._polling_interval)
+            if self.running:
+                self._poll()
+
+    def set_executor(self, executor):
+        '''
+        Set the method through which the device is accessed, e.g. so that a
+        device controller does all USB I/O on a single thread.
+        :param executor: a method that calls the parameterless method given
+                         and returns its result
+        '''
+        self._executor = executor
+
+    def _poll(self):
+        '''
+        Poll the device once, invoking the remove event handler if it was
+        open and fails, or the add event handler if it could be opened.
+        '''
+        action = self._executor(self._probe)
+        if action == _ADD_ACTION:
+            handler = self._get_add_event_handler()
+        elif action == _REMOVE_ACTION:
+            handler = self._get_remove_event_handler()
+        else:
+            return
+        if not handler is None:
+            handler()
+
+    def _probe(self):
+        '''
+        Poll the device if open, closing it if it fails, or else try to open
+        it. Get the resulting event's action, if any.
+        '''
+        # Transition from open to close (removed)
+        if self._device.is_open():
+            try:
+                self._logger.debug('Device open - polling')
+                if self._device.poll():
+                    return None
+            except IOError:
+                pass
+            self._device.close()
+            return _REMOVE_ACTION
+        # Transition from close to open (added)
+        try:
+            self._logger.debug('Trying to open device')
+            self._device.open()
+        except IOError:
+            return None
+        return _ADD_ACTION
+
+
+class NetlinkDeviceMonitor(BaseDeviceMonitor):
+    '''
+    A device monitor receiving the kernel's uevents from a netlink socket
+    directly, i.e. without pyudev or libudev, for detecting when a specific
+    USB device is connected or disconnected. Note that the kernel sends an
+    event before udev has applied its rules to the device.
+    '''
+
+    def __init__(self,
+                 vendor_id,
+                 product_id,
+                 sock=None,
+                 topology_index=None,
+                 sysfs_path=_USB_SYSFS_PATH,
+                 logger=logging.basicConfig()):
+        '''
+        Constructor.
+        :param vendor_id: the USB device's vendor ID
+        :param product_id: the USB device's product ID
+        :param sock: the socket to receive uevent datagrams from; a netlink
+                     socket bound to the kernel's uevents when started if
+                     None
+        :param topology_index: the usb_topology.UsbTopologyIndex invalidated
+                               by the device events; the shared one if None
+        :param sysfs_path: the sysfs directory listing the USB devices
+                           present
+        :param logger: local logger instance
+        '''
+        super(type(self), self).__init__(logger=logger)
+        if topology_index is None:
+            topology_index = usb_topology.get_shared_index()
+        self._topology_index = topology_index
+        self._vendor_id = vendor_id
+        self._product_id = product_id
+        self._sysfs_path = sysfs_path
+        self._socket = sock
+        self._owns_socket = sock is None
+        self._thread = None
+        # Every datagram is received into this buffer and parsed in place
+        self._buffer = bytearray(_UEVENT_BUFFER_SIZE)
+
+    def start(self):
+        '''
+        Start the device monitor.
+        '''
+        self._logger.info("Device monitor starting")
+        with self._runLock:
+            if self.running:
+                self._logger.warn("Device monitor already started")
+                return
+            if self._owns_socket:
+                self._socket = socket.socket(socket.AF_NETLINK,
+                                             socket.SOCK_DGRAM,
+                                             _NETLINK_KOBJECT_UEVENT)
+                self._socket.bind((0, _UEVENT_KERNEL_GROUP))
+            self.running = True
+            self._thread = threading.Thread(target=self._run,
+                                            name='device_observer')
+            self._thread.daemon = True
+            self._thread.start()
+            self._enumerate()
+            self._logger.info("Device monitor started")
+
+    def stop(self):
+        '''
+        Stop the device monitor.
+        '''
+        self._logger.info("Device monitor stopping")
+        with self._runLock:
+            if not self.running:
+                self._logger.warn("Device monitor already stopped")
+                return
+            self.running = False
+            self._thread.join()
+            self._thread = None
+            if self._owns_socket:
+                self._socket.close()
+                self._socket = None
+            self._logger.info("Device monitor stopped")
+
+    def _enumerate(self):
+        '''
+        Invoke the add event handler if the device is present already, i.e.
+        was plugged in before the monitor started, as listed in sysfs. Any
+        event for it since the monitor started may invoke it again.
+        '''
+        add_event_handler = self._get_add_event_handler()
+        if add_event_handler is None:
+            return
+        try:
+            names = os.listdir(self._sysfs_path)
+        except OSError, e:
+            self._logger.warn('Enumerating devices failed: {0}'.format(e))
+            return
+        for name in names:
+            path = os.path.join(self._sysfs_path, name)
+            try:
+                with open(os.path.join(path, _SYSFS_VENDOR_ID_FILE)) as f:
+                    vendor_id = int(f.read(), 16)
+                with open(os.path.join(path, _SYSFS_PRODUCT_ID_FILE)) as f:
+                    product_id = int(f.read(), 16)
+            except (IOError, ValueError):
+                # Interfaces have no IDs
+                continue
+            if (vendor_id == self._vendor_id and
+                    product_id == self._product_id):
+                self._logger.info('Device present on start-up')
+                add_event_handler()
+                return
+
+    def _run(self):
+        '''
+        Receiving thread.
+        '''
+        while self.running:
+            try:
+                (readable, _, _) = select.select([self._socket], [], [],
+                                                 _UEVENT_TIMEOUT)
+                if len(readable) == 0:
+                    continue
+                (length, address) = self._socket.recvfrom_into(self._buffer)
+            except (select.error, socket.error), e:
+                self._logger.error('Receiving uevents failed: {0}'.format(e))
+                sleep(_UEVENT_TIMEOUT)
+                continue
+            # Only the kernel (port 0) sends uevents; ignore anyone else
+            if isinstance(address, tuple) and not address[0] == 0:
+                continue
+            self._handle_uevent(length)
+
+    def _handle_uevent(self, length):
+        '''
+        Handle a uevent received into the buffer, invoking the add or remove
+        event handler if for the device.
+        :param length: the uevent's length in bytes
+        '''
+        subsystem = _get_uevent_value(self._buffer,
+                                      length,
+                                      _UEVENT_SUBSYSTEM_KEY)
+        devtype = _get_uevent_value(self._buffer, length, _UEVENT_DEVTYPE_KEY)
+        if (not subsystem == _USB_SUBSYSTEM or
+                not devtype == _USB_DEVICE_DEVTYPE):
+            return
+        # PRODUCT=<VID>/<PID>/<bcdDevice>, in hex without leading zeros
+        product = _get_uevent_value(self._buffer, length, _UEVENT_PRODUCT_KEY)
+        try:
+            (vendor_id, product_id) = [int(value, 16) for value in
+                                       product.split('/')[0:2]]
+        except (AttributeError, ValueError):
+            self._logger.debug('Invalid uevent product: {0}'.format(product))
+            return
+        self._logger.debug('Device event handler invoked for '
+                           'vid_%0#6x, pid_%0#6x',
+                           vendor_id, product_id)
+        # Any device added or removed changes the bus
+        self._topology_index.invalidate(vendor_id, product_id)
+        if (not vendor_id == self._vendor_id or
+                not product_id == self._product_id):
+            return
+        action = _get_uevent_value(self._buffer, length, _UEVENT_ACTION_KEY)
+        add_event_handler = self._get_add_event_handler()
+        remove_event_handler = self._get_remove_event_handler()
+        if action == _ADD_ACTION and not add_event_handler is None:
+            add_event_handler()
+        elif action == _REMOVE_ACTION and not remove_event_handler is None:
+            remove_event_handler()
+        else:
+            self._logger.debug('Unknown device event or no handler')
+
+
+def _get_uevent_value(data, length, key):
+    '''
+    Get the value of a key of a uevent, i.e. of an <action>@<devpath> header
+    followed by <key>=<value> pairs, all null-terminated. Only the value is
+    copied; None if the uevent has no such key.
+    :param data: the buffer holding the uevent
+    :param length: the uevent's length in bytes
+    :param key: the key
+    '''
+    start = data.find('\0' + key + '=', 0, length)
+    if start == -1:
+        return None
+    start += len(key) + 2
+    end = data.find('\0', start, length)
+    if end == -1:
+        end = length
+    return str(data[start:end])
+
+
+def _call(method):
+    '''
+    Call a method and get its result.
+    :param method: a parameterless method
+    '''
+    return method()
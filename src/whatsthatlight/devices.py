@@ -13,11 +13,44 @@
 # limitations under the License.
 
 # System imports
+import array
+import collections
+import errno
+import fcntl
 import importlib
+import os
+import select
+import threading
 
 # Local imports
+import usb_events
+import usb_topology
 from common import parser
 from common import utils
+from common.future import Future, FutureTimeoutException
+from common.rtt_estimator import RttEstimator
+
+# Constants
+_HIDRAW_SYSFS_PATH = '/sys/class/hidraw'
+_HID_ID_KEY = 'HID_ID'
+_HID_REPORT_DESCRIPTOR_FILE = 'report_descriptor'
+# HID report descriptor items (HID 1.11, 6.2.2), by their prefix without the
+# size, and the sizes of a short item's data
+_HID_USAGE_PAGE_ITEM = 0x04
+_HID_USAGE_ITEM = 0x08
+_HID_LONG_ITEM = 0xfe
+_HID_ITEM_SIZES = (0, 1, 2, 4)
+# The hidraw ioctl (linux/hidraw.h) type and numbers for feature reports
+_HIDIOC_TYPE = ord('H')
+_HIDIOCSFEATURE_NUMBER = 0x06
+_HIDIOCGFEATURE_NUMBER = 0x07
+# The timeout of asynchronous transfers (in milliseconds)
+_TRANSFER_TIMEOUT = 1000
+# The blink(1) feature report size and HID class requests
+_BLINK1_REPORT_SIZE = 8
+_HID_SET_REPORT = 0x09
+_HID_GET_REPORT = 0x01
+_BLINK1_REPORT_VALUE = (3 << 8) | 0x01
 
 
 class DeviceError(Exception):
@@ -54,6 +87,7 @@ class TeensyDevice(object):
         '''
         self._packet_size = 64
         self._timeout = 50
+        self._rtt_estimator = RttEstimator()
         self._vendor_id = vendor_id
         self._product_id = product_id
         self._usage_page = usage_page
@@ -82,6 +116,7 @@ class TeensyDevice(object):
         '''
         Open the device for communication.
         '''
+        self._rtt_estimator.reset()
         self._device.open(self._vendor_id,
                           self._product_id,
                           self._usage_page,
@@ -99,12 +134,21 @@ class TeensyDevice(object):
         :param data: the binary data
         '''
         self._device.send(data, self._timeout)
+        self._rtt_estimator.sent()
 
     def receive(self):
         '''
-        Receive binary data.
+        Receive binary data, with a timeout adapted to the round-trip time.
         '''
-        return self._device.recv(self._packet_size, self._timeout)
+        def _recv(timeout):
+            return self._device.recv(self._packet_size, timeout)
+        return self._rtt_estimator.receive(_recv)
+
+    def get_rtt_estimator(self):
+        '''
+        Get the round-trip time estimator, e.g. for its statistics.
+        '''
+        return self._rtt_estimator
 
     def poll(self):
         '''
@@ -130,16 +174,22 @@ class PyUsbDevice(object):
     def __init__(self,
                  vendor_id,
                  product_id,
-                 interface_number):
+                 interface_number,
+                 topology_index=None):
         '''
         Constructor.
         :param vendor_id: the device's VID
         :param product_id: the device's PID
         :param interface_number: the device's interface number to use
+        :param topology_index: the usb_topology.UsbTopologyIndex to find the
+                               device in; the shared one if None
         '''
         self._vendor_id = vendor_id
         self._product_id = product_id
         self._interface_number = interface_number
+        if topology_index is None:
+            topology_index = usb_topology.get_shared_index()
+        self._topology_index = topology_index
         self._clear()
         self._pyusb = importlib.import_module('usb')
 
@@ -169,8 +219,8 @@ class PyUsbDevice(object):
         Open the device for communication.
         '''
         self._clear()
-        device = self._pyusb.core.find(idVendor=self.get_vendor_id(),
-                                       idProduct=self.get_product_id())
+        device = self._topology_index.get_device(self.get_vendor_id(),
+                                                 self.get_product_id())
         if device is None:
             raise IOError('Device could not be found')
         self._device = device
@@ -199,7 +249,11 @@ class PyUsbDevice(object):
         '''
         if not self.is_open():
             raise DeviceError('The device is not open')
-        number_of_bytes = self._bulk_out_endpoint.write(data)
+        try:
+            number_of_bytes = self._bulk_out_endpoint.write(data)
+        except IOError:
+            self._forget()
+            raise
         if not number_of_bytes == len(data):
             raise IOError('There was a problem sending the data: \
                            written {0} bytes, but expected {1} bytes '.
@@ -211,13 +265,22 @@ class PyUsbDevice(object):
         '''
         if not self.is_open():
             raise DeviceError('The device is not open')
-        data = self._bulk_in_endpoint.read(self.get_packet_size())
-        if not len(data) == self._bulk_in_endpoint.wMaxPacketSize:
+        packet_size = self.get_packet_size()
+        if (self._receive_buffer is None or
+                not len(self._receive_buffer) == packet_size):
+            self._receive_buffer = array.array('B', '\0' * packet_size)
+        try:
+            number_of_bytes = self._bulk_in_endpoint.read(
+                                                    self._receive_buffer)
+        except IOError:
+            self._forget()
+            raise
+        if not number_of_bytes == packet_size:
             raise IOError('There was a problem reading the data: \
                            read {0} bytes, but expected {1} bytes'.
-                          format(len(data),
-                                 self._bulk_in_endpoint.wMaxPacketSize))
-        return data.tostring()
+                          format(number_of_bytes, packet_size))
+        # A read-only view, valid until the next receive
+        return buffer(self._receive_buffer)
 
     def poll(self):
         '''
@@ -228,6 +291,14 @@ class PyUsbDevice(object):
         self._logger.debug('\'{0}\''.format(utils.strip(r)))
         assert(parser.is_challenge_response(r))
 
+    def _forget(self):
+        '''
+        Forget the device found after a failed transfer, since it may have
+        been replaced without a hotplug event, so that opening it scans the
+        bus again.
+        '''
+        self._topology_index.invalidate(self._vendor_id, self._product_id)
+
     def _clear(self):
         '''
         Clear the different handlers
@@ -235,6 +306,7 @@ class PyUsbDevice(object):
         self._device = None
         self._bulk_in_endpoint = None
         self._bulk_out_endpoint = None
+        self._receive_buffer = None
 
     def close(self):
         '''
@@ -262,6 +334,7 @@ class HidApiDevice(object):
         '''
         self._packet_size = 64
         self._timeout = 50
+        self._rtt_estimator = RttEstimator()
         self._vendor_id = vendor_id
         self._product_id = product_id
         self._usage_page = usage_page
@@ -290,6 +363,7 @@ class HidApiDevice(object):
         '''
         Open the device for communication.
         '''
+        self._rtt_estimator.reset()
         self._device.open(self._vendor_id,
                           self._product_id,
                           self._usage_page,
@@ -307,12 +381,21 @@ class HidApiDevice(object):
         :param data: the binary data
         '''
         self._device.send(data, self._timeout)
+        self._rtt_estimator.sent()
 
     def receive(self):
         '''
-        Receive binary data.
+        Receive binary data, with a timeout adapted to the round-trip time.
         '''
-        return self._device.recv(self._packet_size, self._timeout)
+        def _recv(timeout):
+            return self._device.recv(self._packet_size, timeout)
+        return self._rtt_estimator.receive(_recv)
+
+    def get_rtt_estimator(self):
+        '''
+        Get the round-trip time estimator, e.g. for its statistics.
+        '''
+        return self._rtt_estimator
 
     def poll(self):
         '''
@@ -330,6 +413,263 @@ class HidApiDevice(object):
         self._device.close()
 
 
+class HidrawDevice(object):
+    '''
+    Wrapper class for an HID device using the Linux hidraw driver directly,
+    i.e. without libusb or any other module, and without detaching the
+    kernel driver. Reports are written to and read from /dev/hidrawN;
+    feature reports are sent and received with ioctls, which is how data is
+    sent and received instead for Control transfers (e.g. to a blink(1)).
+    '''
+
+    def __init__(self,
+                 vendor_id,
+                 product_id,
+                 usage_page=None,
+                 usage=None,
+                 path=None,
+                 sysfs_path=_HIDRAW_SYSFS_PATH,
+                 feature_reports=False):
+        '''
+        Constructor.
+        :param vendor_id: the device's VID
+        :param product_id: the device's PID
+        :param usage_page: the usage page of the device's interface to use,
+                           if it has several
+        :param usage: the usage of the device's interface to use, if it has
+                      several
+        :param path: the device's node, e.g. /dev/hidraw0; found by its VID
+                     and PID (and usage page and usage) when opened if None
+        :param sysfs_path: the sysfs directory listing the hidraw devices
+        :param feature_reports: whether data is sent and received as feature
+                                reports, the report number first, instead
+                                of as output and input reports
+        '''
+        self._feature_reports = feature_reports
+        if feature_reports:
+            self._packet_size = _BLINK1_REPORT_SIZE
+        else:
+            self._packet_size = 64
+        self._rtt_estimator = RttEstimator()
+        self._vendor_id = vendor_id
+        self._product_id = product_id
+        self._usage_page = usage_page
+        self._usage = usage
+        self._path = path
+        self._sysfs_path = sysfs_path
+        self._fd = None
+        # The number of the feature report received, as last sent
+        self._report_number = 1
+        # The report number (0, i.e. unnumbered) followed by the data
+        self._report = bytearray(self._packet_size + 1)
+
+    def get_vendor_id(self):
+        '''
+        Get the vendor ID of the device.
+        '''
+        return self._vendor_id
+
+    def get_product_id(self):
+        '''
+        Get the product ID of the device.
+        '''
+        return self._product_id
+
+    def get_packet_size(self):
+        '''
+        Get the size for sending data.
+        '''
+        return self._packet_size
+
+    def open(self):
+        '''
+        Open the device for communication.
+        '''
+        self.close()
+        self._rtt_estimator.reset()
+        path = self._path
+        if path is None:
+            path = self._find_path()
+        if path is None:
+            raise IOError('Device could not be found')
+        try:
+            self._fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        except OSError, e:
+            raise IOError(e.errno, e.strerror, path)
+
+    def is_open(self):
+        '''
+        Check whether the device is open for communication.
+        '''
+        return not self._fd is None
+
+    def send(self, data):
+        '''
+        Send raw data as an output report, or as a feature report.
+        :param data: the binary data; the report number followed by the
+                     binary data, as a list of bytes, if feature reports
+        '''
+        if not self.is_open():
+            raise IOError('The device is not open')
+        if self._feature_reports:
+            if data is None:
+                return
+            self.send_feature_report(data)
+            self._report_number = data[0]
+            return
+        length = len(data) + 1
+        if length > len(self._report):
+            self._report = bytearray(length)
+        self._report[1:length] = data
+        try:
+            number_of_bytes = os.write(self._fd,
+                                       memoryview(self._report)[:length])
+        except OSError, e:
+            raise IOError(e.errno, e.strerror)
+        if not number_of_bytes == length:
+            raise IOError('There was a problem sending the data: \
+                           written {0} bytes, but expected {1} bytes '.
+                          format(number_of_bytes, length))
+        self._rtt_estimator.sent()
+
+    def receive(self):
+        '''
+        Receive binary data, with a timeout adapted to the round-trip time,
+        or the feature report last sent.
+        '''
+        if not self.is_open():
+            raise IOError('The device is not open')
+        if self._feature_reports:
+            return str(self.get_feature_report(self._report_number,
+                                               self._packet_size))
+
+        def _recv(timeout):
+            (readable, _, _) = select.select([self._fd], [], [],
+                                             timeout / 1000.0)
+            if len(readable) == 0:
+                return ''
+            try:
+                return os.read(self._fd, self._packet_size)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    return ''
+                raise IOError(e.errno, e.strerror)
+        return self._rtt_estimator.receive(_recv)
+
+    def send_feature_report(self, data):
+        '''
+        Send a feature report.
+        :param data: the report number followed by the binary data
+        '''
+        if not self.is_open():
+            raise IOError('The device is not open')
+        report = bytearray(data)
+        fcntl.ioctl(self._fd,
+                    _hidioc(_HIDIOCSFEATURE_NUMBER, len(report)),
+                    report)
+
+    def get_feature_report(self, report_number, size):
+        '''
+        Receive a feature report.
+        :param report_number: the report number
+        :param size: the report size in bytes, including the report number
+        '''
+        if not self.is_open():
+            raise IOError('The device is not open')
+        report = bytearray(size)
+        report[0] = report_number
+        fcntl.ioctl(self._fd,
+                    _hidioc(_HIDIOCGFEATURE_NUMBER, size),
+                    report,
+                    True)
+        return report
+
+    def get_rtt_estimator(self):
+        '''
+        Get the round-trip time estimator, e.g. for its statistics.
+        '''
+        return self._rtt_estimator
+
+    def poll(self):
+        '''
+        Poll the device.
+        '''
+        if self._feature_reports:
+            # 0x76 = 'v' => get version, from a blink(1)
+            self.send([0x01, 0x76, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+            assert self.receive()
+            return True
+        self.send(parser.get_challenge_request())
+        assert(parser.is_challenge_response(self.receive()))
+
+    def close(self):
+        '''
+        Close the device for communication.
+        '''
+        if self._fd is None:
+            return
+        fd = self._fd
+        self._fd = None
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+    def _find_path(self):
+        '''
+        Find the node of the hidraw device with the VID and PID, if any. A
+        device with several HID interfaces has a node for each, so the one
+        with the usage page and usage is chosen then.
+        '''
+        try:
+            names = os.listdir(self._sysfs_path)
+        except OSError:
+            return None
+        # In numerical order, e.g. hidraw2 before hidraw10
+        names.sort(key=lambda name: (len(name), name))
+        found = []
+        for name in names:
+            uevent = os.path.join(self._sysfs_path, name, 'device', 'uevent')
+            try:
+                with open(uevent) as f:
+                    properties = dict(line.rstrip('\n').split('=', 1)
+                                      for line in f if '=' in line)
+            except IOError:
+                continue
+            # HID_ID=<bus>:<VID>:<PID>, in hex
+            hid_id = properties.get(_HID_ID_KEY, '').split(':')
+            if (len(hid_id) == 3 and
+                    int(hid_id[1], 16) == self._vendor_id and
+                    int(hid_id[2], 16) == self._product_id):
+                found.append(name)
+        if len(found) > 1 and not self._usage_page is None:
+            found = [name for name in found if
+                     self._get_usage(name) == (self._usage_page, self._usage)]
+        if len(found) > 1:
+            raise IOError('Several hidraw devices found ({0}); specify the '
+                          'usage page and usage, or the path'.
+                          format(', '.join(found)))
+        if len(found) == 0:
+            return None
+        return os.path.join('/dev', found[0])
+
+    def _get_usage(self, name):
+        '''
+        Get the (usage_page, usage) tuple of a hidraw device's interface,
+        from its report descriptor, if any.
+        :param name: the hidraw device's name, e.g. hidraw0
+        '''
+        path = os.path.join(self._sysfs_path,
+                            name,
+                            'device',
+                            _HID_REPORT_DESCRIPTOR_FILE)
+        try:
+            with open(path, 'rb') as f:
+                return _get_top_level_usage(f.read())
+        except IOError:
+            return None
+
+
 class Blink1Device(object):
     '''
     Wrapper class for a blink(1) device using PyUSB
@@ -340,16 +680,22 @@ class Blink1Device(object):
     def __init__(self,
                  vendor_id,
                  product_id,
-                 interface_number):
+                 interface_number,
+                 topology_index=None):
         '''
         Constructor.
         :param vendor_id: the device's VID
         :param product_id: the device's PID
         :param interface_number: the device's interface number to use
+        :param topology_index: the usb_topology.UsbTopologyIndex to find the
+                               device in; the shared one if None
         '''
         self._vendor_id = vendor_id
         self._product_id = product_id
         self._interface_number = interface_number
+        if topology_index is None:
+            topology_index = usb_topology.get_shared_index()
+        self._topology_index = topology_index
         self._clear()
         self._pyusb = importlib.import_module('usb')
 
@@ -379,8 +725,8 @@ class Blink1Device(object):
         Open the device for communication.
         '''
         self._clear()
-        device = self._pyusb.core.find(idVendor=self.get_vendor_id(),
-                                       idProduct=self.get_product_id())
+        device = self._topology_index.get_device(self.get_vendor_id(),
+                                                 self.get_product_id())
         if device is None:
             raise IOError('Device could not be found')
         self._device = device
@@ -389,6 +735,15 @@ class Blink1Device(object):
             self._device.set_configuration()
         except:
             pass
+        util = self._pyusb.util
+        self._request_type_out = util.build_request_type(
+                                    util.CTRL_OUT,
+                                    util.CTRL_TYPE_CLASS,
+                                    util.CTRL_RECIPIENT_INTERFACE)
+        self._request_type_in = util.build_request_type(
+                                    util.CTRL_IN,
+                                    util.CTRL_TYPE_CLASS,
+                                    util.CTRL_RECIPIENT_INTERFACE)
 
     def is_open(self):
         '''
@@ -405,15 +760,16 @@ class Blink1Device(object):
             return
         if not self.is_open():
             raise DeviceError('The device is not open')
-        bm_request_type_out = self._pyusb.util.build_request_type(
-                                    self._pyusb.util.CTRL_OUT,
-                                    self._pyusb.util.CTRL_TYPE_CLASS,
-                                    self._pyusb.util.CTRL_RECIPIENT_INTERFACE)
-        number_of_bytes = self._device.ctrl_transfer(bm_request_type_out,
-                                                     0x09,
-                                                     (3 << 8) | 0x01,
-                                                     0,
-                                                     data)
+        try:
+            number_of_bytes = self._device.ctrl_transfer(
+                                                    self._request_type_out,
+                                                    0x09,
+                                                    (3 << 8) | 0x01,
+                                                    0,
+                                                    data)
+        except IOError:
+            self._forget()
+            raise
         if not number_of_bytes == len(data):
             raise IOError('There was a problem sending the data: \
                            written {0} bytes, but expected {1} bytes '.
@@ -425,15 +781,15 @@ class Blink1Device(object):
         '''
         if not self.is_open():
             raise DeviceError('The device is not open')
-        bm_request_type_in = self._pyusb.util.build_request_type(
-                                    self._pyusb.util.CTRL_IN,
-                                    self._pyusb.util.CTRL_TYPE_CLASS,
-                                    self._pyusb.util.CTRL_RECIPIENT_INTERFACE)
-        data = self._device.ctrl_transfer(bm_request_type_in,
-                                          0x01,
-                                          (3 << 8) | 0x01,
-                                          0,
-                                          8)
+        try:
+            data = self._device.ctrl_transfer(self._request_type_in,
+                                              0x01,
+                                              (3 << 8) | 0x01,
+                                              0,
+                                              8)
+        except IOError:
+            self._forget()
+            raise
         return data
 
     def poll(self):
@@ -445,6 +801,14 @@ class Blink1Device(object):
         assert self.receive()
         return True
 
+    def _forget(self):
+        '''
+        Forget the device found after a failed transfer, since it may have
+        been replaced without a hotplug event, so that opening it scans the
+        bus again.
+        '''
+        self._topology_index.invalidate(self._vendor_id, self._product_id)
+
     def _clear(self):
         '''
         Clear the different handlers
@@ -452,9 +816,434 @@ class Blink1Device(object):
         self._device = None
         self._bulk_in_endpoint = None
         self._bulk_out_endpoint = None
+        self._request_type_out = None
+        self._request_type_in = None
 
     def close(self):
         '''
         Close the device for communication.
         '''
         self._clear()
+
+
+class _AsyncUsbDevice(object):
+    '''
+    Base class for a device using libusb's asynchronous API (the usb1
+    module). Transfers are submitted and complete on a USB event thread,
+    which many devices can share. Sending returns once the transfer is
+    submitted with a copy of the data (libusb sends from the buffer given,
+    while the caller may reuse its own), so that several transfers can be
+    in flight; a failed send is raised by the next send or receive.
+    '''
+
+    def __init__(self,
+                 vendor_id,
+                 product_id,
+                 interface_number,
+                 set_up_send,
+                 set_up_receive,
+                 event_thread=None):
+        '''
+        Base constructor.
+        :param vendor_id: the device's VID
+        :param product_id: the device's PID
+        :param interface_number: the device's interface number to use
+        :param set_up_send: the method setting up a transfer sending data,
+                            taking the usb1.USBTransfer, its future (as its
+                            user data) and the data
+        :param set_up_receive: the method setting up a transfer receiving
+                               data, taking the usb1.USBTransfer and its
+                               future
+        :param event_thread: the usb_events.UsbEventThread handling the
+                             transfers; the shared one if None
+        '''
+        self._vendor_id = vendor_id
+        self._product_id = product_id
+        self._interface_number = interface_number
+        self._set_up_send = set_up_send
+        self._set_up_receive = set_up_receive
+        self._event_thread = event_thread
+        self._usb1 = importlib.import_module('usb1')
+        self._handle = None
+        # Idle transfers, reused, and the futures of the sends in flight
+        self._transfers = []
+        self._sending = collections.deque()
+        self._lock = threading.Lock()
+
+    def get_vendor_id(self):
+        '''
+        Get the vendor ID of the device.
+        '''
+        return self._vendor_id
+
+    def get_product_id(self):
+        '''
+        Get the product ID of the device.
+        '''
+        return self._product_id
+
+    def open(self):
+        '''
+        Open the device for communication.
+        '''
+        self.close()
+        if self._event_thread is None:
+            self._event_thread = usb_events.get_shared_event_thread()
+        context = self._event_thread.get_context()
+        handle = context.openByVendorIDAndProductID(self._vendor_id,
+                                                    self._product_id,
+                                                    skip_on_error=True)
+        if handle is None:
+            raise IOError('Device could not be found')
+        try:
+            handle.setAutoDetachKernelDriver(True)
+        except:
+            pass
+        try:
+            handle.claimInterface(self._interface_number)
+            self._opened(handle)
+        except self._usb1.USBError, e:
+            handle.close()
+            raise IOError('Device could not be opened: {0}'.format(e))
+        self._handle = handle
+        self._event_thread.acquire()
+
+    def is_open(self):
+        '''
+        Check whether the device is open for communication.
+        '''
+        return not self._handle is None
+
+    def send(self, data):
+        '''
+        Submit raw data to be sent, without waiting for it to be sent.
+        :param data: the binary data
+        '''
+        self._raise_failed_send()
+        self._sending.append(self.submit_send(data))
+
+    def receive(self):
+        '''
+        Wait for the data sent to be sent, then receive raw data.
+        '''
+        while len(self._sending) > 0:
+            self._wait(self._sending.popleft())
+        return self._wait(self.submit_receive())
+
+    def submit_send(self, data):
+        '''
+        Submit raw data to be sent and get a future of the data sent.
+        :param data: the binary data
+        '''
+        return self._submit(self._set_up_send, data)
+
+    def submit_receive(self):
+        '''
+        Submit a receive and get a future of the data received.
+        '''
+        return self._submit(self._set_up_receive)
+
+    def close(self):
+        '''
+        Close the device for communication, cancelling the transfers in
+        flight.
+        '''
+        handle = self._handle
+        if handle is None:
+            return
+        self._handle = None
+        with self._lock:
+            self._transfers = []
+        self._sending.clear()
+        try:
+            handle.releaseInterface(self._interface_number)
+            handle.close()
+        except self._usb1.USBError:
+            pass
+        self._event_thread.release()
+
+    def _opened(self, handle):
+        '''
+        Prepare for transfers once the device is opened.
+        :param handle: the usb1.USBDeviceHandle
+        '''
+        pass
+
+    def _submit(self, set_up, *args):
+        '''
+        Set up and submit a transfer, reusing an idle one if any, and get
+        its future.
+        :param set_up: the method setting up the transfer
+        :param args: the arguments for the method, after the transfer and
+                     future
+        '''
+        handle = self._handle
+        if handle is None:
+            raise IOError('The device is not open')
+        future = Future()
+        with self._lock:
+            if len(self._transfers) > 0:
+                transfer = self._transfers.pop()
+            else:
+                transfer = handle.getTransfer()
+        try:
+            set_up(transfer, future, *args)
+            transfer.submit()
+        except self._usb1.USBError, e:
+            raise IOError('Transfer could not be submitted: {0}'.format(e))
+        return future
+
+    def _completed(self, transfer):
+        '''
+        Set the future of a completed transfer and keep the transfer for
+        reuse. Invoked on the event thread.
+        :param transfer: the usb1.USBTransfer
+        '''
+        future = transfer.getUserData()
+        status = transfer.getStatus()
+        if status == self._usb1.TRANSFER_COMPLETED:
+            length = transfer.getActualLength()
+            future.set_result(str(transfer.getBuffer()[:length]))
+        else:
+            future.set_exception(IOError('Transfer failed with status {0}'.
+                                         format(status)))
+        with self._lock:
+            if not self._handle is None:
+                self._transfers.append(transfer)
+
+    def _wait(self, future):
+        '''
+        Wait for a transfer's data.
+        :param future: the future of the transfer
+        '''
+        try:
+            return future.result(_TRANSFER_TIMEOUT * 2 / 1000.0)
+        except FutureTimeoutException, e:
+            raise IOError(e.message)
+
+    def _raise_failed_send(self):
+        '''
+        Raise the failure of any send completed since the last send.
+        '''
+        while len(self._sending) > 0 and self._sending[0].done():
+            exception = self._sending.popleft().exception()
+            if not exception is None:
+                self._sending.clear()
+                raise exception
+
+
+class AsyncPyUsbDevice(_AsyncUsbDevice):
+    '''
+    Asynchronous counterpart of PyUsbDevice, with bulk transfers.
+    '''
+
+    def __init__(self,
+                 vendor_id,
+                 product_id,
+                 interface_number,
+                 event_thread=None):
+        '''
+        Constructor.
+        :param vendor_id: the device's VID
+        :param product_id: the device's PID
+        :param interface_number: the device's interface number to use
+        :param event_thread: the usb_events.UsbEventThread handling the
+                             transfers; the shared one if None
+        '''
+        super(AsyncPyUsbDevice, self).__init__(vendor_id,
+                                               product_id,
+                                               interface_number,
+                                               self._set_send,
+                                               self._set_receive,
+                                               event_thread)
+        self._bulk_in_address = None
+        self._bulk_out_address = None
+        self._packet_size = None
+
+    def get_packet_size(self):
+        '''
+        Get the size for sending data.
+        '''
+        if not self.is_open():
+            raise DeviceError('Packet size only available if \
+                               the device is connected')
+        return self._packet_size
+
+    def poll(self):
+        '''
+        Poll the device.
+        '''
+        self.send(parser.get_challenge_request())
+        assert(parser.is_challenge_response(self.receive()))
+
+    def _opened(self, handle):
+        '''
+        Find the bulk endpoints once the device is opened.
+        :param handle: the usb1.USBDeviceHandle
+        '''
+        for setting in handle.getDevice().iterSettings():
+            if setting.getNumber() == self._interface_number:
+                endpoints = list(setting)
+                self._bulk_in_address = endpoints[0].getAddress()
+                self._bulk_out_address = endpoints[1].getAddress()
+                self._packet_size = endpoints[0].getMaxPacketSize()
+                return
+        raise IOError('Interface {0} not found'.
+                      format(self._interface_number))
+
+    def _set_send(self, transfer, future, data):
+        '''
+        Set up a bulk transfer sending data.
+        :param transfer: the usb1.USBTransfer
+        :param future: the future of the transfer, as its user data
+        :param data: the binary data
+        '''
+        transfer.setBulk(self._bulk_out_address,
+                         bytearray(data),
+                         callback=self._completed,
+                         user_data=future,
+                         timeout=_TRANSFER_TIMEOUT)
+
+    def _set_receive(self, transfer, future):
+        '''
+        Set up a bulk transfer receiving a packet.
+        :param transfer: the usb1.USBTransfer
+        :param future: the future of the transfer, as its user data
+        '''
+        transfer.setBulk(self._bulk_in_address,
+                         self._packet_size,
+                         callback=self._completed,
+                         user_data=future,
+                         timeout=_TRANSFER_TIMEOUT)
+
+
+class AsyncBlink1Device(_AsyncUsbDevice):
+    '''
+    Asynchronous counterpart of Blink1Device, with control transfers of
+    feature reports.
+    '''
+
+    def __init__(self,
+                 vendor_id,
+                 product_id,
+                 interface_number,
+                 event_thread=None):
+        '''
+        Constructor.
+        :param vendor_id: the device's VID
+        :param product_id: the device's PID
+        :param interface_number: the device's interface number to use
+        :param event_thread: the usb_events.UsbEventThread handling the
+                             transfers; the shared one if None
+        '''
+        super(AsyncBlink1Device, self).__init__(vendor_id,
+                                                product_id,
+                                                interface_number,
+                                                self._set_send,
+                                                self._set_receive,
+                                                event_thread)
+        usb1 = self._usb1
+        self._request_type_out = (usb1.TYPE_CLASS |
+                                  usb1.RECIPIENT_INTERFACE |
+                                  usb1.ENDPOINT_OUT)
+        self._request_type_in = (usb1.TYPE_CLASS |
+                                 usb1.RECIPIENT_INTERFACE |
+                                 usb1.ENDPOINT_IN)
+
+    def get_packet_size(self):
+        '''
+        Get the size for sending data.
+        '''
+        return _BLINK1_REPORT_SIZE
+
+    def send(self, data):
+        '''
+        Submit raw data to be sent, without waiting for it to be sent.
+        :param data: the binary data, as a list of bytes
+        '''
+        if data == None:
+            return
+        super(AsyncBlink1Device, self).send(data)
+
+    def poll(self):
+        '''
+        Poll the device.
+        '''
+        # 0x76 = 'v' => get version
+        self.send([0x00, 0x76, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+        assert self.receive()
+        return True
+
+    def _set_send(self, transfer, future, data):
+        '''
+        Set up a control transfer setting the feature report.
+        :param transfer: the usb1.USBTransfer
+        :param future: the future of the transfer, as its user data
+        :param data: the binary data, as a list of bytes
+        '''
+        transfer.setControl(self._request_type_out,
+                            _HID_SET_REPORT,
+                            _BLINK1_REPORT_VALUE,
+                            0,
+                            bytearray(data),
+                            callback=self._completed,
+                            user_data=future,
+                            timeout=_TRANSFER_TIMEOUT)
+
+    def _set_receive(self, transfer, future):
+        '''
+        Set up a control transfer getting the feature report.
+        :param transfer: the usb1.USBTransfer
+        :param future: the future of the transfer, as its user data
+        '''
+        transfer.setControl(self._request_type_in,
+                            _HID_GET_REPORT,
+                            _BLINK1_REPORT_VALUE,
+                            0,
+                            _BLINK1_REPORT_SIZE,
+                            callback=self._completed,
+                            user_data=future,
+                            timeout=_TRANSFER_TIMEOUT)
+
+
+def _get_top_level_usage(descriptor):
+    '''
+    Get the (usage_page, usage) tuple of the first usage in an HID report
+    descriptor, i.e. of its top-level collection, if any.
+    :param descriptor: the report descriptor
+    '''
+    descriptor = bytearray(descriptor)
+    usage_page = None
+    index = 0
+    while index < len(descriptor):
+        prefix = descriptor[index]
+        if prefix == _HID_LONG_ITEM:
+            if index + 1 == len(descriptor):
+                break
+            # The data's size and the item's tag follow
+            index += 3 + descriptor[index + 1]
+            continue
+        size = _HID_ITEM_SIZES[prefix & 0x03]
+        value = 0
+        for (shift, byte) in enumerate(descriptor[index + 1:
+                                                  index + 1 + size]):
+            value |= byte << (8 * shift)
+        index += 1 + size
+        if prefix & 0xfc == _HID_USAGE_PAGE_ITEM:
+            usage_page = value
+        elif prefix & 0xfc == _HID_USAGE_ITEM:
+            # An extended usage includes its usage page
+            if size == 4:
+                return (value >> 16, value & 0xffff)
+            return (usage_page, value)
+    return None
+
+
+def _hidioc(number, size):
+    '''
+    Get a hidraw feature report ioctl request, i.e. _IOC(_IOC_WRITE |
+    _IOC_READ, 'H', number, size).
+    :param number: the ioctl number
+    :param size: the report size in bytes
+    '''
+    return (3 << 30) | (size << 16) | (_HIDIOC_TYPE << 8) | number
@@ -13,15 +13,27 @@
 # limitations under the License.
 
 # System imports
+import errno
+import fcntl
 import logging
+import os
+import select
 import socket
 import threading
+import time
 
 # Local imports
 from common import config
 from common import packets
+from common import parser
 from common import utils
 
+# Constants
+_ACCEPT_BATCH_SIZE = 16
+_DEFER_ACCEPT_PERIOD = 1
+_IDLE_TIMEOUT = 30
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+
 
 class Listener(object):
     '''
@@ -85,15 +97,21 @@ class Listener(object):
                 self._logger.warn("Listener already stopped")
                 return
             self.running = False
-            self._logger.debug("Bumping the thread out of the blocking accept")
-            try:
-                utils.send(self._address, self._port, '')
-            except Exception, e:
-                self._logger.exception(e)
+            self._wake()
             self._thread.join()
             self._server_socket.close()
             self._logger.info("Listener stopped")
 
+    def _wake(self):
+        '''
+        Wake the listener thread so that it can notice it must stop.
+        '''
+        self._logger.debug("Bumping the thread out of the blocking accept")
+        try:
+            utils.send(self._address, self._port, '')
+        except Exception, e:
+            self._logger.exception(e)
+
     def _run(self):
         '''
         Main listener loop.
@@ -116,3 +134,303 @@ class Listener(object):
         except Exception, e:
             self._logger.exception(e)
             raise
+
+
+class MultiplexingListener(Listener):
+    '''
+    A socket server listener that multiplexes many connections on a single
+    thread, so that a slow or stalled peer cannot hold up any other. It is a
+    drop-in replacement for Listener.
+    '''
+
+    def __init__(self,
+                 logger=logging.basicConfig(),
+                 address=config.CLIENT_ADDRESS_DEFAULT,
+                 port=config.CLIENT_PORT_DEFAULT,
+                 handler=None,
+                 accept_batch_size=_ACCEPT_BATCH_SIZE,
+                 defer_accept_period=_DEFER_ACCEPT_PERIOD,
+                 idle_timeout=_IDLE_TIMEOUT,
+                 persistent=False):
+        '''
+        Constructor.
+        :param logger: local logger instance
+        :param address: the address to listen on; defaults to all interfaces
+        :param port: the port to listen on
+        :param handler: a method to handle received data
+        :param accept_batch_size: the maximum number of pending connections to
+                                  accept per wake-up
+        :param defer_accept_period: seconds the kernel may hold a connection
+                                    until data arrives (Linux only); 0 to
+                                    disable
+        :param idle_timeout: seconds after which a connection without any
+                             activity gets closed; None to never close
+        :param persistent: if True, keep connections open and invoke the
+                           handler once for every terminated message;
+                           otherwise invoke it once per connection
+        '''
+        super(MultiplexingListener, self).__init__(logger=logger,
+                                                   address=address,
+                                                   port=port,
+                                                   handler=handler)
+        self._accept_batch_size = accept_batch_size
+        self._idle_timeout = idle_timeout
+        self._persistent = persistent
+        self._connections = {}
+        self._server_socket.setblocking(False)
+        if defer_accept_period > 0 and hasattr(socket, 'TCP_DEFER_ACCEPT'):
+            self._server_socket.setsockopt(socket.IPPROTO_TCP,
+                                           socket.TCP_DEFER_ACCEPT,
+                                           defer_accept_period)
+
+        # A self-pipe for waking the thread: a connection without data will
+        # not be accepted promptly when deferring accepts.
+        (self._wake_reader, self._wake_writer) = os.pipe()
+        flags = fcntl.fcntl(self._wake_reader, fcntl.F_GETFL)
+        fcntl.fcntl(self._wake_reader, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def _wake(self):
+        '''
+        Wake the listener thread so that it can notice it must stop.
+        '''
+        self._logger.debug("Bumping the thread out of the blocking poll")
+        try:
+            os.write(self._wake_writer, '\0')
+        except OSError, e:
+            # A broken pipe means the thread has already exited
+            if not e.errno == errno.EPIPE:
+                self._logger.exception(e)
+        finally:
+            os.close(self._wake_writer)
+
+    def _run(self):
+        '''
+        Main listener loop.
+        '''
+        poller = _Poller()
+        server_fd = self._server_socket.fileno()
+        poller.register(server_fd)
+        poller.register(self._wake_reader)
+        try:
+            self._runningEvent.set()
+            while self.running:
+                self._logger.debug("Waiting for events on %u connection(s)",
+                                   len(self._connections))
+                for fd in poller.poll(self._idle_timeout):
+                    if fd == server_fd:
+                        self._accept(poller)
+                    elif fd in self._connections:
+                        self._receive(poller, fd)
+                if not self._idle_timeout is None:
+                    self._close_idle_connections(poller)
+        except Exception, e:
+            self._logger.exception(e)
+            raise
+        finally:
+            for fd in self._connections.keys():
+                self._close_connection(poller, fd)
+            poller.close()
+            os.close(self._wake_reader)
+
+    def _accept(self, poller):
+        '''
+        Accept a batch of pending connections.
+        :param poller: the poller to register new connections with
+        '''
+        for _ in xrange(self._accept_batch_size):
+            try:
+                (client_socket, (address, _)) = self._server_socket.accept()
+            except socket.error, e:
+                if not e.errno in _WOULD_BLOCK:
+                    self._logger.warn('Could not accept a connection: %s', e)
+                return
+            self._logger.info('New connection from %s accepted', address)
+            client_socket.setblocking(False)
+            if self._persistent:
+                client_socket.setsockopt(socket.SOL_SOCKET,
+                                         socket.SO_KEEPALIVE,
+                                         True)
+            connection = _Connection(client_socket, address)
+            self._connections[connection.fileno()] = connection
+            poller.register(connection.fileno())
+
+    def _receive(self, poller, fd):
+        '''
+        Read from a connection that has data available. Unless connections
+        are persistent, the connection is closed after the first read.
+        :param poller: the poller the connection is registered with
+        :param fd: the connection's file descriptor
+        '''
+        connection = self._connections[fd]
+        try:
+            data = connection.socket.recv(packets.MAX_SIZE)
+        except socket.error, e:
+            if e.errno in _WOULD_BLOCK:
+                return
+            self._logger.warn('Could not receive data: %s', e)
+            data = ''
+        connection.last_active = time.time()
+
+        if not self._persistent:
+            self._close_connection(poller, fd)
+            # If there's a handler and there's no more data to read,
+            # invoke the handler.
+            if len(data) > 0:
+                self._handle(data)
+            return
+
+        # An empty read means the peer closed the connection
+        if len(data) == 0:
+            if connection.decoder.has_partial_frame():
+                self._logger.warn('Discarding an unterminated message '
+                                  'from %s',
+                                  connection.address)
+            self._close_connection(poller, fd)
+            return
+        for message in connection.decoder.split(data):
+            self._handle(message)
+        if connection.decoder.has_overflowed():
+            self._logger.warn('Message from %s exceeds %u bytes',
+                              connection.address,
+                              packets.MAX_SIZE)
+            self._close_connection(poller, fd)
+
+    def _handle(self, data):
+        '''
+        Invoke the handler, if any, without letting it break the loop.
+        :param data: the data received
+        '''
+        if self._handler is None:
+            return
+        try:
+            self._handler(data)
+        except Exception, e:
+            self._logger.exception(e)
+
+    def _close_idle_connections(self, poller):
+        '''
+        Close all connections that have been idle for too long.
+        :param poller: the poller the connections are registered with
+        '''
+        deadline = time.time() - self._idle_timeout
+        for (fd, connection) in self._connections.items():
+            if connection.last_active < deadline:
+                self._logger.info('Connection from %s timed out',
+                                  connection.address)
+                self._close_connection(poller, fd)
+
+    def _close_connection(self, poller, fd):
+        '''
+        Unregister and close a connection.
+        :param poller: the poller the connection is registered with
+        :param fd: the connection's file descriptor
+        '''
+        connection = self._connections.pop(fd)
+        poller.unregister(fd)
+        connection.socket.close()
+        self._logger.info('Connection closed')
+
+
+class PersistentListener(MultiplexingListener):
+    '''
+    A multiplexing listener that keeps connections open, so that the server
+    can send any number of messages over a single connection.
+    '''
+
+    def __init__(self,
+                 logger=logging.basicConfig(),
+                 address=config.CLIENT_ADDRESS_DEFAULT,
+                 port=config.CLIENT_PORT_DEFAULT,
+                 handler=None):
+        '''
+        Constructor.
+        :param logger: local logger instance
+        :param address: the address to listen on; defaults to all interfaces
+        :param port: the port to listen on
+        :param handler: a method to handle every received message
+        '''
+        super(PersistentListener, self).__init__(logger=logger,
+                                                 address=address,
+                                                 port=port,
+                                                 handler=handler,
+                                                 idle_timeout=None,
+                                                 persistent=True)
+
+
+class _Connection(object):
+    '''
+    An accepted connection and its partially received message.
+    '''
+
+    def __init__(self, client_socket, address):
+        '''
+        Constructor.
+        :param client_socket: the connected socket
+        :param address: the peer's address
+        '''
+        self.socket = client_socket
+        self.address = address
+        self.last_active = time.time()
+        self.decoder = parser.StreamDecoder()
+
+    def fileno(self):
+        '''
+        Get the socket's file descriptor.
+        '''
+        return self.socket.fileno()
+
+
+class _Poller(object):
+    '''
+    A read-readiness poller using epoll where available (Linux) and poll
+    otherwise.
+    '''
+
+    def __init__(self):
+        '''
+        Constructor.
+        '''
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            self._events = select.EPOLLIN
+            self._timeout_scale = 1
+        else:
+            self._poller = select.poll()
+            self._events = select.POLLIN
+            self._timeout_scale = 1000
+
+    def register(self, fd):
+        '''
+        Register a file descriptor for read (and error) events.
+        :param fd: the file descriptor
+        '''
+        self._poller.register(fd, self._events)
+
+    def unregister(self, fd):
+        '''
+        Unregister a file descriptor.
+        :param fd: the file descriptor
+        '''
+        self._poller.unregister(fd)
+
+    def poll(self, timeout):
+        '''
+        Wait for events and return the ready file descriptors.
+        :param timeout: the maximum time to wait in seconds; None to block
+        '''
+        if timeout is None:
+            timeout = -1
+        try:
+            events = self._poller.poll(timeout * self._timeout_scale)
+        except (IOError, select.error), e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        return [fd for (fd, _) in events]
+
+    def close(self):
+        '''
+        Release the poller's resources.
+        '''
+        if hasattr(self._poller, 'close'):
+            self._poller.close()
@@ -19,11 +19,18 @@ import threading
 # Local imports
 import listener
 from common import config
+from common import mapping
 from common import parser
 from common import requests
 from common import utils
 from common import version
 from common import usb_protocol_types
+from common.light_state import LightState
+from common.lru_cache import LruCache
+
+# Constants
+_STATE_CACHE_SIZE = 64
+_MISSING = object()
 
 
 class NotifierClient:
@@ -40,6 +47,8 @@ class NotifierClient:
                  server_port=config.SERVER_PORT_DEFAULT,
                  retry_period=5,
                  usb_protocol_type=usb_protocol_types.DAS_BLINKENLICHTEN,
+                 listener_class=listener.Listener,
+                 light_mapping=None,
                  logger=logging.basicConfig()):
         '''
         Constructor.
@@ -51,6 +60,10 @@ class NotifierClient:
         :param server_port: the notification server's port
         :param retry_period: registration retry period in seconds
         :param usb_protocol_type: the USB protocol used to communicate
+        :param listener_class: the listener class (Listener,
+                               MultiplexingListener or PersistentListener)
+        :param light_mapping: the mapping from requests to lights; defaults to
+                              the mapping registered with the parser
         :param logger: local logger instance
         '''
         self._logger = logger
@@ -60,24 +73,48 @@ class NotifierClient:
         self._server_port = server_port
         self._retry_period = retry_period
         self._retry_timer = None
+        # Registrations are done one at a time; one started before the
+        # device was added, removed or the client stopped (i.e. of an
+        # older generation) is abandoned, and so is its retry
+        self._registering = threading.Lock()
+        self._registration_lock = threading.Lock()
+        self._registration_generation = 0
         self._usb_protocol_type = usb_protocol_type
-        self._listener = listener.Listener(logger=logger,
-                                           address=address,
-                                           port=port,
-                                           handler=self.handle_data)
+        self._state_cache = LruCache(_STATE_CACHE_SIZE)
+        if light_mapping is None:
+            light_mapping = parser.get_mapping()
+        self._light_state = LightState(light_mapping, usb_protocol_type)
+        # The host and user never change, so encode the registration once
+        registration_request = requests.RegistrationRequest(address, username)
+        self._registration_command = parser.encode(registration_request)
+        self._listener = listener_class(logger=logger,
+                                        address=address,
+                                        port=port,
+                                        handler=self.handle_data)
 
         def _device_add_handler():
             self._logger.debug('Invoked')
-            self.register()
+            # The device controller replays the lights as soon as it opened
+            # the device, so the server need not be waited for; register
+            # in parallel to reconcile with it
+            registration = threading.Thread(target=self._register,
+                                            args=(self._new_registration(),))
+            registration.setDaemon(True)
+            registration.start()
 
         def _device_remove_handler():
             self._logger.debug('Invoked')
-            self._stop_registration_timer()
+            self._new_registration()
+            # A new device starts with its lights off
+            self._light_state.reset()
 
         self._device_controller = device_controller
         self._device_controller.set_add_event_handler(_device_add_handler)
         (self._device_controller.
          set_remove_event_handler(_device_remove_handler))
+        # Restore the lights when the device was added or recovered
+        self._device_controller.set_replay_handler(self._light_state.
+                                                   get_command)
         self.running = False
         self._runLock = threading.Lock()
 
@@ -94,8 +131,8 @@ class NotifierClient:
             self._device_controller.start()
             self._listener.start()
             # Status is unknown on start-up
-            request = requests.StatusRequest(False)
-            self.handle_request(request)
+            request = requests.StatusRequest.get_instance(False)
+            self.handle_request(request, force=True)
             self._logger.info("Client started")
             self.running = True
 
@@ -108,10 +145,10 @@ class NotifierClient:
             if not self.running:
                 self._logger.warn("Client already stopped")
                 return
-            self._stop_registration_timer()
+            self._new_registration()
             # Status is unknown after shutdown
-            request = requests.StatusRequest(False)
-            self.handle_request(request)
+            request = requests.StatusRequest.get_instance(False)
+            self.handle_request(request, force=True)
             self._device_controller.stop()
             self._listener.stop()
             self._logger.info("Client stopped")
@@ -121,30 +158,57 @@ class NotifierClient:
         '''
         Register this notifier client with the server.
         '''
-        self._stop_registration_timer()
-        self._logger.info('Registering user %s with host %s',
-                          self._username,
-                          self._address)
-        command = parser.encode(requests.RegistrationRequest(self._address,
-                                                             self._username))
-        try:
-            self._logger.debug('Registering with {0} on port {1}'.
-                               format(self._server_address,
-                                      self._server_port))
-            utils.send(self._server_address, self._server_port, command)
-        except Exception, e:
-            self._logger.warn('Could not register ({0}); '
-                              'will retry in {1} second(s)'.
-                              format(e, self._retry_period))
-            self._start_registration_timer()
+        self._register(self._new_registration())
+
+    def _new_registration(self):
+        '''
+        Abandon any registration and its retry, and get the generation of
+        the next one.
+        '''
+        with self._registration_lock:
+            self._registration_generation += 1
+            self._stop_registration_timer()
+            return self._registration_generation
+
+    def _register(self, generation):
+        '''
+        Register this notifier client with the server, retrying until it
+        succeeds, unless abandoned.
+        :param generation: the generation of the registration
+        '''
+        with self._registering:
+            with self._registration_lock:
+                if not generation == self._registration_generation:
+                    self._logger.debug('Registration abandoned')
+                    return
+            self._logger.info('Registering user %s with host %s',
+                              self._username,
+                              self._address)
+            try:
+                self._logger.debug('Registering with {0} on port {1}'.
+                                   format(self._server_address,
+                                          self._server_port))
+                utils.send(self._server_address,
+                           self._server_port,
+                           self._registration_command)
+            except Exception, e:
+                with self._registration_lock:
+                    if not generation == self._registration_generation:
+                        return
+                    self._logger.warn('Could not register ({0}); '
+                                      'will retry in {1} second(s)'.
+                                      format(e, self._retry_period))
+                    self._start_registration_timer(generation)
 
-    def _start_registration_timer(self):
+    def _start_registration_timer(self, generation):
         '''
         Start the registration timer.
+        :param generation: the generation of the registration to retry
         '''
         self._logger.debug('Starting a new registration timer')
         self._retry_timer = threading.Timer(self._retry_period,
-                                            self.register)
+                                            self._register,
+                                            (generation,))
         self._retry_timer.start()
 
     def _stop_registration_timer(self):
@@ -154,6 +218,7 @@ class NotifierClient:
         if not self._retry_timer is None:
             self._logger.debug('Stopping the registration timer')
             self._retry_timer.cancel()
+            self._retry_timer = None
 
     def handle_data(self, data):
         '''
@@ -162,23 +227,63 @@ class NotifierClient:
         '''
         try:
             self._logger.debug('Data received: {0}'.format(data))
-            request = parser.decode(data)
-            self.handle_request(request)
+            # The server repeats the same few notifications, so skip the
+            # decoding of anything seen before
+            state = self._state_cache.get(data, _MISSING)
+            if state is _MISSING:
+                state = mapping.get_state(parser.decode(data))
+                self._state_cache.put(data, state)
+            self._update_lights(state)
         except Exception, e:
             self._logger.exception(e)
 
-    def handle_request(self, request):
+    def get_state_cache_hits_and_misses(self):
+        '''
+        Get the (hits, misses) tuple for the cache of decoded data.
+        '''
+        return (self._state_cache.get_hits(),
+                self._state_cache.get_misses())
+
+    def get_suppressed_writes(self):
+        '''
+        Get the number of requests that left the lights unchanged, so that
+        nothing was written to the device.
+        '''
+        return self._light_state.get_suppressed_writes()
+
+    def handle_request(self, request, force=False):
         '''
         Handle a request after decoded from data.
         :param request: the decoded request
+        :param force: write all the request's lights, even if unchanged
         '''
         try:
-            if (self._usb_protocol_type ==
-                usb_protocol_types.DAS_BLINKENLICHTEN):
-                command = parser.translate(request)
-            elif (self._usb_protocol_type ==
-                usb_protocol_types.BLINK1):
-                    command = parser.translate_for_blink1(request)
-            self._device_controller.send(command)
+            self._update_lights(mapping.get_state(request), force)
         except Exception, e:
             self._logger.exception(e)
+
+    def _update_lights(self, state, force=False):
+        '''
+        Write the lights of a light state that changed to the device.
+        :param state: a mapping light state
+        :param force: write all the state's lights, even if unchanged
+        '''
+        (command, channels) = self._light_state.update(state, force)
+        if command is None:
+            self._logger.debug('Lights unchanged for {0}'.format(state))
+            return
+        # Never wait on USB I/O
+        write = self._device_controller.submit(command,
+                                               channels,
+                                               mapping.get_priority(state))
+        write.add_done_callback(self._check_write)
+
+    def _check_write(self, write):
+        '''
+        Check whether a device write succeeded.
+        :param write: the future of the device write
+        '''
+        if not write.exception() is None or write.result() is False:
+            # The device may or may not have been written, so write all the
+            # lights next time
+            self._light_state.reset()
@@ -20,12 +20,15 @@ import threading
 import sys
 
 # Local imports
+import listener
 import notifier_client
 from common import argument_parser
 from common import config
 from common import logger
+from common import parser
 from common import usb_protocol_types
 from common import usb_transfer_types
+from common.mapping import InvalidMappingException
 from device_controller import DeviceController
 
 
@@ -84,6 +87,25 @@ def main():
         from devices import Blink1Device
         interface_number = the_config.get_interface_number()
         device = Blink1Device(vendor_id, product_id, interface_number)
+    elif device_class == 'AsyncPyUsbDevice':
+        from devices import AsyncPyUsbDevice
+        interface_number = the_config.get_interface_number()
+        device = AsyncPyUsbDevice(vendor_id, product_id, interface_number)
+    elif device_class == 'AsyncBlink1Device':
+        from devices import AsyncBlink1Device
+        interface_number = the_config.get_interface_number()
+        device = AsyncBlink1Device(vendor_id, product_id, interface_number)
+    elif device_class == 'HidrawDevice':
+        from devices import HidrawDevice
+        (usage_page, usage) = the_config.get_usage_and_usage_page()
+        # Control transfers are done with feature reports
+        feature_reports = the_config.get_usb_transfer_mode() == 'Control'
+        device = HidrawDevice(vendor_id,
+                              product_id,
+                              usage_page,
+                              usage,
+                              path=the_config.get_device_path(),
+                              feature_reports=feature_reports)
     else:
         raise Exception('Invalid or device class not supported: {0}'.
                         format(device_class))
@@ -96,7 +118,13 @@ def main():
         monitor = PyUdevDeviceMonitor(vendor_id,
                                       product_id,
                                       pyudev,
+                                      tag=the_config.get_udev_tag(),
                                       logger=the_logger)
+    elif device_monitor_class == 'NetlinkDeviceMonitor':
+        from device_monitors import NetlinkDeviceMonitor
+        monitor = NetlinkDeviceMonitor(vendor_id,
+                                       product_id,
+                                       logger=the_logger)
     elif device_monitor_class == 'PollingDeviceMonitor':
         from device_monitors import PollingDeviceMonitor
         monitor_polling_period = the_config.get_polling_device_monitor_period()
@@ -117,6 +145,14 @@ def main():
         raise Exception('Invalid or USB protocol not supported: {0}'.
                         format(usb_protocol))
 
+    # Compile the mapping from requests to lights
+    try:
+        light_mapping = the_config.get_mapping()
+        parser.register_mapping(light_mapping)
+    except InvalidMappingException, e:
+        print('Invalid mapping: {0}'.format(e.message))
+        exit(1)
+
     # Pick a USB transfer type (RAW or CTRL)
     usb_transfer_mode = the_config.get_usb_transfer_mode()
     if usb_transfer_mode == 'Raw':
@@ -128,14 +164,30 @@ def main():
                         'not supported: {0}'.
                         format(usb_transfer_mode))
 
+    # Pick a listener class
+    listener_class_name = the_config.get_listener_class()
+    if listener_class_name == 'Listener':
+        listener_class = listener.Listener
+    elif listener_class_name == 'MultiplexingListener':
+        listener_class = listener.MultiplexingListener
+    elif listener_class_name == 'PersistentListener':
+        listener_class = listener.PersistentListener
+    else:
+        raise Exception('Invalid or listener class not supported: {0}'.
+                        format(listener_class_name))
+
     # Assemble the client
     (client_address, client_port) = the_config.get_client_address_and_port()
     (server_address, server_port) = the_config.get_server_address_and_port()
     username = the_config.get_username()
     retry_period = the_config.get_registration_retry_period()
+    command_ttl = the_config.get_command_ttl()
+    pipeline_window = the_config.get_pipeline_window()
     controller = DeviceController(device,
                                   usb_transfer_type,
                                   monitor,
+                                  command_ttl=command_ttl,
+                                  pipeline_window=pipeline_window,
                                   logger=the_logger)
     client = notifier_client.NotifierClient(username,
                                             controller,
@@ -145,6 +197,8 @@ def main():
                                             server_port=server_port,
                                             retry_period=retry_period,
                                             usb_protocol_type=upt,
+                                            listener_class=listener_class,
+                                            light_mapping=light_mapping,
                                             logger=the_logger)
 
     # Run as long as the client is running
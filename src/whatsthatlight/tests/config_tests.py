@@ -18,6 +18,8 @@ import unittest
 
 # Local imports
 from whatsthatlight.common import config
+from whatsthatlight.common import mapping
+from whatsthatlight.common import usb_protocol_types
 
 
 class Test(unittest.TestCase):
@@ -313,6 +315,28 @@ class Test(unittest.TestCase):
         actual = the_config.get_polling_device_monitor_period()
         self.assertEqual(actual, expected)
 
+    def test_get_udev_tag(self):
+        '''
+        Retrieve the default, followed by retrieving the configured value.
+        '''
+        # Create an empty config
+        config_parser = ConfigParser.SafeConfigParser()
+        the_config = config.Config(config_parser)
+
+        # Test that we get the default
+        actual = the_config.get_udev_tag()
+        self.assertIsNone(actual)
+
+        # Test that we get the configured value
+        config_parser.add_section(config.MONITOR_SECTION)
+        expected = 'whatsthatlight'
+        config_parser.set(config.MONITOR_SECTION,
+                          config.MONITOR_UDEV_TAG_OPTION,
+                          expected)
+        the_config = config.Config(config_parser)
+        actual = the_config.get_udev_tag()
+        self.assertEqual(actual, expected)
+
     def test_get_registration_retry_period(self):
         '''
         Retrieve the default, followed by retrieving the configured value.
@@ -336,5 +360,158 @@ class Test(unittest.TestCase):
         actual = the_config.get_registration_retry_period()
         self.assertEqual(actual, expected)
 
+    def test_get_command_ttl(self):
+        '''
+        Retrieve the default, followed by retrieving the configured value.
+        '''
+        # Create an empty config
+        config_parser = ConfigParser.SafeConfigParser()
+        the_config = config.Config(config_parser)
+
+        # Test that we get the default
+        expected = 5
+        actual = the_config.get_command_ttl()
+        self.assertEqual(actual, expected)
+
+        # Test that we get the configured value
+        config_parser.add_section(config.DEVICE_SECTION)
+        expected = 2
+        config_parser.set(config.DEVICE_SECTION,
+                          config.DEVICE_COMMAND_TTL_OPTION,
+                          str(expected))
+        the_config = config.Config(config_parser)
+        actual = the_config.get_command_ttl()
+        self.assertEqual(actual, expected)
+
+    def test_get_pipeline_window(self):
+        '''
+        Retrieve the default, followed by retrieving the configured value.
+        '''
+        # Create an empty config
+        config_parser = ConfigParser.SafeConfigParser()
+        the_config = config.Config(config_parser)
+
+        # Test that we get the default
+        expected = 1
+        actual = the_config.get_pipeline_window()
+        self.assertEqual(actual, expected)
+
+        # Test that we get the configured value
+        config_parser.add_section(config.DEVICE_SECTION)
+        expected = 4
+        config_parser.set(config.DEVICE_SECTION,
+                          config.DEVICE_PIPELINE_WINDOW_OPTION,
+                          str(expected))
+        the_config = config.Config(config_parser)
+        actual = the_config.get_pipeline_window()
+        self.assertEqual(actual, expected)
+
+    def test_get_device_path(self):
+        '''
+        Retrieve the default, followed by retrieving the configured value.
+        '''
+        # Create an empty config
+        config_parser = ConfigParser.SafeConfigParser()
+        the_config = config.Config(config_parser)
+
+        # Test that we get the default
+        actual = the_config.get_device_path()
+        self.assertIsNone(actual)
+
+        # Test that we get the configured value
+        config_parser.add_section(config.DEVICE_SECTION)
+        expected = '/dev/hidraw1'
+        config_parser.set(config.DEVICE_SECTION,
+                          config.DEVICE_PATH_OPTION,
+                          expected)
+        the_config = config.Config(config_parser)
+        actual = the_config.get_device_path()
+        self.assertEqual(actual, expected)
+
+    def test_get_listener_class(self):
+        '''
+        Retrieve the default, followed by retrieving the configured value.
+        '''
+        # Create an empty config
+        config_parser = ConfigParser.SafeConfigParser()
+        the_config = config.Config(config_parser)
+
+        # Test that we get the default
+        expected = 'Listener'
+        actual = the_config.get_listener_class()
+        self.assertEqual(actual, expected)
+
+        # Test that we get the configured value
+        config_parser.add_section(config.CLIENT_SECTION)
+        expected = 'MultiplexingListener'
+        config_parser.set(config.CLIENT_SECTION,
+                          config.CLIENT_LISTENER_CLASS_OPTION,
+                          expected)
+        the_config = config.Config(config_parser)
+        actual = the_config.get_listener_class()
+        self.assertEqual(actual, expected)
+
+    def test_get_mapping(self):
+        '''
+        Retrieve the default, followed by retrieving the configured value.
+        '''
+        das = usb_protocol_types.DAS_BLINKENLICHTEN
+        blink1 = usb_protocol_types.BLINK1
+
+        # Create an empty config
+        config_parser = ConfigParser.SafeConfigParser()
+        the_config = config.Config(config_parser)
+
+        # Test that we get the default
+        the_mapping = the_config.get_mapping()
+        self.assertEqual('red=on\ngreen=off\n',
+                         the_mapping.get_command(mapping.ATTENTION_REQUIRED,
+                                                 das))
+        self.assertEqual([0x01, 0x63, 255, 0, 0, 0, 100, 0],
+                         the_mapping.get_command(mapping.ATTENTION_REQUIRED,
+                                                 blink1))
+
+        # Test that we get the configured value
+        config_parser.add_section(config.MAPPING_SECTION)
+        config_parser.set(config.MAPPING_SECTION,
+                          mapping.ATTENTION_REQUIRED,
+                          'yellow:on, red:sos')
+        config_parser.set(config.MAPPING_SECTION,
+                          'blink1_' + mapping.BUILD_INACTIVE,
+                          'blue:on')
+        config_parser.set(config.MAPPING_SECTION,
+                          'colour_yellow',
+                          '1,2,3')
+        the_config = config.Config(config_parser)
+        the_mapping = the_config.get_mapping()
+        self.assertEqual('yellow=on\nred=sos\n',
+                         the_mapping.get_command(mapping.ATTENTION_REQUIRED,
+                                                 das))
+        self.assertEqual([0x01, 0x63, 1, 2, 3, 0, 100, 0],
+                         the_mapping.get_command(mapping.ATTENTION_REQUIRED,
+                                                 blink1))
+        self.assertEqual('yellow=off\n',
+                         the_mapping.get_command(mapping.BUILD_INACTIVE,
+                                                 das))
+        self.assertEqual([0x01, 0x63, 0, 0, 255, 0, 100, 0],
+                         the_mapping.get_command(mapping.BUILD_INACTIVE,
+                                                 blink1))
+
+        # Test that an invalid value gets rejected
+        config_parser.set(config.MAPPING_SECTION,
+                          mapping.BUILD_ACTIVE,
+                          'yellow:maybe')
+        the_config = config.Config(config_parser)
+        self.assertRaises(mapping.InvalidMappingException,
+                          the_config.get_mapping)
+
+        # Test that an unknown LED gets rejected
+        config_parser.set(config.MAPPING_SECTION,
+                          mapping.BUILD_ACTIVE,
+                          'rde:on')
+        the_config = config.Config(config_parser)
+        self.assertRaises(mapping.InvalidMappingException,
+                          the_config.get_mapping)
+
 if __name__ == "__main__":
     unittest.main()
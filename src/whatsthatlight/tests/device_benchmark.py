@@ -0,0 +1,119 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# System imports
+import itertools
+import logging
+import sys
+import timeit
+
+# Local imports
+from whatsthatlight.common import usb_transfer_types
+from whatsthatlight.device_controller import DeviceController
+from mock_device_monitor import MockDeviceMonitor
+
+# The commands sent for the light states
+COMMANDS = ['red=off\ngreen=off\nyellow=on\n',
+            'red=off\ngreen=on\nyellow=off\n',
+            'red=on\ngreen=off\nyellow=off\n',
+            'yellow=off\n',
+            'red=on\n']
+PACKET_SIZE = 64
+ACK = 'ack' + '\0' * (PACKET_SIZE - len('ack'))
+ITERATIONS = 20000
+REPEAT = 5
+SUSTAINED_LOAD = 100000
+
+
+class _FrameDevice(object):
+    '''
+    An open RAW device that acks every frame, optionally keeping the frames
+    sent alive.
+    '''
+
+    def __init__(self, keep_frames):
+        '''
+        Constructor.
+        :param keep_frames: whether to keep the frames sent
+        '''
+        self.frames = [] if keep_frames else None
+
+    def is_open(self):
+        return True
+
+    def get_packet_size(self):
+        return PACKET_SIZE
+
+    def send(self, data):
+        if not self.frames is None:
+            self.frames.append(data)
+
+    def receive(self):
+        return ACK
+
+
+def _controller(device):
+    '''
+    Get a (stopped) controller sending commands to a device inline.
+    :param device: the device
+    '''
+    logger = logging.getLogger('device_benchmark')
+    logger.setLevel(logging.INFO)
+    return DeviceController(device,
+                            usb_transfer_types.RAW,
+                            MockDeviceMonitor(dormant=True),
+                            logger=logger)
+
+
+def _sends_per_second():
+    '''
+    Benchmark sending the commands and return the best rate.
+    '''
+    controller = _controller(_FrameDevice(False))
+
+    def _send():
+        for command in COMMANDS:
+            controller.send(command)
+    best = min(timeit.repeat(_send, number=ITERATIONS, repeat=REPEAT))
+    return len(COMMANDS) * ITERATIONS / best
+
+
+def _allocations():
+    '''
+    Send a sustained load of commands, keeping every frame sent alive, and
+    return the number of distinct frame objects and their total size in
+    bytes.
+    '''
+    device = _FrameDevice(True)
+    controller = _controller(device)
+    for command in itertools.islice(itertools.cycle(COMMANDS),
+                                    SUSTAINED_LOAD):
+        controller.send(command)
+    distinct = dict((id(frame), frame) for frame in device.frames).values()
+    size = sum(sys.getsizeof(frame) for frame in distinct)
+    return (len(distinct), size)
+
+
+def main():
+    '''
+    Print the send rate and the frame allocations.
+    '''
+    print('RAW sends: {0:10.0f} commands/s'.format(_sends_per_second()))
+    (count, size) = _allocations()
+    print('Frames allocated for {0} commands: {1} ({2} bytes)'.
+          format(SUSTAINED_LOAD, count, size))
+
+if __name__ == '__main__':
+    main()
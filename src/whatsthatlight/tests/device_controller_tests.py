@@ -14,16 +14,20 @@
 
 # System imports
 import unittest
-from threading import Event, Thread
+from threading import Event, Thread, current_thread
 from time import sleep
 
 # Local imports
 import whatsthatlight.devices
 import mock_pyudev
 from whatsthatlight.device_controller import DeviceController
+from whatsthatlight.device_controller import _CircuitBreaker
+from whatsthatlight.device_monitors import PollingDeviceMonitor
 from whatsthatlight.device_monitors import PyUdevDeviceMonitor
 from whatsthatlight.common import logger
+from whatsthatlight.common import priorities
 from whatsthatlight.common import usb_transfer_types
+from whatsthatlight.common.rtt_estimator import RttEstimator
 from mock_device_monitor import MockDeviceMonitor
 
 # Third-party imports
@@ -35,6 +39,100 @@ from mockito import verify, any  # @UnusedImport
 from mockito import inorder  # @UnresolvedImport
 
 
+class _BlockingDevice(object):
+    '''
+    A device that holds on to the data sent until released.
+    '''
+
+    def __init__(self, replies=None, send_failures=0, open_failures=0):
+        self.send_failures = send_failures
+        self.open_failures = open_failures
+        self.opened = 0
+        self.open_state = True
+        self.sent = []
+        self.transfers = []
+        self.replies = replies or []
+        self.sending = Event()
+        self.released = Event()
+
+    def get_vendor_id(self):
+        return 0
+
+    def get_product_id(self):
+        return 0
+
+    def get_packet_size(self):
+        return 64
+
+    def open(self):
+        if self.open_failures > 0:
+            self.open_failures -= 1
+            self.open_state = False
+            raise IOError('Open failed')
+        self.opened += 1
+        self.open_state = True
+
+    def close(self):
+        self.open_state = False
+
+    def is_open(self):
+        return self.open_state
+
+    def send(self, data):
+        if self.send_failures > 0:
+            self.send_failures -= 1
+            raise IOError('Send failed')
+        self.sent.append(data.rstrip('\0'))
+        self.transfers.append('send')
+        self.sending.set()
+        self.released.wait()
+
+    def receive(self):
+        self.transfers.append('receive')
+        if len(self.replies) > 0:
+            return self.replies.pop(0)
+        return 'ack'
+
+
+class _TimedDevice(_BlockingDevice):
+    '''
+    A blocking device that estimates its round-trip time.
+    '''
+
+    def __init__(self, replies=None):
+        _BlockingDevice.__init__(self, replies)
+        self.rtt_estimator = RttEstimator()
+
+    def get_rtt_estimator(self):
+        return self.rtt_estimator
+
+    def send(self, data):
+        _BlockingDevice.send(self, data)
+        self.rtt_estimator.sent()
+
+    def receive(self):
+        return self.rtt_estimator.receive(
+            lambda timeout: _BlockingDevice.receive(self))
+
+
+class _PolledDevice(_BlockingDevice):
+    '''
+    A blocking device that records the threads opening and polling it.
+    '''
+
+    def __init__(self, open_failures=0):
+        _BlockingDevice.__init__(self, open_failures=open_failures)
+        self.threads = []
+
+    def open(self):
+        self.threads.append(current_thread())
+        _BlockingDevice.open(self)
+
+    def poll(self):
+        self.threads.append(current_thread())
+        return True
+
+
 class Test(unittest.TestCase):
     '''
     Device controller tests.
@@ -404,6 +502,499 @@ class Test(unittest.TestCase):
         verify(mock_device, times=1).send(any())
         verify(mock_device, times=1).receive()
 
+    def test_send_reuses_frame(self):
+        '''
+        Test that every command is sent in the same frame, and that an ack
+        received in a buffer is understood.
+        '''
+        mock_monitor = mock()
+        device = _BlockingDevice(replies=[buffer('ack\r\n' + '\0' * 59),
+                                          buffer('ack!' + '\0' * 60)])
+        frames = []
+        device.send = frames.append
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      mock_monitor,
+                                      logger=self._logger)
+        self.assertTrue(controller.send('red=on\n'))
+        self.assertEqual('red=on\n' + '\0' * 57, frames[0])
+        self.assertFalse(controller.send('foo'))
+        self.assertIs(frames[0], frames[1])
+        self.assertEqual('foo' + '\0' * 61, frames[1])
+
+    def test_submit_while_running(self):
+        '''
+        Test that commands submitted while running are sent by the I/O
+        thread.
+        '''
+        # The frame sent is reused, so the device must copy it
+        device = _BlockingDevice()
+        device.released.set()
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      MockDeviceMonitor(dormant=True),
+                                      logger=self._logger)
+        controller.start()
+        futures = [controller.submit(command) for command in
+                   ['red=on\n', 'green=on\n', 'yellow=on\n']]
+        self.assertTrue(all(f.result(1) for f in futures))
+        controller.stop()
+        self.assertListEqual(['red=on\n', 'green=on\n', 'yellow=on\n'],
+                             device.sent)
+
+    def test_coalesce_commands(self):
+        '''
+        Test that a command waiting to be sent is dropped for a later one
+        that sets all its channels.
+        '''
+        device = _BlockingDevice()
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      MockDeviceMonitor(dormant=True),
+                                      logger=self._logger)
+        controller.start()
+        futures = [controller.submit('red=on\n', frozenset(['red']))]
+        device.sending.wait(1)
+        for (command, channels) in [('yellow=on\n', ['yellow']),
+                                    ('red=off\ngreen=on\n', ['red', 'green']),
+                                    ('yellow=off\n', ['yellow']),
+                                    ('red=on\n', ['red'])]:
+            futures.append(controller.submit(command, frozenset(channels)))
+        device.released.set()
+        results = [f.result(1) for f in futures]
+        controller.stop()
+        self.assertListEqual([True, None, True, True, True], results)
+        self.assertListEqual(['red=on\n',
+                              'red=off\ngreen=on\n',
+                              'yellow=off\n',
+                              'red=on\n'],
+                             device.sent)
+        self.assertEqual(1, controller.get_coalesced_commands())
+
+    def test_expire_commands(self):
+        '''
+        Test that a command waiting for longer than the TTL is dropped.
+        '''
+        device = _BlockingDevice()
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      MockDeviceMonitor(dormant=True),
+                                      command_ttl=0.05,
+                                      logger=self._logger)
+        controller.start()
+        first = controller.submit('red=on\n')
+        device.sending.wait(1)
+        second = controller.submit('green=on\n')
+        sleep(0.1)
+        device.released.set()
+        self.assertTrue(first.result(1))
+        self.assertFalse(second.result(1))
+        controller.stop()
+        self.assertListEqual(['red=on\n'], device.sent)
+        self.assertEqual(1, controller.get_expired_commands())
+
+    def test_expire_commands_only(self):
+        '''
+        Test that closing a removed device is not dropped, even when waiting
+        for longer than the command TTL.
+        '''
+        device = _BlockingDevice()
+        monitor = MockDeviceMonitor(dormant=True)
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      monitor,
+                                      command_ttl=0.05,
+                                      logger=self._logger)
+        controller.start()
+        first = controller.submit('red=on\n')
+        device.sending.wait(1)
+        monitor._get_remove_event_handler()()
+        sleep(0.1)
+        device.released.set()
+        self.assertTrue(first.result(1))
+        for _ in range(100):
+            if not device.is_open():
+                break
+            sleep(0.01)
+        self.assertFalse(device.is_open())
+        controller.stop()
+        self.assertEqual(0, controller.get_expired_commands())
+
+    def test_urgent_commands_first(self):
+        '''
+        Test that an urgent command overtakes the commands waiting for other
+        channels only.
+        '''
+        device = _BlockingDevice()
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      MockDeviceMonitor(dormant=True),
+                                      logger=self._logger)
+        controller.start()
+        futures = [controller.submit('green=on\n', frozenset(['green']))]
+        device.sending.wait(1)
+        for (command, channels, priority) in [('red=off\nyellow=on\n',
+                                               ['red', 'yellow'],
+                                               priorities.LOW),
+                                              ('red=on\n',
+                                               ['red'],
+                                               priorities.NORMAL),
+                                              ('green=sos\n',
+                                               ['green'],
+                                               priorities.HIGH)]:
+            futures.append(controller.submit(command,
+                                             frozenset(channels),
+                                             priority))
+        device.released.set()
+        self.assertTrue(all(f.result(1) for f in futures))
+        controller.stop()
+        self.assertListEqual(['green=on\n',
+                              'green=sos\n',
+                              'red=off\nyellow=on\n',
+                              'red=on\n'],
+                             device.sent)
+        (count, average, maximum) = controller.get_latency(priorities.HIGH)
+        self.assertEqual(1, count)
+        self.assertTrue(0 < average <= maximum)
+        self.assertEqual(1, controller.get_latency(priorities.LOW)[0])
+
+    def test_pipelined_transfers(self):
+        '''
+        Test that the frames waiting are sent before receiving their acks.
+        '''
+        device = _BlockingDevice()
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      MockDeviceMonitor(dormant=True),
+                                      pipeline_window=4,
+                                      logger=self._logger)
+        controller.start()
+        futures = [controller.submit('red=on\n')]
+        device.sending.wait(1)
+        for command in ['green=on\n', 'yellow=on\n', 'red=off\n']:
+            futures.append(controller.submit(command))
+        device.released.set()
+        self.assertTrue(all(f.result(1) for f in futures))
+        controller.stop()
+        self.assertListEqual(['send', 'receive'] +
+                             ['send'] * 3 + ['receive'] * 3,
+                             device.transfers)
+        self.assertEqual(0, controller.get_pipeline_fallbacks())
+
+    def test_pipelined_transfers_fall_back_to_lock_step(self):
+        '''
+        Test that a missing ack fails the frames from there on and falls
+        back to lock-step.
+        '''
+        # Nothing is received after the missing ack
+        device = _BlockingDevice(replies=['ack', 'ack', 'nak', ''])
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      MockDeviceMonitor(dormant=True),
+                                      pipeline_window=4,
+                                      logger=self._logger)
+        controller.start()
+        futures = [controller.submit('red=on\n')]
+        device.sending.wait(1)
+        for command in ['green=on\n', 'yellow=on\n', 'red=off\n']:
+            futures.append(controller.submit(command))
+        device.released.set()
+        results = [f.result(1) for f in futures]
+        futures = [controller.submit(command) for command in
+                   ['green=off\n', 'yellow=off\n']]
+        results.extend([f.result(1) for f in futures])
+        controller.stop()
+        self.assertListEqual([True, True, False, False, True, True], results)
+        self.assertListEqual(['send', 'receive'] +
+                             ['send'] * 3 + ['receive'] * 3 +
+                             ['send', 'receive'] * 2,
+                             device.transfers)
+        self.assertEqual(1, controller.get_pipeline_fallbacks())
+
+    def test_pipeline_fall_back_discards_late_acks(self):
+        '''
+        Test that the acks arriving late for the frames of a pipeline that
+        fell back to lock-step are not taken for the acks of later frames.
+        '''
+        # The second ack is late (the receive times out), and the device
+        # does not understand the first frame sent in lock-step
+        device = _BlockingDevice(replies=['ack', '', 'ack', 'ack', 'ack',
+                                          'nak'])
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      MockDeviceMonitor(dormant=True),
+                                      pipeline_window=4,
+                                      logger=self._logger)
+        controller.start()
+        futures = [controller.submit('red=on\n')]
+        device.sending.wait(1)
+        for command in ['green=on\n', 'yellow=on\n', 'red=off\n']:
+            futures.append(controller.submit(command))
+        device.released.set()
+        results = [f.result(1) for f in futures]
+        results.extend([controller.submit('green=off\n').result(1),
+                        controller.submit('yellow=off\n').result(1)])
+        controller.stop()
+        self.assertListEqual([True, False, False, False, False, True],
+                             results)
+        self.assertEqual(1, controller.get_pipeline_fallbacks())
+
+    def test_pipeline_fall_back_forgets_unacked_frames(self):
+        '''
+        Test that the frames whose acks were not received when falling back
+        to lock-step are not matched to the acks of later transfers.
+        '''
+        device = _TimedDevice(replies=['ack', 'nak'])
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      MockDeviceMonitor(dormant=True),
+                                      pipeline_window=4,
+                                      logger=self._logger)
+        controller.start()
+        futures = [controller.submit('red=on\n')]
+        device.sending.wait(1)
+        for command in ['green=on\n', 'yellow=on\n', 'red=off\n']:
+            futures.append(controller.submit(command))
+        device.released.set()
+        self.assertListEqual([True, False, False, False],
+                             [f.result(1) for f in futures])
+        sleep(0.5)
+        self.assertTrue(controller.submit('green=off\n').result(1))
+        controller.stop()
+        self.assertTrue(device.rtt_estimator.get_smoothed_rtt() < 20)
+
+    def test_control_transfers_not_pipelined_when_added(self):
+        '''
+        Test that CONTROL transfers are not pipelined once the device was
+        removed and added again.
+        '''
+        device = _BlockingDevice()
+        monitor = MockDeviceMonitor(dormant=True)
+        controller = DeviceController(device,
+                                      usb_transfer_types.CONTROL,
+                                      monitor,
+                                      pipeline_window=4,
+                                      logger=self._logger)
+        controller.start()
+        device.released.set()
+        monitor._get_remove_event_handler()()
+        monitor._get_add_event_handler()()
+        device.released.clear()
+        device.sending.clear()
+        futures = [controller.submit('red=on\n')]
+        device.sending.wait(1)
+        for command in ['green=on\n', 'yellow=on\n', 'red=off\n']:
+            futures.append(controller.submit(command))
+        device.released.set()
+        self.assertFalse(False in [f.result(1) for f in futures])
+        controller.stop()
+        self.assertListEqual(['red=on\n', 'green=on\n', 'yellow=on\n',
+                              'red=off\n'],
+                             device.sent)
+        self.assertFalse('receive' in device.transfers)
+        self.assertEqual(0, controller.get_pipeline_fallbacks())
+
+    def test_recover_from_failed_io(self):
+        '''
+        Test that a device whose I/O failed is reopened and the lights
+        replayed.
+        '''
+        device = _BlockingDevice(send_failures=1)
+        device.released.set()
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      MockDeviceMonitor(dormant=True),
+                                      logger=self._logger)
+        controller.set_replay_handler(lambda: 'red=on\ngreen=off\n')
+        controller.start()
+        self.assertFalse(controller.submit('green=off\n').result(1))
+        for _ in range(0, 20):
+            if controller.get_recovery_time()[0] > 0:
+                break
+            sleep(0.05)
+        controller.stop()
+        self.assertEqual(2, device.opened)
+        self.assertListEqual(['red=on\ngreen=off\n'], device.sent)
+        (count, average, _) = controller.get_recovery_time()
+        self.assertEqual(1, count)
+        self.assertTrue(average >= 0.1)
+
+    def test_replay_when_added(self):
+        '''
+        Test that the lights are replayed as soon as the device was added.
+        '''
+        add_event = Event()
+        # Not plugged in yet when started
+        device = _BlockingDevice(open_failures=1)
+        device.released.set()
+        mock_pyudev.vendor_id = '0000'
+        mock_pyudev.model_id = '0000'
+        mock_pyudev.dormant = False
+        mock_pyudev.delay = 0.1
+        mock_monitor = PyUdevDeviceMonitor(0,
+                                           0,
+                                           udev_module=mock_pyudev,
+                                           logger=self._logger)
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      mock_monitor,
+                                      add_event_handler=add_event.set,
+                                      logger=self._logger)
+        controller.set_replay_handler(lambda: 'red=on\ngreen=off\n')
+        controller.start()
+        add_event.wait(mock_pyudev.delay * 2)
+        controller.stop()
+        self.assertTrue(add_event.is_set(), 'Add handler must be invoked')
+        self.assertListEqual(['red=on\ngreen=off\n'], device.sent)
+
+    def test_cold_plug(self):
+        '''
+        Test that a device present on start-up is added once: by the
+        monitor's enumeration only if the controller could not open it.
+        '''
+        mock_pyudev.dormant = True
+        mock_pyudev.present = [{'ID_VENDOR_ID': '0000', 'ID_MODEL_ID': '0000'}]
+        for open_failures in [0, 1]:
+            added = []
+
+            def _add_handler():
+                added.append(True)
+            device = _BlockingDevice(open_failures=open_failures)
+            device.released.set()
+            mock_monitor = PyUdevDeviceMonitor(0,
+                                               0,
+                                               udev_module=mock_pyudev,
+                                               logger=self._logger)
+            controller = DeviceController(device,
+                                          usb_transfer_types.RAW,
+                                          mock_monitor,
+                                          add_event_handler=_add_handler,
+                                          logger=self._logger)
+            controller.set_replay_handler(lambda: 'red=on\n')
+            controller.start()
+            controller.stop()
+            self.assertListEqual([True], added)
+            self.assertEqual(1, device.opened)
+            self.assertEqual(open_failures, len(device.sent))
+        mock_pyudev.present = []
+
+    def test_polling_monitor_on_io_thread(self):
+        '''
+        Test that a polling monitor accesses the device on the I/O thread.
+        '''
+        device = _PolledDevice(open_failures=1)
+        device.released.set()
+        monitor = PollingDeviceMonitor(device,
+                                       polling_interval=0.1,
+                                       logger=self._logger)
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      monitor,
+                                      logger=self._logger)
+        controller.start()
+        sleep(0.3)
+        controller.stop()
+        # Opened by the monitor, and again when added
+        self.assertEqual(2, device.opened)
+        # The failed open on start-up is done by the controller itself
+        threads = set(device.threads[1:])
+        self.assertEqual(1, len(threads))
+        self.assertFalse(current_thread() in threads)
+        self.assertTrue(len(device.threads) > 3)
+
+    def test_monitor_fails_to_start(self):
+        '''
+        A device monitor failing to start must leave the controller stopped,
+        with the device closed, so that it can be started again.
+        '''
+        device = _BlockingDevice()
+        device.released.set()
+        mock_monitor = mock()
+        (when(mock_monitor).start().
+            thenRaise(OSError('Monitor failed')).
+            thenReturn(None))
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      mock_monitor,
+                                      logger=self._logger)
+        self.assertRaises(OSError, controller.start)
+        self.assertFalse(controller.running)
+        self.assertFalse(device.is_open())
+        controller.start()
+        self.assertTrue(controller.running)
+        self.assertTrue(controller.submit('red=on\n').result(1))
+        controller.stop()
+        self.assertEqual(2, device.opened)
+
+    def test_watchdog(self):
+        '''
+        Test that a stalled transfer is abandoned, and the device cycled
+        through the remove and add handlers.
+        '''
+        add_event = Event()
+        remove_event = Event()
+        device = _BlockingDevice()
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      MockDeviceMonitor(dormant=True),
+                                      add_event_handler=add_event.set,
+                                      remove_event_handler=remove_event.set,
+                                      io_deadline=0.2,
+                                      logger=self._logger)
+        controller.set_replay_handler(lambda: 'red=on\n')
+        controller.start()
+        self.assertFalse(controller.submit('green=on\n').result(1))
+        add_event.wait(1)
+        device.released.set()
+        self.assertTrue(controller.submit('yellow=on\n').result(1))
+        controller.stop()
+        self.assertTrue(remove_event.is_set(), 'Remove handler not invoked')
+        self.assertTrue(add_event.is_set(), 'Add handler not invoked')
+        self.assertListEqual(['green=on\n', 'red=on\n', 'yellow=on\n'],
+                             device.sent)
+        self.assertEqual(2, device.opened)
+        # The stalled transfer returns eventually, on the abandoned thread
+        for _ in range(0, 20):
+            if controller.get_stalls()[1] > 0:
+                break
+            sleep(0.05)
+        (count, average, maximum) = controller.get_stalls()
+        self.assertEqual(1, count)
+        self.assertTrue(0.2 < average <= maximum)
+
+    def test_stop_when_stalled(self):
+        '''
+        Test that stopping does not wait for a stalled transfer forever.
+        '''
+        device = _BlockingDevice()
+        controller = DeviceController(device,
+                                      usb_transfer_types.RAW,
+                                      MockDeviceMonitor(dormant=True),
+                                      io_deadline=0.1,
+                                      logger=self._logger)
+        controller.start()
+        stalled = controller.submit('green=on\n')
+        device.sending.wait(1)
+        waiting = controller.submit('red=on\n')
+        controller.stop()
+        self.assertFalse(stalled.result(1))
+        self.assertFalse(waiting.result(1))
+        self.assertEqual(1, controller.get_stalls()[0])
+        device.released.set()
+
+    def test_circuit_breaker(self):
+        '''
+        Test that reopening backs off exponentially and is suspended after
+        too many attempts.
+        '''
+        breaker = _CircuitBreaker(delay=1, max_delay=4, max_attempts=4,
+                                  period=60)
+        self.assertListEqual([1, 2, 4, 4, 60, 1],
+                             [breaker.failed() for _ in range(0, 6)])
+        breaker.succeeded()
+        self.assertEqual(1, breaker.failed())
+        self.assertEqual(1, breaker.get_trips())
+
     def test_without_handlers_must_still_open_and_close_device(self):
         '''
         Test that, without handlers, the device gets opened and closed.
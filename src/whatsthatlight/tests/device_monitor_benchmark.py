@@ -0,0 +1,143 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import logging
+import time
+
+# Local imports
+from whatsthatlight.device_monitors import PyUdevDeviceMonitor
+from whatsthatlight.usb_topology import UsbTopologyIndex
+
+# A storm of USB events, e.g. a hub of devices replugged, of which only
+# one in every STORM_RATIO is for the device monitored
+VENDOR_ID = 0x27b8
+PRODUCT_ID = 0x01ed
+TAG = 'whatsthatlight'
+STORM_EVENTS = 100000
+STORM_RATIO = 100
+
+
+class _Context(object):
+    '''
+    A udev context.
+    '''
+    pass
+
+
+class _Monitor(object):
+    '''
+    A udev monitor, filtering by tag the way the kernel does.
+    '''
+
+    def __init__(self):
+        self.tag = None
+
+    @classmethod
+    def from_netlink(cls, context):
+        return _Monitor()
+
+    def filter_by(self, subsystem=None, device_type=None):
+        pass
+
+    def filter_by_tag(self, tag):
+        self.tag = tag
+
+
+class _MonitorObserver(object):
+    '''
+    A udev monitor observer, delivering the storm to its callback.
+    '''
+
+    def __init__(self, monitor, callback=None, name=None):
+        self._monitor = monitor
+        self._callback = callback
+
+    def storm(self, events):
+        '''
+        Deliver the events that pass the monitor's filter and get the number
+        of callbacks.
+        :param events: the (device, tags) tuples of the events
+        '''
+        callbacks = 0
+        for (device, tags) in events:
+            if self._monitor.tag is None or self._monitor.tag in tags:
+                self._callback(device)
+                callbacks += 1
+        return callbacks
+
+
+class _Udev(object):
+    '''
+    The pyudev module.
+    '''
+    Context = _Context
+    Monitor = _Monitor
+    MonitorObserver = _MonitorObserver
+
+
+def _storm():
+    '''
+    Get the events of the storm.
+    '''
+    events = []
+    for i in xrange(STORM_EVENTS):
+        action = 'add' if i % 2 == 0 else 'remove'
+        if i % STORM_RATIO == 0:
+            device = {'ACTION': action,
+                      'ID_VENDOR_ID': '{0:04x}'.format(VENDOR_ID),
+                      'ID_MODEL_ID': '{0:04x}'.format(PRODUCT_ID)}
+            events.append((device, (TAG,)))
+        else:
+            device = {'ACTION': action,
+                      'ID_VENDOR_ID': '{0:04x}'.format(i % 0xffff),
+                      'ID_MODEL_ID': '0001'}
+            events.append((device, ()))
+    return events
+
+
+def _callbacks(tag, events):
+    '''
+    Deliver the storm to a monitor and get the number of callbacks and the
+    rate of events handled.
+    :param tag: the monitor's udev tag, or None
+    :param events: the events of the storm
+    '''
+    logger = logging.getLogger('device_monitor_benchmark')
+    logger.setLevel(logging.INFO)
+    monitor = PyUdevDeviceMonitor(VENDOR_ID,
+                                  PRODUCT_ID,
+                                  _Udev,
+                                  topology_index=UsbTopologyIndex(),
+                                  tag=tag,
+                                  logger=logger)
+    monitor.set_add_event_handler(lambda: None)
+    monitor.set_remove_event_handler(lambda: None)
+    start = time.time()
+    callbacks = monitor._observer.storm(events)
+    return (callbacks, len(events) / (time.time() - start))
+
+
+def main():
+    '''
+    Print the callbacks and event rates, without and with the tag filter.
+    '''
+    events = _storm()
+    for (name, tag) in [('Untagged', None), ('Tagged', TAG)]:
+        (callbacks, rate) = _callbacks(tag, events)
+        print('{0:9} {1:7} callbacks for {2} events: {3:10.0f} events/s'.
+              format(name + ':', callbacks, len(events), rate))
+
+if __name__ == '__main__':
+    main()
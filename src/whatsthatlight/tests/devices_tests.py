@@ -13,11 +13,22 @@
 # limitations under the License.
 
 # System imports
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import tty
 import unittest
+from time import sleep, time
 
 # Local imports
 from whatsthatlight.devices import PyUsbDevice, TeensyDevice, DeviceError
+from whatsthatlight.devices import HidrawDevice, _get_top_level_usage
+from whatsthatlight.devices import AsyncPyUsbDevice, AsyncBlink1Device
+from whatsthatlight.usb_events import UsbEventThread
 from whatsthatlight.common import logger
+import mock_usb1
 
 
 class Test(unittest.TestCase):
@@ -32,6 +43,28 @@ class Test(unittest.TestCase):
         # Use this line to run single test
         #self._logger = logger.get_logger('../logger.conf')
 
+        # The asynchronous devices use the usb1 module
+        self._usb1 = sys.modules.get('usb1')
+        sys.modules['usb1'] = mock_usb1
+        mock_usb1.present = [(0x16c0, 0x0486)]
+        mock_usb1.sent = []
+        mock_usb1.replies = []
+        mock_usb1.failures = 0
+        mock_usb1.transfers = []
+        mock_usb1.controls = []
+        mock_usb1.completed = []
+        mock_usb1.claimed = []
+        mock_usb1.handling.set()
+
+    def tearDown(self):
+        '''
+        Tear down.
+        '''
+        if self._usb1 is None:
+            del sys.modules['usb1']
+        else:
+            sys.modules['usb1'] = self._usb1
+
     def test_teensy_device_get_vendor_and_product_ids(self):
         '''
         Test that the VID and PID supplied with the constructor is returned.
@@ -130,6 +163,260 @@ class Test(unittest.TestCase):
         self.assertRaises(DeviceError, device.send, 'foo')
         self.assertRaises(DeviceError, device.receive)
 
+    def test_hidraw_device_send_and_receive(self):
+        '''
+        Reports must be written with the report number and read back without
+        blocking, using a pty in place of the hidraw node.
+        '''
+        (master, slave) = os.openpty()
+        tty.setraw(slave)
+        device = HidrawDevice(0x16c0, 0x0486, path=os.ttyname(slave))
+        try:
+            self.assertFalse(device.is_open())
+            device.open()
+            self.assertTrue(device.is_open())
+            device.send('foo')
+            self.assertEqual('\0foo', os.read(master, 64))
+            os.write(master, 'ack')
+            self.assertEqual('ack', device.receive())
+            # Nothing to read: the receive and its retry time out
+            self.assertEqual('', device.receive())
+            self.assertEqual(1, device.get_rtt_estimator().get_timeouts())
+            device.close()
+            self.assertFalse(device.is_open())
+            self.assertRaises(IOError, device.send, 'foo')
+        finally:
+            device.close()
+            os.close(master)
+            os.close(slave)
+
+    def test_hidraw_device_send_and_receive_feature_reports(self):
+        '''
+        In place of output and input reports, feature reports must be sent
+        and received with ioctls.
+        '''
+        ioctls = []
+
+        def _ioctl(fd, request, report, mutate_flag=True):
+            ioctls.append((request, str(report)))
+            if request & 0xff == 0x07:
+                report[1:] = '\x76\x00\x01\x02\x00\x00\x00'
+            return 0
+        (master, slave) = os.openpty()
+        device = HidrawDevice(0x27b8,
+                              0x01ed,
+                              path=os.ttyname(slave),
+                              feature_reports=True)
+        ioctl = fcntl.ioctl
+        fcntl.ioctl = _ioctl
+        try:
+            device.open()
+            self.assertEqual(8, device.get_packet_size())
+            device.send(None)
+            device.send([0x01, 0x63, 255, 0, 0, 0, 100, 0])
+            self.assertTrue(device.poll())
+            # HIDIOCSFEATURE(8) and HIDIOCGFEATURE(8)
+            self.assertListEqual([(0xc0084806, '\x01\x63\xff\x00\x00\x00'
+                                               '\x64\x00'),
+                                  (0xc0084806, '\x01\x76' + '\x00' * 6),
+                                  (0xc0084807, '\x01' + '\x00' * 7)],
+                                 ioctls)
+            device.close()
+            self.assertRaises(IOError, device.send, [0x01])
+        finally:
+            fcntl.ioctl = ioctl
+            device.close()
+            os.close(master)
+            os.close(slave)
+
+    def test_hidraw_device_find_path(self):
+        '''
+        The node must be found by the VID and PID in sysfs, and by the usage
+        page and usage if the device has several interfaces.
+        '''
+        sysfs_path = tempfile.mkdtemp()
+        try:
+            for (name, hid_id, descriptor) in [
+                    ('hidraw0', '0003:000027B8:000001ED',
+                     '\x06\x00\xff\x09\x01\xa1\x01'),
+                    ('hidraw1', '0003:00001234:00005678', None),
+                    ('hidraw10', '0003:000016C0:00000486',
+                     '\x06\xab\xff\x0a\x00\x02\xa1\x01'),
+                    ('hidraw2', '0003:000016C0:00000486',
+                     '\x06\xc9\xff\x09\x04\xa1\x5c')]:
+                os.makedirs(os.path.join(sysfs_path, name, 'device'))
+                with open(os.path.join(sysfs_path, name, 'device', 'uevent'),
+                          'w') as f:
+                    f.write('DRIVER=hid-generic\nHID_ID={0}\n'.format(hid_id))
+                if descriptor is None:
+                    continue
+                with open(os.path.join(sysfs_path, name, 'device',
+                                       'report_descriptor'), 'wb') as f:
+                    f.write(descriptor)
+            # A single interface, whatever its usage
+            device = HidrawDevice(0x27b8, 0x01ed, 0xffc9, 0x0004,
+                                  sysfs_path=sysfs_path)
+            self.assertEqual('/dev/hidraw0', device._find_path())
+            device = HidrawDevice(0x1234, 0x5678, sysfs_path=sysfs_path)
+            self.assertEqual('/dev/hidraw1', device._find_path())
+            # Several interfaces
+            device = HidrawDevice(0x16c0, 0x0486, 0xffab, 0x0200,
+                                  sysfs_path=sysfs_path)
+            self.assertEqual('/dev/hidraw10', device._find_path())
+            device = HidrawDevice(0x16c0, 0x0486, 0xffc9, 0x0004,
+                                  sysfs_path=sysfs_path)
+            self.assertEqual('/dev/hidraw2', device._find_path())
+            device = HidrawDevice(0x16c0, 0x0486, sysfs_path=sysfs_path)
+            try:
+                device.open()
+                self.fail('Opened one of several interfaces')
+            except IOError, e:
+                self.assertTrue('hidraw2, hidraw10' in str(e))
+            self.assertFalse(device.is_open())
+            device = HidrawDevice(0x1, 0x1, sysfs_path=sysfs_path)
+            self.assertIsNone(device._find_path())
+            self.assertRaises(IOError, device.open)
+            self.assertFalse(device.is_open())
+            self.assertRaises(IOError, device.send, 'foo')
+            self.assertRaises(IOError, device.receive)
+        finally:
+            shutil.rmtree(sysfs_path)
+
+    def test_hidraw_device_top_level_usage(self):
+        '''
+        The usage page and usage of a report descriptor's top-level
+        collection must be parsed, skipping long items.
+        '''
+        self.assertEqual((0xffc9, 0x0004),
+                         _get_top_level_usage('\x06\xc9\xff\x09\x04'))
+        self.assertEqual((0xffab, 0x0200),
+                         _get_top_level_usage('\xfe\x02\x00\x01\x02'
+                                              '\x0b\x00\x02\xab\xff'))
+        self.assertIsNone(_get_top_level_usage('\xa1\x01\xc0'))
+        self.assertIsNone(_get_top_level_usage(''))
+
+    def test_async_pyusb_device_send_and_receive(self):
+        '''
+        Transfers must be submitted and completed on the event thread, and
+        reused once completed.
+        '''
+        event_thread = UsbEventThread(mock_usb1.USBContext(),
+                                      logger=self._logger)
+        device = AsyncPyUsbDevice(0x16c0, 0x0486, 0, event_thread)
+        self.assertRaises(IOError, device.send, 'foo')
+        device.open()
+        try:
+            self.assertTrue(device.is_open())
+            self.assertEqual(64, device.get_packet_size())
+            self.assertEqual(1, event_thread.get_users())
+            for i in range(3):
+                mock_usb1.replies.append('ack{0}'.format(i))
+                device.send('foo{0}'.format(i))
+                self.assertEqual('ack{0}'.format(i), device.receive())
+            self.assertListEqual(['foo0', 'foo1', 'foo2'], mock_usb1.sent)
+            self.assertTrue(len(mock_usb1.transfers) <= 2)
+        finally:
+            device.close()
+        self.assertFalse(device.is_open())
+        self.assertEqual(0, event_thread.get_users())
+        self.assertListEqual([], mock_usb1.claimed)
+
+    def test_async_pyusb_device_send_copies_data(self):
+        '''
+        The data must be sent as submitted, even when the caller reuses its
+        buffer while the transfer is in flight.
+        '''
+        event_thread = UsbEventThread(mock_usb1.USBContext(),
+                                      logger=self._logger)
+        device = AsyncPyUsbDevice(0x16c0, 0x0486, 0, event_thread)
+        device.open()
+        try:
+            frame = bytearray('foo')
+            mock_usb1.handling.clear()
+            device.send(frame)
+            frame[:] = 'bar'
+            device.send(frame)
+            mock_usb1.handling.set()
+            mock_usb1.replies.append('ack')
+            self.assertEqual('ack', device.receive())
+            self.assertListEqual(['foo', 'bar'], mock_usb1.sent)
+        finally:
+            device.close()
+
+    def test_async_pyusb_device_failed_send(self):
+        '''
+        A failed send must be raised by the next send or receive.
+        '''
+        event_thread = UsbEventThread(mock_usb1.USBContext(),
+                                      logger=self._logger)
+        device = AsyncPyUsbDevice(0x16c0, 0x0486, 0, event_thread)
+        device.open()
+        try:
+            mock_usb1.failures = 1
+            device.send('foo')
+            self.assertRaises(IOError, device.receive)
+            mock_usb1.failures = 1
+            device.send('foo')
+            deadline = time() + 1
+            while len(mock_usb1.completed) < 2 and time() < deadline:
+                sleep(0.01)
+            self.assertRaises(IOError, device.send, 'bar')
+            # Carries on after the failure
+            mock_usb1.replies.append('ack')
+            device.send('foo')
+            self.assertEqual('ack', device.receive())
+            self.assertListEqual(['foo'], mock_usb1.sent)
+        finally:
+            device.close()
+
+    def test_async_pyusb_device_reopen(self):
+        '''
+        Closing must release the device and its transfers, so that it can
+        be opened again.
+        '''
+        event_thread = UsbEventThread(mock_usb1.USBContext(),
+                                      logger=self._logger)
+        device = AsyncPyUsbDevice(0x16c0, 0x0486, 0, event_thread)
+        transfers = []
+        for _ in range(2):
+            device.open()
+            self.assertTrue(device.is_open())
+            self.assertListEqual([0], mock_usb1.claimed)
+            mock_usb1.replies.append('ack')
+            device.send('foo')
+            self.assertEqual('ack', device.receive())
+            device.close()
+            self.assertFalse(device.is_open())
+            self.assertListEqual([], mock_usb1.claimed)
+            self.assertEqual(0, event_thread.get_users())
+            self.assertRaises(IOError, device.receive)
+            transfers.append(len(mock_usb1.transfers))
+        # The transfers of a closed device are not reused
+        self.assertTrue(transfers[0] < transfers[1])
+        mock_usb1.present = []
+        self.assertRaises(IOError, device.open)
+        self.assertFalse(device.is_open())
+
+    def test_async_blink1_device_send_and_receive(self):
+        '''
+        Feature reports must be set and got with control transfers.
+        '''
+        event_thread = UsbEventThread(mock_usb1.USBContext(),
+                                      logger=self._logger)
+        device = AsyncBlink1Device(0x16c0, 0x0486, 0, event_thread)
+        device.open()
+        try:
+            self.assertEqual(8, device.get_packet_size())
+            device.send(None)
+            mock_usb1.replies.append('\x01v\x00\x01\x02\x00\x00\x00')
+            self.assertTrue(device.poll())
+            self.assertListEqual(['\x00v' + '\x00' * 7], mock_usb1.sent)
+            self.assertListEqual([(0x21, 0x09, 0x0301, 0),
+                                  (0xa1, 0x01, 0x0301, 0)],
+                                 mock_usb1.controls)
+        finally:
+            device.close()
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
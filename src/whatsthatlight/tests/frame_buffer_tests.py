@@ -0,0 +1,48 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import unittest
+
+# Local imports
+from whatsthatlight.common.frame_buffer import FrameBuffer
+
+
+class Test(unittest.TestCase):
+    '''
+    FrameBuffer tests.
+    '''
+
+    def test_fill(self):
+        '''
+        The same frame must be reused, padded with nulls after every command.
+        '''
+        frame_buffer = FrameBuffer(8)
+        self.assertEqual(8, frame_buffer.get_size())
+        frame = frame_buffer.fill('red=on\n')
+        self.assertEqual('red=on\n\0', frame)
+        self.assertIs(frame, frame_buffer.fill('foo'))
+        self.assertEqual('foo\0\0\0\0\0', frame)
+        self.assertEqual('foobar\0\0', frame_buffer.fill('foobar'))
+        self.assertEqual('\0' * 8, frame_buffer.fill(''))
+
+    def test_fill_too_long(self):
+        '''
+        A command longer than the frame must be rejected.
+        '''
+        frame_buffer = FrameBuffer(4)
+        self.assertRaises(ValueError, frame_buffer.fill, 'foobar')
+
+if __name__ == "__main__":
+    unittest.main()
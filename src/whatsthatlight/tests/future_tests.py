@@ -0,0 +1,52 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# System imports
+import unittest
+
+# Local imports
+from whatsthatlight.common import future
+from whatsthatlight.common.future import Future, FutureTimeoutException
+
+
+class Test(unittest.TestCase):
+    '''
+    Future tests.
+    '''
+
+    def test_result_and_callbacks(self):
+        '''
+        Callbacks must be invoked once done, or right away if done already.
+        '''
+        done = []
+        f = Future()
+        f.add_done_callback(done.append)
+        self.assertFalse(f.done())
+        self.assertRaises(FutureTimeoutException, f.result, 0)
+        f.set_result('foo')
+        f.add_done_callback(done.append)
+        self.assertEqual('foo', f.result())
+        self.assertListEqual([f, f], done)
+
+    def test_exception(self):
+        '''
+        The exception set must be raised by result.
+        '''
+        f = Future()
+        f.set_exception(IOError())
+        self.assertIsInstance(f.exception(), IOError)
+        self.assertRaises(IOError, f.result)
+        self.assertTrue(future.completed(True).result())
+
+if __name__ == "__main__":
+    unittest.main()
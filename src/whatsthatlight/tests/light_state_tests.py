@@ -0,0 +1,79 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# System imports
+import unittest
+
+# Local imports
+from whatsthatlight.common import mapping
+from whatsthatlight.common import usb_protocol_types
+from whatsthatlight.common.light_state import LightState
+
+
+class Test(unittest.TestCase):
+    '''
+    Light state tests.
+    '''
+
+    def test_write_changed_leds_only(self):
+        '''
+        Only LEDs that change must be written.
+        '''
+        light_state = LightState(mapping.Mapping(),
+                                 usb_protocol_types.DAS_BLINKENLICHTEN)
+        self.assertEqual('red=on\ngreen=on\nyellow=on\n',
+                         light_state.update(mapping.STATUS_DOWN)[0])
+        self.assertIsNone(light_state.update(mapping.BUILD_ACTIVE)[0])
+        self.assertEqual(('red=off\n', frozenset(['red'])),
+                         light_state.update(mapping.ATTENTION_NONE))
+        self.assertEqual('yellow=off\n',
+                         light_state.update(mapping.BUILD_INACTIVE)[0])
+        self.assertEqual(1, light_state.get_suppressed_writes())
+        self.assertEqual(2, light_state.get_suppressed_fragments())
+
+    def test_force_and_reset(self):
+        '''
+        Forcing or resetting must write all LEDs again.
+        '''
+        light_state = LightState(mapping.Mapping(),
+                                 usb_protocol_types.DAS_BLINKENLICHTEN)
+        (command, _) = light_state.update(mapping.STATUS_DOWN)
+        (forced, _) = light_state.update(mapping.STATUS_DOWN, force=True)
+        self.assertEqual(command, forced)
+        light_state.reset()
+        self.assertEqual(command, light_state.update(mapping.STATUS_DOWN)[0])
+        self.assertEqual(0, light_state.get_suppressed_writes())
+        # After a reset, all the lights must be written with the next update
+        light_state.update(mapping.ATTENTION_NONE)
+        light_state.reset()
+        expected = 'red=off\ngreen=on\nyellow=off\n'
+        self.assertEqual(expected,
+                         light_state.update(mapping.BUILD_INACTIVE)[0])
+        self.assertEqual(expected, light_state.get_command())
+
+    def test_blink1(self):
+        '''
+        A blink(1) has a single LED, so an identical colour must not be
+        written again.
+        '''
+        light_state = LightState(mapping.Mapping(), usb_protocol_types.BLINK1)
+        (command, channels) = light_state.update(mapping.ATTENTION_REQUIRED)
+        self.assertEqual(255, command[2])
+        self.assertEqual(frozenset([0]), channels)
+        self.assertIsNone(light_state.update(mapping.ATTENTION_REQUIRED)[0])
+        self.assertIsNone(light_state.update(mapping.BUILD_INACTIVE)[0])
+        self.assertIsNotNone(light_state.update(mapping.ATTENTION_NONE)[0])
+        self.assertEqual(1, light_state.get_suppressed_writes())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,11 +13,13 @@
 # limitations under the License.
 
 # System imports
+import socket
 import unittest
 import threading
 
 # Local imports
-from whatsthatlight.listener import Listener
+from whatsthatlight.listener import Listener, MultiplexingListener
+from whatsthatlight.listener import PersistentListener
 from whatsthatlight.common import utils
 from whatsthatlight.common import logger
 
@@ -112,6 +114,115 @@ class Test(unittest.TestCase):
         for i in range(0, 2):
             self.assertEqual(dataRx[i], dataTx[i])
 
+    def test_multiplexing_start_and_stop(self):
+        '''
+        Basic start and stop test.
+        '''
+        listener = MultiplexingListener(self._logger)
+        listener.start()
+        self.assertTrue(listener.running)
+        listener.stop()
+        self.assertFalse(listener.running)
+        listener.stop()
+        self.assertFalse(listener.running)
+
+    def test_multiplexing_listening(self):
+        '''
+        Basic listening test by connecting to the multiplexing listener.
+        '''
+        event = threading.Event()
+        dataTx = []
+        dataRx = []
+
+        def handler(data):
+            dataRx.append(data)
+            event.set()
+
+        address = '0.0.0.0'
+        port = 10001
+        listener = MultiplexingListener(self._logger, address, port, handler)
+        listener.start()
+        self.assertTrue(listener.running)
+        try:
+            for i in range(0, 10):
+                data = 'test' + str(i)
+                dataTx.append(data)
+                event.clear()
+                utils.send(address, port, data)
+                event.wait(10)
+        finally:
+            listener.stop()
+            self.assertFalse(listener.running)
+        self.assertListEqual(dataTx, dataRx)
+
+    def test_multiplexing_stalled_peer(self):
+        '''
+        A peer that connects but never sends must not block other peers.
+        '''
+        self._multiplexing_stalled_peer(0)
+        self._multiplexing_stalled_peer(1)
+
+    def _multiplexing_stalled_peer(self, defer_accept_period):
+        '''
+        Helper.
+        :param defer_accept_period: passed through to the listener
+        '''
+        event = threading.Event()
+        dataRx = []
+
+        def handler(data):
+            dataRx.append(data)
+            event.set()
+
+        address = '127.0.0.1'
+        port = 10002 + defer_accept_period
+        listener = MultiplexingListener(self._logger,
+                                        address,
+                                        port,
+                                        handler,
+                                        defer_accept_period=
+                                        defer_accept_period)
+        listener.start()
+        stalled = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            stalled.connect((address, port))
+            utils.send(address, port, 'foo')
+            event.wait(5)
+        finally:
+            stalled.close()
+            listener.stop()
+        self.assertListEqual(['foo'], dataRx)
+
+    def test_persistent_listening(self):
+        '''
+        Messages packed into or split across segments on a single connection
+        must each be handled separately.
+        '''
+        event = threading.Event()
+        dataRx = []
+        expected = ['foo!', 'bar!', 'baz!', 'qux!']
+
+        def handler(data):
+            dataRx.append(data)
+            if len(dataRx) == len(expected):
+                event.set()
+
+        address = '127.0.0.1'
+        port = 10004
+        listener = PersistentListener(self._logger, address, port, handler)
+        listener.start()
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            client.connect((address, port))
+            client.sendall('foo!bar!')
+            client.sendall('ba')
+            client.sendall('z!qux!unterminated')
+            event.wait(5)
+        finally:
+            client.close()
+            listener.stop()
+        self.assertListEqual(expected, dataRx)
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
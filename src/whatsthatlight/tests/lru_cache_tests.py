@@ -0,0 +1,54 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import unittest
+
+# Local imports
+from whatsthatlight.common.lru_cache import LruCache
+
+
+class Test(unittest.TestCase):
+    '''
+    LRU cache tests.
+    '''
+
+    def test_hits_and_misses(self):
+        '''
+        Lookups must be counted as hits or misses.
+        '''
+        cache = LruCache(2)
+        self.assertIsNone(cache.get('foo'))
+        cache.put('foo', 'bar')
+        self.assertEqual('bar', cache.get('foo'))
+        self.assertEqual('baz', cache.get('qux', 'baz'))
+        self.assertEqual(1, cache.get_hits())
+        self.assertEqual(2, cache.get_misses())
+
+    def test_evict_least_recently_used(self):
+        '''
+        The least recently used entry must be evicted when full.
+        '''
+        cache = LruCache(2)
+        cache.put('foo', 1)
+        cache.put('bar', 2)
+        cache.get('foo')
+        cache.put('baz', 3)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.get('foo'))
+        self.assertIsNone(cache.get('bar'))
+        self.assertEqual(3, cache.get('baz'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,6 +16,9 @@
 import logging
 import threading
 
+# Local imports
+from whatsthatlight.common import future
+
 # Constants
 _ACK = 'ack'
 _TIMEOUT = 50
@@ -30,6 +33,8 @@ class DeviceController(object):
                  logger=logging.basicConfig()):
         self._logger = logger
         self._send_handler = send_handler
+        self.event_handlers = {'add': None,
+                               'remove': None}
         self.running = False
         self._runLock = threading.Lock()
 
@@ -54,15 +59,18 @@ class DeviceController(object):
             self._logger.info("Mock device controller stopped")
 
     def _get_add_event_handler(self):
-        return None
+        return self.event_handlers['add']
 
     def set_add_event_handler(self, handler):
-        pass
+        self.event_handlers['add'] = handler
 
     def _get_remove_event_handler(self):
-        return None
+        return self.event_handlers['remove']
 
     def set_remove_event_handler(self, handler):
+        self.event_handlers['remove'] = handler
+
+    def set_replay_handler(self, handler):
         pass
 
     def _device_is_open(self):
@@ -74,6 +82,9 @@ class DeviceController(object):
     def _close_device(self):
         self._is_open = False
 
+    def submit(self, command, channels=None, priority=None):
+        return future.completed(self.send(command))
+
     def send(self, command):
         if not self._send_handler is None:
-            self._send_handler(command)
+            return self._send_handler(command)
@@ -21,6 +21,10 @@ vendor_id = None
 model_id = None
 dormant = False
 delay = 1
+# The tags filtered by
+tags = []
+# The devices present, as listed by a context
+present = []
 
 
 class Context(object):
@@ -28,6 +32,15 @@ class Context(object):
     def __init__(self):
         pass
 
+    def list_devices(self, subsystem=None, **properties):
+        return Enumerator(present)
+
+
+class Enumerator(list):
+
+    def match_tag(self, tag):
+        return self
+
 
 class Monitor(object):
 
@@ -37,6 +50,9 @@ class Monitor(object):
     def filter_by(self, subsystem=None, device_type=None):
         pass
 
+    def filter_by_tag(self, tag):
+        tags.append(tag)
+
     @classmethod
     def from_netlink(cls, context):
         return Monitor()
@@ -0,0 +1,187 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import Queue
+import threading
+
+TRANSFER_COMPLETED = 0
+TRANSFER_ERROR = 1
+TYPE_CLASS = 0x20
+RECIPIENT_INTERFACE = 0x01
+ENDPOINT_OUT = 0x00
+ENDPOINT_IN = 0x80
+
+# The devices present, as (VID, PID) tuples
+present = []
+# The data sent, and the replies received in order
+sent = []
+replies = []
+# The number of transfers to fail next
+failures = 0
+# The transfers created, the control set-ups submitted and the statuses of
+# the transfers completed
+transfers = []
+controls = []
+completed = []
+# The interfaces claimed
+claimed = []
+# Cleared to hold back completing the transfers submitted
+handling = threading.Event()
+handling.set()
+
+
+class USBError(Exception):
+    pass
+
+
+class USBContext(object):
+    '''
+    A libusb context completing the transfers submitted when handling its
+    events.
+    '''
+
+    def __init__(self):
+        self.submitted = Queue.Queue()
+
+    def openByVendorIDAndProductID(self, vendor_id, product_id,
+                                   skip_on_error=False):
+        if not (vendor_id, product_id) in present:
+            return None
+        return USBDeviceHandle(self)
+
+    def handleEventsTimeout(self, tv=0):
+        if not handling.wait(tv):
+            return
+        try:
+            transfer = self.submitted.get(timeout=tv)
+        except Queue.Empty:
+            return
+        transfer.complete()
+
+
+class USBDeviceHandle(object):
+
+    def __init__(self, context):
+        self._context = context
+        self.closed = False
+
+    def setAutoDetachKernelDriver(self, enable):
+        pass
+
+    def claimInterface(self, interface):
+        if interface in claimed:
+            raise USBError('Busy')
+        claimed.append(interface)
+
+    def releaseInterface(self, interface):
+        claimed.remove(interface)
+
+    def close(self):
+        self.closed = True
+
+    def getDevice(self):
+        return USBDevice()
+
+    def getTransfer(self):
+        transfer = USBTransfer(self._context)
+        transfers.append(transfer)
+        return transfer
+
+
+class USBDevice(object):
+
+    def iterSettings(self):
+        return [USBInterfaceSetting(0, [USBEndpoint(0x81, 64),
+                                        USBEndpoint(0x01, 64)])]
+
+
+class USBInterfaceSetting(list):
+
+    def __init__(self, number, endpoints):
+        list.__init__(self, endpoints)
+        self._number = number
+
+    def getNumber(self):
+        return self._number
+
+
+class USBEndpoint(object):
+
+    def __init__(self, address, max_packet_size):
+        self._address = address
+        self._max_packet_size = max_packet_size
+
+    def getAddress(self):
+        return self._address
+
+    def getMaxPacketSize(self):
+        return self._max_packet_size
+
+
+class USBTransfer(object):
+
+    def __init__(self, context):
+        self._context = context
+        self._data = None
+        self._callback = None
+        self._user_data = None
+        self._status = None
+        self._buffer = bytearray()
+
+    def setBulk(self, endpoint, buffer_or_len, callback=None,
+                user_data=None, timeout=0):
+        self._set(endpoint & ENDPOINT_IN, buffer_or_len, callback, user_data)
+
+    def setControl(self, request_type, request, value, index,
+                   buffer_or_len, callback=None, user_data=None, timeout=0):
+        controls.append((request_type, request, value, index))
+        self._set(request_type & ENDPOINT_IN, buffer_or_len, callback,
+                  user_data)
+
+    def submit(self):
+        self._context.submitted.put(self)
+
+    def complete(self):
+        global failures
+        if failures > 0:
+            failures -= 1
+            self._status = TRANSFER_ERROR
+        else:
+            self._status = TRANSFER_COMPLETED
+            if self._data is None:
+                self._buffer = bytearray(replies.pop(0))
+            else:
+                sent.append(str(self._data))
+                self._buffer = bytearray(self._data)
+        self._callback(self)
+        completed.append(self._status)
+
+    def getUserData(self):
+        return self._user_data
+
+    def getStatus(self):
+        return self._status
+
+    def getActualLength(self):
+        return len(self._buffer)
+
+    def getBuffer(self):
+        return self._buffer
+
+    def _set(self, receiving, buffer_or_len, callback, user_data):
+        # Like python-libusb1, a writable buffer is sent from as is
+        self._data = None if receiving else buffer_or_len
+        self._callback = callback
+        self._user_data = user_data
@@ -0,0 +1,155 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from threading import Event
+
+# Local imports
+from whatsthatlight.common import logger
+from whatsthatlight.device_monitors import NetlinkDeviceMonitor
+from whatsthatlight.usb_topology import UsbTopologyIndex
+
+# Recorded kernel uevents of a blink(1) (27b8:01ed) being plugged in and out
+_DEVPATH = '/devices/pci0000:00/0000:00:14.0/usb1/1-2'
+_BLINK1_ADD = ('add@{0}\0ACTION=add\0DEVPATH={0}\0SUBSYSTEM=usb\0MAJOR=189\0'
+               'MINOR=3\0DEVNAME=bus/usb/001/004\0DEVTYPE=usb_device\0'
+               'PRODUCT=27b8/1ed/2\0TYPE=0/0/0\0BUSNUM=001\0DEVNUM=004\0'
+               'SEQNUM=3405\0'.format(_DEVPATH))
+_BLINK1_INTERFACE_ADD = ('add@{0}/1-2:1.0\0ACTION=add\0'
+                         'DEVPATH={0}/1-2:1.0\0SUBSYSTEM=usb\0'
+                         'DEVTYPE=usb_interface\0PRODUCT=27b8/1ed/2\0'
+                         'TYPE=0/0/0\0INTERFACE=3/0/0\0SEQNUM=3406\0'.
+                         format(_DEVPATH))
+_BLINK1_REMOVE = ('remove@{0}\0ACTION=remove\0DEVPATH={0}\0SUBSYSTEM=usb\0'
+                  'DEVNAME=bus/usb/001/004\0DEVTYPE=usb_device\0'
+                  'PRODUCT=27b8/1ed/2\0TYPE=0/0/0\0SEQNUM=3410\0'.
+                  format(_DEVPATH))
+_TEENSY_ADD = ('add@/devices/pci0000:00/0000:00:14.0/usb1/1-3\0ACTION=add\0'
+               'SUBSYSTEM=usb\0DEVTYPE=usb_device\0PRODUCT=16c0/486/100\0'
+               'SEQNUM=3411\0')
+
+
+class Test(unittest.TestCase):
+    '''
+    Netlink device monitor tests.
+    '''
+
+    def setUp(self):
+        '''
+        Setup.
+        '''
+        self._logger = logger.get_logger('src/whatsthatlight/logger.conf')
+        (self._monitor_socket, self._kernel_socket) = \
+            socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sysfs_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        '''
+        Tear down.
+        '''
+        self._monitor_socket.close()
+        self._kernel_socket.close()
+        shutil.rmtree(self._sysfs_path)
+
+    def test_start_and_stop(self):
+        '''
+        Starting and stopping twice must not fail.
+        '''
+        monitor = NetlinkDeviceMonitor(0x27b8,
+                                       0x01ed,
+                                       sock=self._monitor_socket,
+                                       sysfs_path=self._sysfs_path,
+                                       logger=self._logger)
+        monitor.start()
+        monitor.start()
+        self.assertTrue(monitor.running)
+        monitor.stop()
+        monitor.stop()
+        self.assertFalse(monitor.running)
+
+    def test_device_events(self):
+        '''
+        Only the device's own add and remove events must invoke the
+        handlers, but any device's events must invalidate the topology
+        index.
+        '''
+        added = Event()
+        removed = Event()
+        events = []
+        scans = []
+
+        def _scan(vendor_id, product_id, serial_number):
+            scans.append((vendor_id, product_id))
+            return 'device'
+        index = UsbTopologyIndex(_scan)
+        monitor = NetlinkDeviceMonitor(0x27b8,
+                                       0x01ed,
+                                       sock=self._monitor_socket,
+                                       sysfs_path=self._sysfs_path,
+                                       topology_index=index,
+                                       logger=self._logger)
+
+        def _add_event_handler():
+            events.append('add')
+            added.set()
+
+        def _remove_event_handler():
+            events.append('remove')
+            removed.set()
+        monitor.set_add_event_handler(_add_event_handler)
+        monitor.set_remove_event_handler(_remove_event_handler)
+        index.get_device(0x16c0, 0x0486)
+        monitor.start()
+        for uevent in [_TEENSY_ADD, 'foo', _BLINK1_INTERFACE_ADD, _BLINK1_ADD]:
+            self._kernel_socket.send(uevent)
+        self.assertTrue(added.wait(1))
+        self._kernel_socket.send(_BLINK1_REMOVE)
+        self.assertTrue(removed.wait(1))
+        monitor.stop()
+        self.assertListEqual(['add', 'remove'], events)
+        index.get_device(0x16c0, 0x0486)
+        self.assertEqual(2, len(scans))
+
+    def test_cold_plug(self):
+        '''
+        A device present already must be added when starting.
+        '''
+        for (name, ids) in [('usb1', ('1d6b', '0002')),
+                            ('1-2', ('27b8', '01ed')),
+                            ('1-2:1.0', None)]:
+            os.mkdir(os.path.join(self._sysfs_path, name))
+            if ids is None:
+                continue
+            for (filename, value) in zip(['idVendor', 'idProduct'], ids):
+                with open(os.path.join(self._sysfs_path, name, filename),
+                          'w') as f:
+                    f.write(value + '\n')
+        added = []
+        monitor = NetlinkDeviceMonitor(0x27b8,
+                                       0x01ed,
+                                       sock=self._monitor_socket,
+                                       sysfs_path=self._sysfs_path,
+                                       logger=self._logger)
+        monitor.set_add_event_handler(lambda: added.append(True))
+        monitor.start()
+        self.assertListEqual([True], added)
+        monitor.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -340,6 +340,65 @@ class Test(unittest.TestCase):
                                           format(fields.USERNAME,
                                                  username)))
 
+    def test_registration_retry_abandoned(self):
+        '''
+        Test that a registration in progress when the device was removed,
+        or the client stopped, is not retried.
+        '''
+        server_port = 10211
+        attempts = []
+        sending = Event()
+        refused = Event()
+        send = utils.send
+
+        # The server refuses the registrations, once told to
+        def _send(address, port, data):
+            if not port == server_port:
+                return send(address, port, data)
+            attempts.append(data)
+            sending.set()
+            refused.wait(1)
+            raise IOError('Connection refused')
+
+        mock_dc = mock_device_controller.DeviceController(logger=self._logger)
+        client = notifier_client.NotifierClient('foo',
+                                                mock_dc,
+                                                address='localhost',
+                                                port=10210,
+                                                server_address='localhost',
+                                                server_port=server_port,
+                                                retry_period=0.1,
+                                                logger=self._logger)
+        utils.send = _send
+        try:
+            client.start()
+            # Removed while registering
+            mock_dc._get_add_event_handler()()
+            self.assertTrue(sending.wait(1))
+            mock_dc._get_remove_event_handler()()
+            refused.set()
+            sleep(0.3)
+            self.assertEqual(1, len(attempts))
+            # Retried while added, also when added again meanwhile
+            mock_dc._get_add_event_handler()()
+            mock_dc._get_add_event_handler()()
+            sleep(0.3)
+            self.assertTrue(len(attempts) > 2)
+            # Stopped while registering
+            refused.clear()
+            sending.clear()
+            self.assertTrue(sending.wait(1))
+            client.stop()
+            refused.set()
+            sleep(0.3)
+            stopped = len(attempts)
+            sleep(0.3)
+            self.assertEqual(stopped, len(attempts))
+        finally:
+            utils.send = send
+            refused.set()
+            client.stop()
+
     def test_set_unknown_status_on_startup_and_shutdown(self):
         '''
         Check that the client sets the USB device's status to
@@ -413,9 +472,11 @@ class Test(unittest.TestCase):
         client.stop()
         self.assertFalse(client.running)
 
-        # Test the number of commands/command batches sent
-        self.assertTrue(len(command_list) == 3,
-                        'There must be exactly three commands')
+        # Test the number of commands/command batches sent: the request
+        # does not change the lights set on start-up, so it is suppressed
+        self.assertTrue(len(command_list) == 2,
+                        'There must be exactly two commands')
+        self.assertEqual(1, client.get_suppressed_writes())
 
         # Split correctly generates an empty string after the last \n
         expected = ['red=on', 'green=on', 'yellow=on', '']
@@ -423,5 +484,48 @@ class Test(unittest.TestCase):
             self.assertTrue(command.count('\n'), 3)
             self.assertListEqual(expected, command.split('\n'))
 
+    def test_handle_repeated_data(self):
+        '''
+        Repeated data must be decoded once and written once; invalid data
+        must never be written.
+        '''
+        command_list = []
+
+        def _send_handler(command):
+            command_list.append(command)
+
+        mock_dc = mock_device_controller.DeviceController(_send_handler,
+                                                          logger=self._logger)
+        client = notifier_client.NotifierClient('foo',
+                                                mock_dc,
+                                                logger=self._logger)
+        for _ in range(0, 3):
+            client.handle_data('requesttypeid=3;buildsactive=1!')
+            client.handle_data('requesttypeid=0!')
+        self.assertListEqual(['yellow=on\n'], command_list)
+        self.assertEqual((2, 4), client.get_state_cache_hits_and_misses())
+        self.assertEqual(2, client.get_suppressed_writes())
+
+    def test_write_changed_lights_only(self):
+        '''
+        Only the lights that change must be written.
+        '''
+        command_list = []
+
+        def _send_handler(command):
+            command_list.append(command)
+
+        mock_dc = mock_device_controller.DeviceController(_send_handler,
+                                                          logger=self._logger)
+        client = notifier_client.NotifierClient('foo',
+                                                mock_dc,
+                                                logger=self._logger)
+        client.handle_data('requesttypeid=2;attention=1;priority=0!')
+        client.handle_data('requesttypeid=0!')
+        client.handle_data('requesttypeid=2;attention=1;priority=1!')
+        self.assertListEqual(['red=on\ngreen=off\n', 'red=sos\n'],
+                             command_list)
+
+
 if __name__ == "__main__":
     unittest.main()
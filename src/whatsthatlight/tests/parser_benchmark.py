@@ -0,0 +1,102 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import itertools
+import sys
+import timeit
+
+# Local imports
+from whatsthatlight.common import parser
+
+# The requests exercised by parser_tests
+VALID_CORPUS = ['requesttypeid=4;status=1!',
+                'requesttypeid=4;status=0!',
+                'requesttypeid=3;buildsactive=1!',
+                'requesttypeid=3;buildsactive=0!',
+                'requesttypeid=2;attention=1;priority=1!',
+                'requesttypeid=2;attention=1;priority=0!',
+                'requesttypeid=2;attention=0;priority=0!']
+INVALID_CORPUS = ['foo=bar!',
+                  'requesttypeid=0!',
+                  'requesttypeid=foo!',
+                  'requesttypeid=1;requesttypeid=2!',
+                  'requesttypeid=1;requesttypeid=1!',
+                  'requesttypeid=2;attention=0;priority=1!']
+ITERATIONS = 20000
+REPEAT = 5
+SUSTAINED_LOAD = 100000
+
+
+def _decode_valid():
+    '''
+    Decode the valid corpus once.
+    '''
+    for data in VALID_CORPUS:
+        parser.decode(data)
+
+
+def _decode_invalid():
+    '''
+    Decode the invalid corpus once.
+    '''
+    for data in INVALID_CORPUS:
+        try:
+            parser.decode(data)
+        except Exception:
+            pass
+
+
+def _messages_per_second(method, corpus):
+    '''
+    Benchmark a decoding method and return the best rate.
+    :param method: a method decoding the corpus once
+    :param corpus: the corpus decoded by the method
+    '''
+    best = min(timeit.repeat(method, number=ITERATIONS, repeat=REPEAT))
+    return len(corpus) * ITERATIONS / best
+
+
+def _allocations():
+    '''
+    Decode a sustained load of notifications, keeping every request alive,
+    and return the number of distinct request objects and their total size
+    in bytes.
+    '''
+    decoded = [parser.decode(data) for data in
+               itertools.islice(itertools.cycle(VALID_CORPUS),
+                                SUSTAINED_LOAD)]
+    distinct = dict((id(request), request) for request in decoded).values()
+    size = 0
+    for request in distinct:
+        size += sys.getsizeof(request)
+        if hasattr(request, '__dict__'):
+            size += sys.getsizeof(request.__dict__)
+    return (len(distinct), size)
+
+
+def main():
+    '''
+    Print the decoding rates and allocations.
+    '''
+    print('Valid requests:   {0:10.0f} messages/s'.
+          format(_messages_per_second(_decode_valid, VALID_CORPUS)))
+    print('Invalid requests: {0:10.0f} messages/s'.
+          format(_messages_per_second(_decode_invalid, INVALID_CORPUS)))
+    (count, size) = _allocations()
+    print('Request objects allocated for {0} notifications: {1} '
+          '({2} bytes)'.format(SUSTAINED_LOAD, count, size))
+
+if __name__ == '__main__':
+    main()
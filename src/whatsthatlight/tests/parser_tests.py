@@ -22,6 +22,7 @@ from whatsthatlight.common import requests
 from whatsthatlight.common import fields
 from whatsthatlight.common import packets
 from whatsthatlight.common import request_types
+from whatsthatlight.common import usb_protocol_types
 from whatsthatlight.common.requests import InvalidRequestException
 
 
@@ -62,6 +63,17 @@ class Test(unittest.TestCase):
                                           format(fields.USERNAME,
                                                  username)))
 
+    def test_encode_registration_request_is_canonical(self):
+        '''
+        A registration request must always encode to the same bytes.
+        '''
+        request = requests.RegistrationRequest('bar', 'foo')
+        expected = 'requesttypeid=1;hostname=bar;username=foo!'
+        self.assertEqual(expected, parser.encode(request))
+        self.assertEqual(expected, parser.encode(requests.
+                                                 RegistrationRequest('bar',
+                                                                     'foo')))
+
     def test_encode_invalid_request(self):
         '''
         Test the encoding of an invalid request.
@@ -269,6 +281,103 @@ class Test(unittest.TestCase):
         else:
             self.fail('Invalid')
 
+    def test_stream_decoder(self):
+        '''
+        Requests split across and packed into chunks must all be decoded.
+        '''
+        decoder = parser.StreamDecoder()
+        decoded = []
+        for chunk in ['requesttypeid=3;buildsactive=1!requesttypeid=4;',
+                      'status=0!requesttypeid=2;atten',
+                      'tion=1;priority=1!',
+                      '']:
+            decoded.extend(decoder.feed(chunk))
+        self.assertFalse(decoder.has_partial_frame())
+        self.assertEqual(3, len(decoded))
+        self.assertIsInstance(decoded[0], requests.BuildActiveRequest)
+        self.assertTrue(decoded[0].is_build_active())
+        self.assertIsInstance(decoded[1], requests.StatusRequest)
+        self.assertFalse(decoded[1].is_up())
+        self.assertIsInstance(decoded[2], requests.AttentionRequest)
+        self.assertTrue(decoded[2].is_priority())
+
+    def test_stream_decoder_invalid_request(self):
+        '''
+        An invalid request must not prevent decoding the ones following it.
+        '''
+        decoder = parser.StreamDecoder()
+        requests_decoded = decoder.feed('requesttypeid=0!'
+                                        'requesttypeid=3;buildsactive=0!')
+        self.assertRaises(InvalidRequestException, list, requests_decoded)
+        decoded = list(decoder.feed(''))
+        self.assertEqual(1, len(decoded))
+        self.assertFalse(decoded[0].is_build_active())
+
+    def test_stream_decoder_max_frame_size(self):
+        '''
+        An oversized request must be discarded up to its terminator.
+        '''
+        decoder = parser.StreamDecoder(max_frame_size=32)
+        self.assertRaises(InvalidRequestException,
+                          list,
+                          decoder.feed('requesttypeid=3;' + 'x' * 32))
+        decoded = list(decoder.feed('yz!requesttypeid=3;buildsactive=1!'))
+        self.assertEqual(1, len(decoded))
+        self.assertTrue(decoded[0].is_build_active())
+
+    def test_stream_decoder_max_frame_size_terminated(self):
+        '''
+        An oversized request received in one chunk with its terminator must
+        be discarded too, without affecting the requests around it.
+        '''
+        decoder = parser.StreamDecoder(max_frame_size=10)
+        self.assertListEqual([], decoder.split('requesttypeid=2;'
+                                               'buildsactive=1!'))
+        self.assertTrue(decoder.has_overflowed())
+        frames = decoder.split('a=1!requesttypeid=2;buildsactive=1!b=2!')
+        self.assertListEqual(['a=1!', 'b=2!'], frames)
+        self.assertTrue(decoder.has_overflowed())
+        self.assertFalse(decoder.has_partial_frame())
+
+    def test_translate_for_blink1(self):
+        '''
+        Translate requests for a blink(1) device.
+        '''
+        red = parser.translate_for_blink1(requests.AttentionRequest(True,
+                                                                    False))
+        self.assertListEqual([0x01, 0x63, 255, 0, 0, 0, 100, 0], red)
+        blue = parser.translate(requests.StatusRequest(False),
+                                usb_protocol_types.BLINK1)
+        self.assertListEqual([0x01, 0x63, 0, 0, 255, 0, 100, 0], blue)
+
+    def test_register_translator(self):
+        '''
+        A translator registered for a new protocol must be used for it only.
+        '''
+        usb_protocol_type = 1000
+        request = requests.BuildActiveRequest(True)
+        self.assertRaises(InvalidRequestException,
+                          parser.translate,
+                          request,
+                          usb_protocol_type)
+        parser.register_translator(request_types.BUILD_ACTIVE,
+                                   usb_protocol_type,
+                                   lambda r: 'foo')
+        self.assertEqual('foo', parser.translate(request, usb_protocol_type))
+        self.assertEqual('yellow=on\n', parser.translate(request))
+
+    def test_decode_returns_shared_requests(self):
+        '''
+        Decoding equal requests must return the same immutable instance.
+        '''
+        data = 'requesttypeid=2;attention=1;priority=0!'
+        request = parser.decode(data)
+        self.assertIs(request, parser.decode(data))
+        self.assertIs(request, requests.AttentionRequest.get_instance(True,
+                                                                      False))
+        self.assertRaises(AttributeError, setattr, request, '_priority', True)
+        self.assertRaises(AttributeError, setattr, request, 'foo', True)
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.test']
     unittest.main()
@@ -77,6 +77,40 @@ class Test(unittest.TestCase):
         monitors.stop()
         self.assertFalse(monitors.running)
 
+    def test_cold_plug(self):
+        '''
+        A device present already must be added before starting returns.
+        '''
+        added = []
+        mock_device = mock()
+        when(mock_device).is_open().thenReturn(False)
+        monitor = PollingDeviceMonitor(mock_device,
+                                       polling_interval=1,
+                                       logger=self._logger)
+        monitor.set_add_event_handler(lambda: added.append(True))
+        monitor.start()
+        self.assertListEqual([True], added)
+        monitor.stop()
+        verify(mock_device, times=1).open()
+
+    def test_cold_plug_handler_fails(self):
+        '''
+        A failing add event handler must not fail starting, nor stopping.
+        '''
+        def _add_event_handler():
+            raise ValueError('Handler failed')
+
+        mock_device = mock()
+        when(mock_device).is_open().thenReturn(False)
+        monitor = PollingDeviceMonitor(mock_device,
+                                       polling_interval=0.1,
+                                       logger=self._logger)
+        monitor.set_add_event_handler(_add_event_handler)
+        monitor.start()
+        self.assertTrue(monitor.running)
+        monitor.stop()
+        self.assertFalse(monitor.running)
+
     def test_add_remove_handlers_invoked_error_on_send(self):
         # Overriding the default log level so that the instructions are clear
         # and not obfuscated by the many debug messages.
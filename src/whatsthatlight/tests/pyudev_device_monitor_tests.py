@@ -14,10 +14,13 @@
 
 # System imports
 import unittest
+from time import sleep
 
 # Local imports
+import mock_pyudev
 from whatsthatlight.common import logger
 from whatsthatlight.device_monitors import PyUdevDeviceMonitor
+from whatsthatlight.usb_topology import UsbTopologyIndex
 
 # Third-party imports
 import pyudev
@@ -71,3 +74,71 @@ class Test(unittest.TestCase):
         self.assertFalse(monitors.running)
         monitors.stop()
         self.assertFalse(monitors.running)
+
+    def test_events_invalidate_topology_index(self):
+        '''
+        Devices added or removed must be scanned for again, even if not the
+        device monitored.
+        '''
+        scans = []
+
+        def _scan(vendor_id, product_id, serial_number):
+            scans.append((vendor_id, product_id))
+            return 'device'
+        index = UsbTopologyIndex(_scan)
+        index.get_device(0x0a1b, 0x2c3d)
+        mock_pyudev.vendor_id = '0a1b'
+        mock_pyudev.model_id = '2c3d'
+        mock_pyudev.dormant = False
+        mock_pyudev.delay = 0.1
+        monitor = PyUdevDeviceMonitor(0,
+                                      0,
+                                      udev_module=mock_pyudev,
+                                      topology_index=index,
+                                      logger=self._logger)
+        monitor.start()
+        sleep(mock_pyudev.delay * 1.5)
+        index.get_device(0x0a1b, 0x2c3d)
+        monitor.stop()
+        self.assertListEqual([(0x0a1b, 0x2c3d), (0x0a1b, 0x2c3d)], scans)
+        index.get_device(0x0a1b, 0x2c3d)
+        self.assertEqual(3, len(scans))
+
+    def test_filter_by_tag(self):
+        '''
+        Events must be filtered by the udev tag, only if one is given.
+        '''
+        mock_pyudev.dormant = True
+        mock_pyudev.tags = []
+        PyUdevDeviceMonitor(0, 0, mock_pyudev, logger=self._logger)
+        PyUdevDeviceMonitor(0, 0, mock_pyudev, tag='', logger=self._logger)
+        PyUdevDeviceMonitor(0, 0, mock_pyudev, tag='foo', logger=self._logger)
+        self.assertListEqual(['foo'], mock_pyudev.tags)
+
+    def test_cold_plug(self):
+        '''
+        A device present already must be added when starting.
+        '''
+        added = []
+        mock_pyudev.dormant = True
+        mock_pyudev.present = [{'ID_VENDOR_ID': '16c0', 'ID_MODEL_ID': '0486'},
+                               {'ID_VENDOR_ID': '0a1b', 'ID_MODEL_ID': '2c3d'},
+                               {}]
+        monitor = PyUdevDeviceMonitor(0x0a1b,
+                                      0x2c3d,
+                                      mock_pyudev,
+                                      logger=self._logger)
+        monitor.set_add_event_handler(lambda: added.append(True))
+        monitor.start()
+        self.assertListEqual([True], added)
+        monitor.stop()
+        mock_pyudev.present = [{'ID_VENDOR_ID': '16c0', 'ID_MODEL_ID': '0486'}]
+        monitor = PyUdevDeviceMonitor(0x0a1b,
+                                      0x2c3d,
+                                      mock_pyudev,
+                                      logger=self._logger)
+        monitor.set_add_event_handler(lambda: added.append(True))
+        monitor.start()
+        monitor.stop()
+        mock_pyudev.present = []
+        self.assertListEqual([True], added)
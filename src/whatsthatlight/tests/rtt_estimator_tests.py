@@ -0,0 +1,70 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# System imports
+import unittest
+from time import sleep
+
+# Local imports
+from whatsthatlight.common.rtt_estimator import RttEstimator
+
+
+class Test(unittest.TestCase):
+    '''
+    Round-trip time estimator tests.
+    '''
+
+    def test_adapt_timeout(self):
+        '''
+        The timeout must follow the measured round-trip times.
+        '''
+        estimator = RttEstimator(initial_timeout=50, min_timeout=10)
+        timeouts = []
+
+        def _recv(timeout):
+            timeouts.append(timeout)
+            return 'ack'
+
+        for _ in range(0, 10):
+            estimator.sent()
+            self.assertEqual('ack', estimator.receive(_recv))
+        self.assertEqual(50, timeouts[0])
+        self.assertEqual(10, estimator.get_timeout())
+        self.assertTrue(estimator.get_smoothed_rtt() < 10)
+        self.assertEqual(0, estimator.get_timeouts())
+
+    def test_timeouts_and_spurious_retries(self):
+        '''
+        A timed out receive must be retried once with double the timeout.
+        '''
+        estimator = RttEstimator(initial_timeout=20, max_timeout=30)
+        replies = ['', 'ack', '', '']
+        timeouts = []
+
+        def _recv(timeout):
+            timeouts.append(timeout)
+            return replies.pop(0)
+
+        estimator.sent()
+        sleep(0.05)
+        self.assertEqual('ack', estimator.receive(_recv))
+        self.assertTrue(estimator.get_smoothed_rtt() >= 50)
+        self.assertEqual(30, estimator.get_timeout())
+        estimator.sent()
+        self.assertEqual('', estimator.receive(_recv))
+        self.assertListEqual([20, 30, 30, 30], timeouts)
+        self.assertEqual(2, estimator.get_timeouts())
+        self.assertEqual(1, estimator.get_spurious_retries())
+
+if __name__ == "__main__":
+    unittest.main()
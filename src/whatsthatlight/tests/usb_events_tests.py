@@ -0,0 +1,93 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import threading
+import unittest
+
+# Local imports
+from whatsthatlight.common import logger
+from whatsthatlight.usb_events import UsbEventThread
+
+
+class _Context(object):
+    '''
+    A libusb context counting the times its events were handled.
+    '''
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.handled = 0
+        self.handling = threading.Event()
+
+    def handleEventsTimeout(self, tv=0):
+        self.handling.set()
+        if self.failures > 0:
+            self.failures -= 1
+            raise Exception('Handling failed')
+        self.handled += 1
+        threading.Event().wait(tv)
+
+
+class Test(unittest.TestCase):
+    '''
+    USB event thread tests.
+    '''
+
+    def setUp(self):
+        '''
+        Setup.
+        '''
+        self._logger = logger.get_logger('src/whatsthatlight/logger.conf')
+
+    def test_shared_by_devices(self):
+        '''
+        The thread must run while at least one device acquired it.
+        '''
+        context = _Context()
+        event_thread = UsbEventThread(context, logger=self._logger)
+        self.assertIs(context, event_thread.get_context())
+        self.assertFalse(event_thread.running)
+        event_thread.acquire()
+        event_thread.acquire()
+        self.assertTrue(event_thread.running)
+        self.assertEqual(2, event_thread.get_users())
+        self.assertTrue(context.handling.wait(1))
+        event_thread.release()
+        self.assertTrue(event_thread.running)
+        event_thread.release()
+        self.assertFalse(event_thread.running)
+        handled = context.handled
+        threading.Event().wait(0.2)
+        self.assertEqual(handled, context.handled)
+        event_thread.release()
+        self.assertEqual(0, event_thread.get_users())
+
+    def test_handling_failed(self):
+        '''
+        The thread must keep handling events after handling failed.
+        '''
+        context = _Context(failures=1)
+        event_thread = UsbEventThread(context, logger=self._logger)
+        event_thread.acquire()
+        for _ in range(20):
+            if context.handled > 0:
+                break
+            threading.Event().wait(0.05)
+        event_thread.release()
+        self.assertEqual(0, context.failures)
+        self.assertTrue(context.handled > 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import time
+import unittest
+
+# Local imports
+from whatsthatlight.usb_topology import UsbTopologyIndex
+
+
+class _Bus(object):
+    '''
+    A bus of devices, keyed by (VID, PID), counting its scans.
+    '''
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.scans = []
+
+    def scan(self, vendor_id, product_id, serial_number):
+        self.scans.append((vendor_id, product_id, serial_number))
+        return self.devices.get((vendor_id, product_id))
+
+
+class Test(unittest.TestCase):
+    '''
+    USB topology index tests.
+    '''
+
+    def test_get_device(self):
+        '''
+        A device found must be got without scanning the bus again, until
+        invalidated.
+        '''
+        bus = _Bus({(0x16c0, 0x0486): 'teensy', (0x27b8, 0x01ed): 'blink1'})
+        index = UsbTopologyIndex(bus.scan)
+        self.assertEqual('teensy', index.get_device(0x16c0, 0x0486))
+        self.assertEqual('teensy', index.get_device(0x16c0, 0x0486))
+        self.assertEqual('blink1', index.get_device(0x27b8, 0x01ed))
+        self.assertEqual(2, index.get_scans())
+        self.assertEqual(1, index.get_hits())
+        bus.devices[(0x16c0, 0x0486)] = 'replugged'
+        index.invalidate(0x16c0, 0x0486)
+        self.assertEqual('replugged', index.get_device(0x16c0, 0x0486))
+        self.assertEqual('blink1', index.get_device(0x27b8, 0x01ed))
+        self.assertEqual(3, index.get_scans())
+        index.invalidate()
+        self.assertEqual('blink1', index.get_device(0x27b8, 0x01ed))
+        self.assertEqual(4, index.get_scans())
+
+    def test_serial_number(self):
+        '''
+        Devices must be indexed by serial number too.
+        '''
+        bus = _Bus({(0x16c0, 0x0486): 'teensy'})
+        index = UsbTopologyIndex(bus.scan)
+        index.get_device(0x16c0, 0x0486)
+        index.get_device(0x16c0, 0x0486, 'a1b2')
+        self.assertListEqual([(0x16c0, 0x0486, None),
+                              (0x16c0, 0x0486, 'a1b2')], bus.scans)
+
+    def test_device_not_found(self):
+        '''
+        A device not found must be remembered as absent until the period
+        expired or it was invalidated.
+        '''
+        bus = _Bus({})
+        index = UsbTopologyIndex(bus.scan, negative_ttl=0.1)
+        self.assertIsNone(index.get_device(0x16c0, 0x0486))
+        self.assertIsNone(index.get_device(0x16c0, 0x0486))
+        self.assertEqual(1, index.get_scans())
+        time.sleep(0.15)
+        self.assertIsNone(index.get_device(0x16c0, 0x0486))
+        self.assertEqual(2, index.get_scans())
+        bus.devices[(0x16c0, 0x0486)] = 'teensy'
+        index.invalidate(0x16c0, 0x0486)
+        self.assertEqual('teensy', index.get_device(0x16c0, 0x0486))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import importlib
+import logging
+import threading
+
+# Constants
+_EVENT_TIMEOUT = 0.1
+
+# The event thread shared by all asynchronous devices, once created
+_shared_event_thread = None
+_shared_event_thread_lock = threading.Lock()
+
+
+class UsbEventThread(object):
+    '''
+    A thread handling libusb's events for asynchronous transfers, i.e.
+    invoking their completion callbacks. Any number of devices can share
+    one: it runs while at least one device acquired it.
+    '''
+
+    def __init__(self,
+                 context=None,
+                 logger=logging.basicConfig()):
+        '''
+        Constructor.
+        :param context: the usb1.USBContext the devices are opened in; a new
+                        one if None
+        :param logger: local logger instance
+        '''
+        if context is None:
+            context = importlib.import_module('usb1').USBContext()
+        self._context = context
+        self._logger = logger
+        self._users = 0
+        self._thread = None
+        self._stop_event = None
+        self.running = False
+        self._runLock = threading.Lock()
+
+    def get_context(self):
+        '''
+        Get the libusb context handled.
+        '''
+        return self._context
+
+    def acquire(self):
+        '''
+        Start handling events for another device; the first one starts the
+        thread.
+        '''
+        with self._runLock:
+            self._users += 1
+            if self.running:
+                return
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._run,
+                                            args=(self._stop_event,))
+            self._thread.daemon = True
+            self.running = True
+            self._thread.start()
+
+    def release(self):
+        '''
+        Stop handling events for a device; the last one stops the thread.
+        '''
+        with self._runLock:
+            if self._users == 0:
+                return
+            self._users -= 1
+            if self._users > 0:
+                return
+            self.running = False
+            self._stop_event.set()
+            thread = self._thread
+            self._thread = None
+        if not thread is threading.current_thread():
+            thread.join()
+
+    def get_users(self):
+        '''
+        Get the number of devices using the thread.
+        '''
+        return self._users
+
+    def _run(self, stop_event):
+        '''
+        Handle events until stopped.
+        :param stop_event: the event set to stop this thread
+        '''
+        while not stop_event.is_set():
+            try:
+                self._context.handleEventsTimeout(_EVENT_TIMEOUT)
+            except Exception, e:
+                self._logger.error('Handling USB events failed: {0}'.
+                                   format(e))
+                stop_event.wait(_EVENT_TIMEOUT)
+
+
+def get_shared_event_thread(logger=logging.basicConfig()):
+    '''
+    Get the event thread shared by all asynchronous devices, creating it
+    (and its libusb context) on first use.
+    :param logger: local logger instance
+    '''
+    global _shared_event_thread
+    with _shared_event_thread_lock:
+        if _shared_event_thread is None:
+            _shared_event_thread = UsbEventThread(logger=logger)
+        return _shared_event_thread
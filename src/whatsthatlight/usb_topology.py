@@ -0,0 +1,132 @@
+#Copyright 2013 Pieter Rautenbach
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# System imports
+import importlib
+import threading
+import time
+
+# Constants (in seconds)
+_NEGATIVE_TTL = 5
+
+# The index shared by all devices and monitors, once created
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+
+class UsbTopologyIndex(object):
+    '''
+    An index of the USB devices found, keyed by (VID, PID, serial number),
+    so that opening a device does not scan the whole bus every time. A
+    device found stays indexed until invalidated, e.g. by a hotplug event
+    or a failed transfer; a device not found is remembered as absent for a
+    while, so that polling for it does not scan the bus every time either.
+    '''
+
+    def __init__(self,
+                 scan=None,
+                 negative_ttl=_NEGATIVE_TTL):
+        '''
+        Constructor.
+        :param scan: a method scanning the bus for a device, taking the VID,
+                     PID and serial number (None for any) and returning the
+                     device or None; PyUSB's usb.core.find if None
+        :param negative_ttl: the period in seconds that a device not found
+                             is remembered as absent
+        '''
+        if scan is None:
+            scan = _pyusb_scan
+        self._scan = scan
+        self._negative_ttl = negative_ttl
+        # (VID, PID, serial) to (device or None, time indexed)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._scans = 0
+
+    def get_device(self, vendor_id, product_id, serial_number=None):
+        '''
+        Get a device, scanning the bus only if not indexed; None if not
+        found.
+        :param vendor_id: the device's VID
+        :param product_id: the device's PID
+        :param serial_number: the device's serial number; any if None
+        '''
+        key = (vendor_id, product_id, serial_number)
+        with self._lock:
+            entry = self._entries.get(key)
+            if (not entry is None and
+                    (not entry[0] is None or
+                     time.time() - entry[1] < self._negative_ttl)):
+                self._hits += 1
+                return entry[0]
+            self._scans += 1
+            device = self._scan(vendor_id, product_id, serial_number)
+            self._entries[key] = (device, time.time())
+            return device
+
+    def invalidate(self, vendor_id=None, product_id=None):
+        '''
+        Forget the devices with a VID and PID, e.g. when one was added or
+        removed, so that getting one scans the bus again.
+        :param vendor_id: the devices' VID; all devices if None
+        :param product_id: the devices' PID; all devices if None
+        '''
+        with self._lock:
+            for key in self._entries.keys():
+                if ((vendor_id is None or key[0] == vendor_id) and
+                        (product_id is None or key[1] == product_id)):
+                    del self._entries[key]
+
+    def get_hits(self):
+        '''
+        Get the number of devices got without scanning the bus.
+        '''
+        return self._hits
+
+    def get_scans(self):
+        '''
+        Get the number of bus scans.
+        '''
+        return self._scans
+
+
+def get_shared_index():
+    '''
+    Get the index shared by all devices and monitors, creating it on first
+    use.
+    '''
+    global _shared_index
+    with _shared_index_lock:
+        if _shared_index is None:
+            _shared_index = UsbTopologyIndex()
+        return _shared_index
+
+
+def _pyusb_scan(vendor_id, product_id, serial_number):
+    '''
+    Scan the bus for a device with PyUSB.
+    :param vendor_id: the device's VID
+    :param product_id: the device's PID
+    :param serial_number: the device's serial number; any if None
+    '''
+    usb = importlib.import_module('usb')
+    custom_match = None
+    if not serial_number is None:
+        def custom_match(device):
+            return (usb.util.get_string(device, device.iSerialNumber) ==
+                    serial_number)
+    return usb.core.find(idVendor=vendor_id,
+                         idProduct=product_id,
+                         custom_match=custom_match)